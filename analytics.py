@@ -0,0 +1,169 @@
+# --- START OF FILE analytics.py ---
+# Query helpers for the columnar export written by analytics_export.py.
+# Every report loads only the columns it needs (and only the month partitions in the requested
+# date range) and aggregates with vectorized pyarrow / NumPy operations - no per-row Python loops
+# and no queries against the production database.
+#
+#   import analytics
+#   analytics.bookings_per_day('analytics_data', by='specialization', start=date(2025, 1, 1))
+#   analytics.cancellation_rate('analytics_data', by='governorate')
+#   analytics.rating_distribution('analytics_data', by='doctor_id')
+#
+#   python analytics.py bookings-per-day --by governorate --start 2025-01-01
+#
+# Reports return pyarrow Tables (call .to_pylist() or .to_pandas() as needed).
+
+# --- Standard Library Imports ---
+import argparse                 # Command-line options for the report CLI.
+import glob                     # Detects whether an export is Parquet or Arrow.
+import os                       # Paths.
+import sys                      # Exit code.
+from datetime import date       # Date range arguments.
+
+# --- Third-Party Imports ---
+import numpy as np              # bincount-based grouped counts.
+import pyarrow as pa            # Tables and arrays.
+import pyarrow.compute as pc    # Vectorized comparisons.
+import pyarrow.dataset as ds    # Partition-pruned reads.
+
+# --- Local Module Imports ---
+from analytics_export import ANALYTICS_DIR # Default export directory.
+
+# Doctor attributes a report can be grouped by (joined from the doctors table).
+DOCTOR_DIMENSIONS = ('specialization', 'governorate', 'province', 'facility_type', 'plc')
+
+
+# --- Loading ---
+
+# Opens one exported table as a pyarrow dataset.
+def open_dataset(root, name):
+    """Returns a dataset for `<root>/<name>`, detecting Parquet vs Arrow files and hive month partitions."""
+    path = os.path.join(root, name)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No exported '{name}' data under {root}. Run analytics_export.py first.")
+    file_format = 'ipc' if glob.glob(os.path.join(path, '**', '*.arrow'), recursive=True) else 'parquet'
+    return ds.dataset(path, format=file_format, partitioning='hive')
+
+# Reads selected columns of a table, optionally restricted to a date range on `date_column`.
+def load(root, name, columns, date_column=None, start=None, end=None):
+    """Reads `columns` from `<root>/<name>`. `start`/`end` (inclusive dates) prune month partitions and filter rows."""
+    dataset = open_dataset(root, name)
+    condition = None
+    # Month bounds let the reader skip whole partitions; the column filter trims the edge months.
+    if start is not None:
+        condition = (ds.field('month') >= start.strftime('%Y-%m')) & (ds.field(date_column) >= pa.scalar(start))
+    if end is not None:
+        upper = (ds.field('month') <= end.strftime('%Y-%m')) & (ds.field(date_column) <= pa.scalar(end))
+        condition = upper if condition is None else condition & upper
+    return dataset.to_table(columns=columns, filter=condition)
+
+# Adds a doctor attribute column (e.g. specialization) to a table that has doctor_id.
+def with_doctor_dimension(root, table, dimension):
+    """Left-joins `dimension` from the doctors table on doctor_id (no-op for doctor_id or None)."""
+    if dimension in (None, 'doctor_id'):
+        return table
+    if dimension not in DOCTOR_DIMENSIONS:
+        raise ValueError(f"Unknown grouping '{dimension}'. Use doctor_id or one of: {', '.join(DOCTOR_DIMENSIONS)}.")
+    doctors = open_dataset(root, 'doctors').to_table(columns=['id', dimension])
+    return table.join(doctors, keys='doctor_id', right_keys='id', join_type='left outer')
+
+# Encodes a grouping column as dense integer codes.
+def group_codes(column):
+    """Returns (codes, labels): codes[i] indexes labels for row i. Nulls get their own 'None' label."""
+    encoded = pc.dictionary_encode(column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column)
+    labels = encoded.dictionary.to_pylist()
+    # Null keys (e.g. a doctor missing from the doctors table) are counted under an extra label.
+    codes = encoded.indices.fill_null(len(labels)).to_numpy(zero_copy_only=False).astype(np.int64)
+    if (codes == len(labels)).any(): labels.append(None)
+    return codes, labels
+
+
+# --- Reports ---
+
+# Number of bookings per appointment day, optionally split by doctor or doctor attribute.
+def bookings_per_day(root=ANALYTICS_DIR, by=None, start=None, end=None, statuses=None):
+    """Returns a table of (booking_date, [by], bookings) sorted by date. `statuses` limits which statuses count."""
+    table = load(root, 'bookings', ['booking_date', 'doctor_id', 'status'], 'booking_date', start, end)
+    if statuses:
+        table = table.filter(pc.is_in(table['status'], value_set=pa.array(list(statuses))))
+    table = with_doctor_dimension(root, table, by)
+    keys = ['booking_date'] + ([by] if by else [])
+    # Count every row (mode='all' includes null statuses); select() pins the column order across pyarrow versions.
+    counts = table.group_by(keys).aggregate([('status', 'count', pc.CountOptions(mode='all'))])
+    counts = counts.select(keys + ['status_count']).rename_columns(keys + ['bookings'])
+    return counts.sort_by([(key, 'ascending') for key in keys])
+
+# Share of bookings that were cancelled, per group.
+def cancellation_rate(root=ANALYTICS_DIR, by='doctor_id', start=None, end=None):
+    """Returns a table of ([by], bookings, cancelled, cancellation_rate). by=None gives one overall row."""
+    table = with_doctor_dimension(root, load(root, 'bookings', ['booking_date', 'doctor_id', 'status'], 'booking_date', start, end), by)
+    # Boolean mask of cancelled rows as 0/1 weights.
+    cancelled_mask = pc.fill_null(pc.equal(table['status'], 'Cancelled'), False).to_numpy(zero_copy_only=False).astype(np.float64)
+    if by is None:
+        codes, labels = np.zeros(table.num_rows, dtype=np.int64), ['all']
+    else:
+        codes, labels = group_codes(table[by])
+    # One pass each: total rows per group and cancelled rows per group.
+    totals = np.bincount(codes, minlength=len(labels))
+    cancelled = np.bincount(codes, weights=cancelled_mask, minlength=len(labels)).astype(np.int64)
+    rates = np.divide(cancelled, totals, out=np.zeros(len(labels)), where=totals > 0)
+    return pa.table({by or 'group': labels, 'bookings': totals, 'cancelled': cancelled, 'cancellation_rate': np.round(rates, 4)}) \
+        .sort_by([('bookings', 'descending')])
+
+# Count of 1..5 star reviews per group, plus totals and average.
+def rating_distribution(root=ANALYTICS_DIR, by=None, start=None, end=None, approved_only=True):
+    """Returns a table of ([by], stars_1..stars_5, reviews, average_rating). Only approved reviews by default."""
+    table = load(root, 'reviews', ['doctor_id', 'rating', 'is_approved', 'created_at'])
+    if approved_only:
+        table = table.filter(pc.equal(table['is_approved'], 1))
+    if start is not None or end is not None:
+        # Compare on the calendar day of created_at (UTC).
+        created_day = pc.cast(table['created_at'], pa.date32())
+        in_range = pc.and_(pc.greater_equal(created_day, pa.scalar(start or date.min)), pc.less_equal(created_day, pa.scalar(end or date.max)))
+        table = table.filter(in_range)
+    # Ignore ratings outside 1..5 (the database CHECK should prevent them anyway).
+    table = table.filter(pc.and_(pc.greater_equal(table['rating'], 1), pc.less_equal(table['rating'], 5)))
+    table = with_doctor_dimension(root, table, by)
+    if by is None:
+        codes, labels = np.zeros(table.num_rows, dtype=np.int64), ['all']
+    else:
+        codes, labels = group_codes(table[by])
+    ratings = table['rating'].to_numpy().astype(np.int64)
+    # A single bincount over (group, star) pairs gives the whole group x 5 histogram.
+    histogram = np.bincount(codes * 5 + (ratings - 1), minlength=len(labels) * 5).reshape(len(labels), 5)
+    reviews = histogram.sum(axis=1)
+    averages = np.divide(histogram @ np.arange(1, 6), reviews, out=np.zeros(len(labels)), where=reviews > 0)
+    columns = {by or 'group': labels}
+    columns.update({f"stars_{star}": histogram[:, star - 1] for star in range(1, 6)})
+    columns.update({'reviews': reviews, 'average_rating': np.round(averages, 2)})
+    return pa.table(columns).sort_by([('reviews', 'descending')])
+
+
+# --- Command Line ---
+
+REPORTS = {'bookings-per-day': bookings_per_day, 'cancellation-rate': cancellation_rate, 'rating-distribution': rating_distribution}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a report over the analytics export.")
+    parser.add_argument('report', choices=sorted(REPORTS), help="Report to run")
+    parser.add_argument('--root', default=ANALYTICS_DIR, help=f"Export directory (default: {ANALYTICS_DIR})")
+    parser.add_argument('--by', help=f"Group by doctor_id or one of: {', '.join(DOCTOR_DIMENSIONS)}")
+    parser.add_argument('--start', type=date.fromisoformat, help="First day (YYYY-MM-DD)")
+    parser.add_argument('--end', type=date.fromisoformat, help="Last day (YYYY-MM-DD)")
+    parser.add_argument('--limit', type=int, default=50, help="Rows to print (default: 50)")
+    args = parser.parse_args(argv)
+    kwargs = {'start': args.start, 'end': args.end}
+    if args.by or args.report != 'cancellation-rate': kwargs['by'] = args.by
+    result = REPORTS[args.report](args.root, **kwargs)
+    # Plain tab-separated output so it pipes into other tools.
+    print('\t'.join(result.column_names))
+    for row in result.slice(0, args.limit).to_pylist():
+        print('\t'.join('' if v is None else str(v) for v in row.values()))
+    if result.num_rows > args.limit: print(f"... {result.num_rows - args.limit} more row(s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# --- END OF FILE analytics.py ---
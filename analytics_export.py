@@ -0,0 +1,214 @@
+# --- START OF FILE analytics_export.py ---
+# Columnar analytics export: streams `bookings` (plus `bookings_archive`), `reviews` and `doctors`
+# out of Supabase into Parquet or Arrow IPC files that analysts query locally with analytics.py,
+# instead of running ad-hoc scans against the production database.
+#
+#   python analytics_export.py                          # Parquet into ./analytics_data
+#   python analytics_export.py --format arrow --out /data/clinic_analytics
+#   python analytics_export.py --no-archive --page-size 2000
+#
+# Layout (hive-style partitions, one directory per month):
+#   <out>/bookings/month=2025-04/part-0.parquet   (partitioned by booking_date month)
+#   <out>/reviews/month=2025-04/part-0.parquet    (partitioned by created_at month)
+#   <out>/doctors/doctors.parquet                 (small dimension table, not partitioned)
+#
+# Tables are read page by page with keyset pagination (id > last id) and written as a stream of
+# record batches, so memory stays at about one page. Patient/reviewer names, phones, notes and
+# tracking columns (IP, cookie, fingerprint) are not exported.
+
+# --- Standard Library Imports ---
+import argparse                 # Command-line options.
+import os                       # Environment variables and paths.
+import shutil                   # Clears a table's previous export.
+import sys                      # Exit code and stderr output.
+import time                     # Timing for the summary line.
+import traceback                # Detailed error output.
+from datetime import date, datetime, timezone # Parsing Supabase date/timestamp strings.
+
+# --- Third-Party Imports ---
+import pyarrow as pa            # Columnar arrays, schemas and record batches.
+import pyarrow.dataset as ds    # Partitioned dataset writer.
+import pyarrow.feather as feather # Arrow IPC writer for the doctors file.
+import pyarrow.parquet as pq    # Parquet writer for the doctors file.
+from dotenv import load_dotenv  # Loads SUPABASE_URL / SUPABASE_KEY from .env, like app.py.
+from supabase import create_client # Supabase client.
+
+# --- Local Module Imports ---
+import archive                  # Name of the bookings archive table.
+
+# --- Configuration ---
+# Default output directory.
+ANALYTICS_DIR = 'analytics_data'
+# Rows fetched per Supabase request (and per record batch written). PostgREST caps responses at 1000 rows by default.
+EXPORT_PAGE_SIZE = 1000
+# --- End Configuration ---
+
+# Columns exported per table and their Arrow types. `month` is derived and used as the partition key.
+BOOKINGS_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('doctor_id', pa.int64()), ('booking_date', pa.date32()), ('booking_time', pa.string()),
+    ('appointment_type', pa.string()), ('status', pa.string()), ('user_id', pa.int64()),
+    ('created_at', pa.timestamp('us', tz='UTC')), ('archived', pa.bool_()), ('month', pa.string()),
+])
+REVIEWS_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('doctor_id', pa.int64()), ('rating', pa.int8()), ('is_approved', pa.int8()),
+    ('created_at', pa.timestamp('us', tz='UTC')), ('month', pa.string()),
+])
+DOCTORS_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('name', pa.string()), ('specialization', pa.string()), ('governorate', pa.string()),
+    ('province', pa.string()), ('facility_type', pa.string()), ('plc', pa.string()), ('rate', pa.float64()),
+])
+
+
+# --- Value Parsing ---
+
+# Parses a 'YYYY-MM-DD' string (or None) into a date.
+def parse_date(value):
+    try: return date.fromisoformat(value[:10]) if value else None
+    except ValueError: return None
+
+# Parses a Supabase timestamp string into an aware UTC datetime (naive values are assumed UTC).
+def parse_timestamp(value):
+    if not value: return None
+    try: parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError: return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+# Returns the 'YYYY-MM' partition value for a date/datetime ('unknown' when missing).
+def month_key(value):
+    return value.strftime('%Y-%m') if value else 'unknown'
+
+
+# --- Row Conversion (Supabase JSON rows -> Arrow record batches) ---
+
+# Builds a bookings record batch from one page of rows.
+def bookings_batch(rows, archived):
+    booking_dates = [parse_date(r.get('booking_date')) for r in rows]
+    return pa.RecordBatch.from_pydict({
+        'id': [r.get('id') for r in rows],
+        'doctor_id': [r.get('doctor_id') for r in rows],
+        'booking_date': booking_dates,
+        'booking_time': [r.get('booking_time') for r in rows],
+        'appointment_type': [r.get('appointment_type') for r in rows],
+        'status': [r.get('status') for r in rows],
+        'user_id': [r.get('user_id') for r in rows],
+        'created_at': [parse_timestamp(r.get('created_at')) for r in rows],
+        'archived': [archived] * len(rows),
+        'month': [month_key(d) for d in booking_dates],
+    }, schema=BOOKINGS_SCHEMA)
+
+# Builds a reviews record batch from one page of rows.
+def reviews_batch(rows):
+    created = [parse_timestamp(r.get('created_at')) for r in rows]
+    return pa.RecordBatch.from_pydict({
+        'id': [r.get('id') for r in rows],
+        'doctor_id': [r.get('doctor_id') for r in rows],
+        'rating': [r.get('rating') for r in rows],
+        'is_approved': [int(r['is_approved']) if r.get('is_approved') is not None else None for r in rows],
+        'created_at': created,
+        'month': [month_key(c) for c in created],
+    }, schema=REVIEWS_SCHEMA)
+
+
+# --- Supabase Reading ---
+
+# Yields pages of rows from a Supabase table using keyset pagination on id.
+def fetch_pages(supabase, table_name, columns, page_size=EXPORT_PAGE_SIZE):
+    """Yields lists of row dicts, up to `page_size` at a time, ordered by id (no OFFSET scans).
+
+    Stops only on an empty page: the server may return fewer rows than asked for (its max-rows cap),
+    so a short page does not mean the table is exhausted.
+    """
+    last_id = None
+    while True:
+        query = supabase.table(table_name).select(columns).order('id', desc=False).limit(page_size)
+        if last_id is not None: query = query.gt('id', last_id)
+        rows = query.execute().data or []
+        if not rows: break
+        yield rows
+        last_id = rows[-1]['id']
+
+
+# --- Writing ---
+
+# Writes a stream of record batches as a month-partitioned dataset under `<out>/<name>/`.
+def write_partitioned(batches, schema, out_dir, name, file_format):
+    """Replaces `<out_dir>/<name>` with a hive-partitioned (month=YYYY-MM) dataset. Returns rows written."""
+    target = os.path.join(out_dir, name)
+    # A full export replaces the previous one so deleted/archived rows don't linger in old partitions.
+    shutil.rmtree(target, ignore_errors=True)
+    counted = {'rows': 0}
+    # Count rows as they stream past.
+    def counting(batches):
+        for batch in batches:
+            counted['rows'] += batch.num_rows
+            yield batch
+    ds.write_dataset(counting(batches), target, schema=schema, format='parquet' if file_format == 'parquet' else 'ipc',
+                     partitioning=ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive'),
+                     basename_template='part-{i}.' + ('parquet' if file_format == 'parquet' else 'arrow'),
+                     existing_data_behavior='overwrite_or_ignore')
+    return counted['rows']
+
+# Exports bookings (and optionally the archive) to `<out>/bookings`.
+def export_bookings(supabase, out_dir, file_format, page_size=EXPORT_PAGE_SIZE, include_archive=True):
+    columns = 'id, doctor_id, booking_date, booking_time, appointment_type, status, user_id, created_at'
+    # Hot table first, then the archive, flagged so reports can tell them apart.
+    def batches():
+        for table_name in archive.booking_tables(include_archive):
+            for rows in fetch_pages(supabase, table_name, columns, page_size):
+                yield bookings_batch(rows, archived=(table_name == archive.ARCHIVE_TABLE))
+    return write_partitioned(batches(), BOOKINGS_SCHEMA, out_dir, 'bookings', file_format)
+
+# Exports reviews to `<out>/reviews`.
+def export_reviews(supabase, out_dir, file_format, page_size=EXPORT_PAGE_SIZE):
+    batches = (reviews_batch(rows) for rows in fetch_pages(supabase, 'reviews', 'id, doctor_id, rating, is_approved, created_at', page_size))
+    return write_partitioned(batches, REVIEWS_SCHEMA, out_dir, 'reviews', file_format)
+
+# Exports the doctors dimension table to a single file.
+def export_doctors(supabase, out_dir, file_format, page_size=EXPORT_PAGE_SIZE):
+    columns = ', '.join(DOCTORS_SCHEMA.names)
+    rows = [row for page in fetch_pages(supabase, 'doctors', columns, page_size) for row in page]
+    table = pa.Table.from_pylist(rows, schema=DOCTORS_SCHEMA)
+    target = os.path.join(out_dir, 'doctors')
+    shutil.rmtree(target, ignore_errors=True); os.makedirs(target)
+    if file_format == 'parquet': pq.write_table(table, os.path.join(target, 'doctors.parquet'))
+    else: feather.write_feather(table, os.path.join(target, 'doctors.arrow'))
+    return table.num_rows
+
+
+# --- Command Line ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export bookings, reviews and doctors from Supabase to month-partitioned Parquet/Arrow files.")
+    parser.add_argument('--out', default=ANALYTICS_DIR, help=f"Output directory (default: {ANALYTICS_DIR})")
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet', help="File format (default: parquet)")
+    parser.add_argument('--page-size', type=int, default=EXPORT_PAGE_SIZE, help=f"Rows per Supabase request (default: {EXPORT_PAGE_SIZE})")
+    parser.add_argument('--no-archive', action='store_true', help=f"Skip {archive.ARCHIVE_TABLE} (hot bookings only)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    supabase_url = os.environ.get("SUPABASE_URL"); supabase_key = os.environ.get("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        print("ERROR (analytics_export): SUPABASE_URL and SUPABASE_KEY must be set in the .env file", file=sys.stderr)
+        return 2
+    supabase = create_client(supabase_url, supabase_key)
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        started = time.perf_counter()
+        counts = {
+            'doctors': export_doctors(supabase, args.out, args.format, args.page_size),
+            'bookings': export_bookings(supabase, args.out, args.format, args.page_size, include_archive=not args.no_archive),
+            'reviews': export_reviews(supabase, args.out, args.format, args.page_size),
+        }
+    except Exception as e:
+        print(f"ERROR (analytics_export): Export failed: {e}", file=sys.stderr); traceback.print_exc()
+        return 1
+    print(f"INFO (analytics_export): Wrote {counts} to {args.out} ({args.format}) in {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# --- END OF FILE analytics_export.py ---
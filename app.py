@@ -13,14 +13,18 @@ import uuid                     # Potentially for generating unique IDs, though
 from flask import (
     Flask,                  # The core Flask class to create the web application instance.
     render_template,        # Function to render HTML templates.
+    stream_template,        # Function to render a template as a streamed (chunked) response.
     # json, -> Duplicate, already imported above. Standard library 'json' is usually preferred.
     request,                # Object to access incoming request data (forms, query parameters, JSON).
     redirect,               # Function to redirect the user's browser to a different URL.
     url_for,                # Function to generate URLs for Flask routes dynamically.
     send_from_directory,    # Function to send a static file from a directory (not used here, but common).
     flash,                  # Function to display temporary messages (flashes) to the user.
+    get_flashed_messages,   # Pops flashed messages (the streamed home page pops them before streaming).
     jsonify,                # Function to create a JSON response.
-    make_response           # Function to create a custom Flask response object (e.g., to set headers).
+    after_this_request,     # Registers a callback run on the response of the current request.
+    make_response,          # Function to create a custom Flask response object (e.g., to set headers).
+    session                 # Signed-cookie session (carries the browser's slot-hold token).
 )
 # REMOVED: import sqlite3 -> Comment indicating SQLite3 is no longer needed as Supabase is used.
 from flask_login import (
@@ -30,6 +34,24 @@ from flask_login import (
 )
 from supabase import create_client, Client # Imports Supabase client factory and type hint.
 from dotenv import load_dotenv        # Function to load environment variables from a `.env` file.
+from werkzeug.middleware.proxy_fix import ProxyFix # Takes the client IP from X-Forwarded-For behind a reverse proxy.
+
+# --- Local Module Imports ---
+from jobs import JobQueue             # In-process background job queue (worker threads + optional SQLite spool).
+import reminders                      # Appointment reminder scheduler (claims due bookings, pluggable senders).
+import sweeper                        # Booking lifecycle sweeper (expires/completes stale Pending bookings in chunks).
+import archive                        # Cold-storage archival of old bookings (bookings -> bookings_archive).
+import rating_stats                   # Vectorized doctor rating stats (counts, averages, smoothed averages, histograms).
+import ranking                        # Precomputed doctor rank scores (decayed Bayesian rating + next-slot proximity).
+import slot_index as slot_schedules   # Effective schedules (weekly availability + date exceptions) and their loaders.
+from slot_index import SlotIndex      # In-memory index of every doctor's next available slot.
+from slot_bitmap import slot_bit      # Parses "HH:MM" slot/time strings onto the slot bitmap grid.
+import holds                          # Short-lived slot holds (in-memory or Supabase-backed store).
+import idempotency                    # Idempotency keys for /confirm-booking (replays the result of duplicate submits).
+import ratelimit                      # Token-bucket rate limiting keyed on IP, device cookie and fingerprint.
+import patients                       # Patient identity: one lookup/filter instead of separate name and phone queries.
+import moderation                     # Background review moderation (spam/profanity heuristics, incremental summaries).
+import review_feed                    # Keyset-paginated feed of a doctor's approved reviews (booking page + JSON API).
 
 # --- Environment Variable Loading ---
 load_dotenv() # Executes the function to load variables from a `.env` file into the environment.
@@ -63,6 +85,10 @@ else:
 # __name__ helps Flask locate templates and static files relative to this script.
 # static_folder='static' explicitly sets the folder for static files (CSS, JS, images).
 app = Flask(__name__, static_folder='static')
+# Behind PROXY_HOPS trusted reverse proxies (1 on Render, set in render.yaml), take request.remote_addr from X-Forwarded-For so
+# per-IP rate limits see the patient's address rather than the proxy's. 0 (default) trusts no forwarded headers.
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS > 0: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
 
 # --- Flask Secret Key Configuration ---
 # Sets the secret key for the Flask application, required for session management and flash messages.
@@ -102,6 +128,256 @@ def load_user(user_id):
     return None
 # --- End Login Manager Setup ---
 
+# --- Background Job Queue Setup ---
+# Non-critical work (analytics, notifications, cache warming) is enqueued here instead of running inside the request.
+# JOB_WORKERS sets the worker thread count; JOB_SPOOL_PATH (optional) enables the SQLite spool so queued jobs survive restarts.
+job_queue = JobQueue(
+    num_workers=int(os.environ.get('JOB_WORKERS', 2)),  # Number of worker threads per app process.
+    spool_path=os.environ.get('JOB_SPOOL_PATH') or None, # e.g. 'database/jobs_spool.db'; unset = in-memory only.
+    lease_seconds=int(os.environ.get('JOB_LEASE_SECONDS', 900)) # Spooled jobs older than this are re-run by a restarting process.
+)
+
+# Job handler: runs after a booking is confirmed (post-booking side work lives here, off the request path).
+@job_queue.register('booking_confirmed')
+def on_booking_confirmed(booking_id, doctor_id, booking_date, booking_time):
+    # Record the booking for analytics (console log for now; extend with notifications, cache warming, etc.).
+    print(f"ANALYTICS: Booking {booking_id} confirmed for Dr {doctor_id} on {booking_date} at {booking_time}.")
+    # The slot is taken now: update the doctor's next available slot in place.
+    slot_index.mark_booked(doctor_id, booking_date, booking_time)
+    # The booked slot may have been the doctor's next free one: refresh their rank score.
+    schedule_rerank(doctor_id)
+# --- End Background Job Queue Setup ---
+
+# --- Appointment Reminder Scheduler Setup ---
+# Every REMINDER_INTERVAL_SECONDS (0 = disabled) a 'reminder_tick' job claims Pending bookings starting in the
+# next REMINDER_HOURS_AHEAD hours and enqueues them in 'send_reminders' batches. Requires migrations/001 and 014.
+# A batch lost before sending (process died) is claimed again after reminders.REMINDER_CLAIM_LEASE_MINUTES.
+REMINDER_INTERVAL_SECONDS = int(os.environ.get('REMINDER_INTERVAL_SECONDS', 0))
+REMINDER_HOURS_AHEAD = int(os.environ.get('REMINDER_HOURS_AHEAD', 24))
+# Pluggable sender: 'file' appends to a local JSONL outbox (default), 'log' prints to the console.
+if os.environ.get('REMINDER_SENDER', 'file') == 'log':
+    reminder_sender = reminders.LogSender()
+else:
+    reminder_sender = reminders.FileSinkSender(os.environ.get('REMINDER_SINK_PATH', 'database/reminders_outbox.jsonl'))
+
+# Job handler: one scheduler tick. Claims due bookings and fans them out as send batches.
+@job_queue.register('reminder_tick')
+def reminder_tick():
+    reminders.run_reminder_tick(supabase, lambda batch: job_queue.enqueue('send_reminders', bookings=batch),
+                                hours_ahead=REMINDER_HOURS_AHEAD)
+
+# Job handler: sends the reminders for one claimed batch of bookings.
+@job_queue.register('send_reminders')
+def send_reminders(bookings):
+    sent, failed = reminders.send_reminder_batch(supabase, reminder_sender, bookings)
+    print(f"INFO: Reminder batch done. Sent: {sent}. Failed (will retry): {failed}.")
+
+# Start the periodic tick if enabled.
+if REMINDER_INTERVAL_SECONDS > 0:
+    job_queue.every(REMINDER_INTERVAL_SECONDS, 'reminder_tick')
+# --- End Appointment Reminder Scheduler Setup ---
+
+# --- Booking Lifecycle Sweeper Setup ---
+# Every SWEEP_INTERVAL_SECONDS (0 = disabled) Pending bookings that started more than SWEEP_GRACE_HOURS ago
+# are moved to 'Expired' (SWEEP_POLICY=expire, default) or 'Completed' (SWEEP_POLICY=complete). Requires migrations/001-002.
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('SWEEP_INTERVAL_SECONDS', 0))
+SWEEP_POLICY = os.environ.get('SWEEP_POLICY', 'expire')
+SWEEP_GRACE_HOURS = int(os.environ.get('SWEEP_GRACE_HOURS', 24))
+
+# Job handler: one sweep run (chunked UPDATEs; logs the number of bookings it processed).
+@job_queue.register('sweep_bookings')
+def sweep_bookings():
+    sweeper.sweep_stale_bookings(supabase, policy=SWEEP_POLICY, grace_hours=SWEEP_GRACE_HOURS)
+
+# Start the periodic sweep if enabled.
+if SWEEP_INTERVAL_SECONDS > 0:
+    job_queue.every(SWEEP_INTERVAL_SECONDS, 'sweep_bookings')
+# --- End Booking Lifecycle Sweeper Setup ---
+
+# --- Booking Archival Setup ---
+# Every ARCHIVE_INTERVAL_SECONDS (0 = disabled) bookings older than ARCHIVE_HORIZON_DAYS, and cancelled bookings older
+# than ARCHIVE_CANCELLED_AFTER_DAYS, are moved to 'bookings_archive'. Requires migrations/001 and 003.
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 0))
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', 365))
+ARCHIVE_CANCELLED_AFTER_DAYS = int(os.environ.get('ARCHIVE_CANCELLED_AFTER_DAYS', 10))
+
+# Job handler: one archival run (chunked moves; logs the number of bookings archived).
+@job_queue.register('archive_bookings')
+def archive_bookings():
+    archive.archive_old_bookings(supabase, horizon_days=ARCHIVE_HORIZON_DAYS, cancelled_after_days=ARCHIVE_CANCELLED_AFTER_DAYS)
+
+# Start the periodic archival if enabled.
+if ARCHIVE_INTERVAL_SECONDS > 0:
+    job_queue.every(ARCHIVE_INTERVAL_SECONDS, 'archive_bookings')
+# --- End Booking Archival Setup ---
+
+# --- Doctor Ranking Setup ---
+# Every RANK_INTERVAL_SECONDS (0 = disabled) all doctors' rank scores are recomputed into 'doctor_rankings'.
+# While enabled, a doctor is also re-ranked right after a review, booking or cancellation. Requires migrations/004.
+RANK_INTERVAL_SECONDS = int(os.environ.get('RANK_INTERVAL_SECONDS', 0))
+RANKING_ENABLED = RANK_INTERVAL_SECONDS > 0
+
+# Job handler: recomputes rank scores (doctor_ids=None means every doctor).
+@job_queue.register('rerank_doctors')
+def rerank_doctors(doctor_ids=None):
+    ranking.refresh_rank_scores(supabase, doctor_ids)
+
+# Queues an incremental re-rank for one doctor (no-op when ranking is disabled).
+def schedule_rerank(doctor_id):
+    if RANKING_ENABLED and doctor_id: job_queue.enqueue('rerank_doctors', doctor_ids=[doctor_id])
+
+# Start the periodic full refresh if enabled (plus one right away so scores exist after a deploy).
+if RANKING_ENABLED:
+    job_queue.enqueue('rerank_doctors')
+    job_queue.every(RANK_INTERVAL_SECONDS, 'rerank_doctors')
+# --- End Doctor Ranking Setup ---
+
+# --- Next Available Slot Index Setup ---
+# Every doctor's earliest open slot (next SLOT_INDEX_HORIZON_DAYS) is kept in memory: built on first use from one doctors
+# query plus one bulk fetch of upcoming bookings, updated in place on booking/cancel/completion, and rebuilt every
+# SLOT_INDEX_REFRESH_SECONDS (0 = never) to pick up schedule edits and bookings made by other app processes.
+SLOT_INDEX_REFRESH_SECONDS = int(os.environ.get('SLOT_INDEX_REFRESH_SECONDS', 600))
+slot_index = SlotIndex(horizon_days=int(os.environ.get('SLOT_INDEX_HORIZON_DAYS', 90)))
+
+# Job handler: full rebuild of the slot index.
+@job_queue.register('rebuild_slot_index')
+def rebuild_slot_index():
+    slot_index.rebuild(supabase)
+
+# Job handler: reloads one doctor's schedule and bookings into the slot index.
+@job_queue.register('refresh_doctor_slots')
+def refresh_doctor_slots(doctor_id):
+    slot_index.refresh_doctor(supabase, doctor_id)
+
+# Start the periodic rebuild if enabled.
+if SLOT_INDEX_REFRESH_SECONDS > 0:
+    job_queue.every(SLOT_INDEX_REFRESH_SECONDS, 'rebuild_slot_index')
+# --- End Next Available Slot Index Setup ---
+
+# --- Slot Hold Setup ---
+# Picking a time on the booking page holds that slot for SLOT_HOLD_TTL_SECONDS: other patients stop seeing it and
+# /confirm-booking turns them away before its validation queries. HOLD_STORE='memory' (default) keeps holds in this
+# process (fine for a single app process); HOLD_STORE='supabase' shares them across processes (requires migrations/006).
+SLOT_HOLD_TTL_SECONDS = int(os.environ.get('SLOT_HOLD_TTL_SECONDS', holds.HOLD_TTL_SECONDS))
+HOLD_STORE = os.environ.get('HOLD_STORE', 'memory').lower()
+# Live holds one device cookie / one IP address may have at once (a client dropping its session cookie gets a new
+# hold token, so the one-slot-per-token rule alone doesn't stop it from holding a doctor's whole day).
+SLOT_HOLDS_PER_DEVICE = int(os.environ.get('SLOT_HOLDS_PER_DEVICE', 2))
+SLOT_HOLDS_PER_IP = int(os.environ.get('SLOT_HOLDS_PER_IP', 8))
+slot_holds = holds.SupabaseHoldStore(supabase) if HOLD_STORE == 'supabase' else holds.MemoryHoldStore()
+print(f"INFO: Slot holds: store={HOLD_STORE}, ttl={SLOT_HOLD_TTL_SECONDS}s")
+
+# Returns this browser's hold token (created on first use and kept in the session cookie).
+def hold_token():
+    if 'hold_token' not in session: session['hold_token'] = uuid.uuid4().hex
+    return session['hold_token']
+# --- End Slot Hold Setup ---
+
+# --- Booking Idempotency Setup ---
+# The booking form carries a key rendered with the page; a duplicate submit of the same form (double click, retry) is
+# answered with the first submit's redirect instead of running the booking checks again. A duplicate arriving while the
+# first submit is still running waits up to IDEMPOTENCY_WAIT_SECONDS for it. IDEMPOTENCY_STORE='memory' (default) or
+# 'supabase' (shared across processes; requires migrations/007).
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', idempotency.IDEMPOTENCY_TTL_SECONDS))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'memory').lower()
+booking_requests = idempotency.SupabaseIdempotencyStore(supabase) if IDEMPOTENCY_STORE == 'supabase' else idempotency.MemoryIdempotencyStore()
+print(f"INFO: Booking idempotency: store={IDEMPOTENCY_STORE}, ttl={IDEMPOTENCY_TTL_SECONDS}s")
+# --- End Booking Idempotency Setup ---
+
+# --- Rate Limiting Setup ---
+# Booking, review, nearest-slot and slot-hold requests are throttled per IP address, device cookie and browser fingerprint before
+# any database work. Each limit is "<requests>/<seconds>" per identity (IP buckets are 4x larger because patients can
+# share an address). RATE_LIMIT_STORE='memory' (default), 'supabase' (shared across processes; requires migrations/008)
+# or 'off'.
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory').lower()
+
+# Parses a "<requests>/<seconds>" limit setting.
+def parse_rate_limit(name, default):
+    requests_str, _, seconds_str = os.environ.get(name, default).partition('/')
+    return ratelimit.Limit(int(requests_str), int(seconds_str))
+
+RATE_LIMITS = {
+    'confirm_booking': parse_rate_limit('RATE_LIMIT_CONFIRM_BOOKING', '5/60'),
+    'submit_review': parse_rate_limit('RATE_LIMIT_SUBMIT_REVIEW', '3/60'),
+    'nearest_available': parse_rate_limit('RATE_LIMIT_NEAREST_AVAILABLE', '20/60'),
+    'slot_hold': parse_rate_limit('RATE_LIMIT_SLOT_HOLD', '20/60'),
+}
+rate_limiter = None
+if RATE_LIMIT_STORE == 'supabase': rate_limiter = ratelimit.SupabaseRateLimiter(supabase, RATE_LIMITS)
+elif RATE_LIMIT_STORE != 'off': rate_limiter = ratelimit.MemoryRateLimiter(RATE_LIMITS)
+print(f"INFO: Rate limiting: store={RATE_LIMIT_STORE}")
+
+# Returns True if the current request is over `endpoint`'s limit (fingerprint is passed by routes whose form has one).
+# Limiter errors let the request through.
+def rate_limited(endpoint, fingerprint=None):
+    if rate_limiter is None: return False
+    identities = {'ip': request.remote_addr, 'device': request.cookies.get('device_id'), 'fingerprint': fingerprint}
+    try:
+        allowed, empty = rate_limiter.take(endpoint, identities)
+    except Exception as e:
+        print(f"WARN: Rate limiter failed for {endpoint} (allowing request): {e}"); rate_limiter.counters.record_error(); return False
+    if not allowed: print(f"WARN: Rate limit hit on {endpoint} by {', '.join(empty)} (ip {request.remote_addr})")
+    return not allowed
+# --- End Rate Limiting Setup ---
+
+# --- Patient Identity Setup ---
+# With PATIENT_INDEX_ENABLED=1 "this patient's bookings/reviews" are found through the 'patients' table (one indexed
+# lookup by normalized phone or name, then patient_id filters). Requires migrations/009 and a backfill_patients.py run.
+# Otherwise each lookup is a single name-OR-phone query on the raw columns.
+PATIENT_INDEX_ENABLED = os.environ.get('PATIENT_INDEX_ENABLED', '0') == '1'
+
+# Resolves a name/phone pair to a patients.PatientIdentity for use with patients.match().
+def identify_patient(name=None, phone=None):
+    return patients.identify(supabase, name, phone, indexed=PATIENT_INDEX_ENABLED)
+
+# Patient dashboard: bookings per page, and whether a page is read with one patient_bookings() call (requires
+# migrations/009 and 016; de-duplication, ordering and is_deletable done in SQL) instead of one query per table.
+PATIENT_DASHBOARD_PAGE_SIZE = int(os.environ.get('PATIENT_DASHBOARD_PAGE_SIZE', 20))
+PATIENT_DASHBOARD_RPC_ENABLED = os.environ.get('PATIENT_DASHBOARD_RPC_ENABLED', '0') == '1'
+# Review eligibility (already reviewed? latest started booking?) with one review_eligibility() call (requires
+# migrations/009 and 011) instead of a reviews query plus a bookings query.
+REVIEW_ELIGIBILITY_RPC_ENABLED = os.environ.get('REVIEW_ELIGIBILITY_RPC_ENABLED', '0') == '1'
+# --- End Patient Identity Setup ---
+
+# --- Review Moderation Setup ---
+# With REVIEW_MODERATION_INTERVAL_SECONDS > 0 new doctor and site reviews are stored as pending (is_approved = 0) and a
+# 'moderate_reviews' job, queued after each submit and every REVIEW_MODERATION_INTERVAL_SECONDS, approves or rejects
+# them in batches. Doctor ratings and the home page review count are then read from the summary tables, which triggers
+# on the review tables keep current. Requires migrations/012 and 017. With 0 (default) reviews are approved on insert,
+# as before.
+REVIEW_MODERATION_INTERVAL_SECONDS = int(os.environ.get('REVIEW_MODERATION_INTERVAL_SECONDS', 0))
+REVIEW_MODERATION_ENABLED = REVIEW_MODERATION_INTERVAL_SECONDS > 0
+REVIEW_MODERATION_BATCH_SIZE = int(os.environ.get('REVIEW_MODERATION_BATCH_SIZE', moderation.MODERATION_BATCH_SIZE))
+# Blocked words: the built-in list plus MODERATION_BLOCKED_WORDS (comma-separated).
+MODERATION_BLOCKED_WORDS = moderation.blocked_word_set(
+    list(moderation.DEFAULT_BLOCKED_WORDS) + os.environ.get('MODERATION_BLOCKED_WORDS', '').split(','))
+# is_approved value written for newly submitted reviews.
+NEW_REVIEW_STATUS = moderation.PENDING if REVIEW_MODERATION_ENABLED else moderation.APPROVED
+
+# Job handler: moderates every pending review (batched), then re-ranks the doctors that gained approved reviews.
+@job_queue.register('moderate_reviews')
+def moderate_reviews():
+    report = moderation.moderate_pending(supabase, blocked_words=MODERATION_BLOCKED_WORDS, batch_size=REVIEW_MODERATION_BATCH_SIZE)
+    if RANKING_ENABLED and report['doctor_ids']: job_queue.enqueue('rerank_doctors', doctor_ids=sorted(report['doctor_ids']))
+
+# Rating stats for `doctor_ids` (all doctors if None): from doctor_rating_summary while moderation is on,
+# otherwise computed from the approved reviews.
+def fetch_doctor_rating_stats(doctor_ids=None):
+    if REVIEW_MODERATION_ENABLED: return rating_stats.fetch_rating_summary(supabase, doctor_ids)
+    return rating_stats.fetch_rating_stats(supabase, doctor_ids)
+
+# Start the periodic run if enabled (plus one right away for reviews left pending by the last deploy).
+if REVIEW_MODERATION_ENABLED:
+    job_queue.enqueue('moderate_reviews')
+    job_queue.every(REVIEW_MODERATION_INTERVAL_SECONDS, 'moderate_reviews')
+print(f"INFO: Review moderation: {'every ' + str(REVIEW_MODERATION_INTERVAL_SECONDS) + 's' if REVIEW_MODERATION_ENABLED else 'off (auto-approve)'}")
+# --- End Review Moderation Setup ---
+
+# Reviews per page on the booking page and in /api/doctors/<id>/reviews (the booking page renders the first page,
+# the rest load as the patient scrolls). Index: migrations/013.
+REVIEW_PAGE_SIZE = int(os.environ.get('REVIEW_PAGE_SIZE', review_feed.REVIEW_PAGE_SIZE))
+
 # --- Helper Functions ---
 
 # Function to safely parse availability data, which might be a dict or a JSON string.
@@ -139,7 +415,8 @@ def parse_availability(raw_availability, doctor_id_for_log="Unknown"):
          return {}
 
 # Function to load doctor data from the Supabase 'doctors' table.
-def load_doctors_from_db():
+# `notify(message, category)` reports a load failure to the user (flash by default; the streamed home page passes its own).
+def load_doctors_from_db(notify=flash):
     """Fetches doctors from Supabase, parses availability, and calculates average rating."""
     # Print a message indicating the start of the loading process.
     print("Loading doctors data from Supabase...")
@@ -166,54 +443,22 @@ def load_doctors_from_db():
             doc_id = doc.get('id', 'Unknown')
             # Parse the 'availability' field using the helper function, handling potential JSON strings.
             doc['availability'] = parse_availability(doc.get('availability'), doc_id) # Use helper
-            # Initialize the average rating for the doctor to 0.0.
-            doc['average_rating'] = 0.0
-            # Initialize the review count for the doctor to 0.
-            doc['review_count'] = 0
-
-        # Query the 'reviews' table to fetch ratings for ALL approved reviews.
-        # Select only 'doctor_id' and 'rating' columns.
-        # Filter for reviews where 'is_approved' is 1 (or True).
-        response_reviews = supabase.table('reviews').select('doctor_id, rating').eq('is_approved', 1).execute()
-
-        # Check if the reviews query returned any data.
-        if response_reviews.data:
-             # Initialize a defaultdict to aggregate ratings. Lambdas provide default {'total': 0, 'count': 0}.
-             ratings_agg = defaultdict(lambda: {'total': 0, 'count': 0})
-             # Iterate through each review dictionary.
-             for review in response_reviews.data:
-                  # Check if the review has both a 'rating' and a 'doctor_id'.
-                  if review.get('rating') is not None and review.get('doctor_id') is not None:
-                    # Try to convert the rating to a float and validate it's between 1 and 5.
-                    try:
-                        # Attempt conversion to float.
-                        rating_val = float(review['rating'])
-                        # Check if the rating is within the valid range (1-5).
-                        if 1 <= rating_val <= 5:
-                           # If valid, add the rating to the total for this doctor_id.
-                           ratings_agg[review['doctor_id']]['total'] += rating_val
-                           # Increment the count of reviews for this doctor_id.
-                           ratings_agg[review['doctor_id']]['count'] += 1
-                    # Handle cases where rating is not a number.
-                    except (ValueError, TypeError):
-                        # Print a warning if a rating is non-numeric and ignore it.
-                        print(f"Warn: Non-numeric rating '{review['rating']}' for doctor {review['doctor_id']} ignored.")
-
-             # Iterate through the doctors_list again to apply the calculated ratings.
-             for doc in doctors_list:
-                # Get the doctor's ID.
-                doc_id = doc.get('id')
-                # Check if the doctor's ID exists and has aggregated rating data.
-                if doc_id and doc_id in ratings_agg:
-                    # Get the aggregated data for this doctor.
-                    agg_data = ratings_agg[doc_id]
-                    # Set the 'review_count' based on the aggregated count.
-                    doc['review_count'] = agg_data['count']
-                    # Check if there are any reviews counted.
-                    if agg_data['count'] > 0:
-                         # Calculate and set the 'average_rating', rounding to one decimal place.
-                         doc['average_rating'] = round(agg_data['total'] / agg_data['count'], 1)
-                # If no rating data found for this doc, average_rating and review_count remain 0 (from initialization).
+
+        # Fetch every doctor's rating stats in one query (summary table, or all approved ratings in one vectorized pass).
+        # Sets review_count, average_rating, bayesian_rating and rating_histogram (zeros for doctors without reviews).
+        rating_stats.apply_rating_stats(doctors_list, fetch_doctor_rating_stats())
+        # Attach the precomputed rank scores used by the "recommended" sort (zeros when ranking is disabled).
+        if RANKING_ENABLED: ranking.apply_rank_scores(supabase, doctors_list)
+        else:
+            for doc in doctors_list: doc['rank_score'] = 0.0; doc['next_slot_at'] = None
+        # Attach each doctor's next available slot from the in-memory index (card badges, "available today", sorting).
+        try:
+            slot_index.ensure_built(supabase)
+            slot_index.apply(doctors_list)
+        # The page still works without it; cards just show no next-slot badge.
+        except Exception as e:
+            print(f"WARN: Could not load next available slots: {e}")
+            for doc in doctors_list: doc['next_available_date'] = None; doc['next_available_time'] = None
 
         # Print a summary message of the loaded data.
         print(f"Loaded {len(doctors_list)} doctors from Supabase with rating info.")
@@ -226,18 +471,18 @@ def load_doctors_from_db():
         print(f"CRITICAL: Supabase error loading doctors data:")
         # Print the full traceback for debugging.
         traceback.print_exc()
-        # Add a flash message to inform the user about the error loading data.
+        # Inform the user about the error loading data (flashed, unless the caller collects it itself).
         # Tries to get a specific error message from the exception, otherwise uses the string representation.
-        flash(f'Error loading doctor data from Supabase: {getattr(e, "message", str(e))}', 'error')
+        notify(f'Error loading doctor data from Supabase: {getattr(e, "message", str(e))}', 'error')
         # Return an empty list as the loading failed.
         return []
 
 # Function to get the current doctor data, currently just calls load_doctors_from_db.
 # This acts as a single point of access, potentially allowing for caching later.
-def get_current_doctors_data():
+def get_current_doctors_data(notify=flash):
     """ Central function to retrieve doctor data, potentially with caching later """
     # Call the function to fetch fresh data from the database.
-    return load_doctors_from_db()
+    return load_doctors_from_db(notify)
 
 # --- Jinja Context Processor ---
 # Decorator registers the function to run before rendering templates, making its return value available in the template context.
@@ -310,112 +555,145 @@ def get_doctor_availability_from_supabase(doctor_id):
           return {}
 
 
-# --- Flask Routes ---
-
-# --- Route: Home Page ---
-# Decorator maps the root URL ('/') to this function for GET requests (default).
-@app.route('/')
-# Function to handle requests to the home page.
-def home():
-    # Print separator and message indicating the route is being loaded.
-    print("\n--- Loading '/' Home Route ---")
-    # Fetch the current list of doctors (includes ratings) using the helper function.
-    doctors_data = get_current_doctors_data()
+# --- Home Page Data Loaders ---
+# The home page is streamed (see `home()` below), so each section's data is fetched by a loader
+# that the template calls at the point where that section is rendered.
+
+# Function to wrap a loader so it runs once, on first call, and returns the cached result afterwards.
+def lazy_loader(loader):
+    """Returns a zero-argument callable that runs `loader()` on first call and memoizes its result."""
+    # Single-element list used as a mutable cache cell inside the closure.
+    cache = []
+    # Inner function handed to the template.
+    def load():
+        # Only run the real loader the first time.
+        if not cache: cache.append(loader())
+        # Return the cached result.
+        return cache[0]
+    # Return the memoizing wrapper.
+    return load
+
+# Function to build the search filter option lists from the loaded doctors.
+def build_home_filter_options(doctors_data):
+    """Returns sorted unique specialties, governorates, facility types and PLCs for the search filters."""
+    # Default to empty lists so the template always gets the same keys.
+    options = {'specialties': [], 'governorates': [], 'facility_types': [], 'plcs': []}
+    # Nothing to derive if no doctors were loaded.
+    if not doctors_data: return options
+    # Try block to safely process doctor data for filters.
+    try:
+        # Create sorted lists of unique values for each filter field (filtering out None/empty).
+        options['specialties'] = sorted({d.get('specialization') for d in doctors_data if d.get('specialization')})
+        options['governorates'] = sorted({d.get('governorate') for d in doctors_data if d.get('governorate')})
+        options['facility_types'] = sorted({d.get('facility_type') for d in doctors_data if d.get('facility_type')})
+        options['plcs'] = sorted({d.get('plc') for d in doctors_data if d.get('plc')})
+    # Catch any exception during the processing of doctor data for filters.
+    except Exception as e:
+        # Print a warning if there's an error creating filter lists.
+        print(f"Warn: Error processing doctors_data for filters: {e}")
+    # Return the filter option lists.
+    return options
+
+# Function to run the count queries shown in the home page stats section.
+def fetch_home_stats(doctors_data):
+    """Builds the home page stats dict: doctor/specialty counts plus booking and site review counts."""
     # Initialize a dictionary to hold various statistics for the site.
     stats = {
         'doctor_count': len(doctors_data),      # Number of doctors loaded.
-        'specialty_count': 0,                   # Placeholder for unique specialty count.
+        'specialty_count': len(build_home_filter_options(doctors_data)['specialties']), # Unique specialty count.
         'total_bookings': 0,                    # Placeholder for total bookings ever made.
         'total_active_bookings': 0,             # Placeholder for non-cancelled bookings.
         'review_count': 0                       # Placeholder for total approved site reviews.
     }
-    # Initialize empty lists for filter options and site reviews.
-    specialties = []; governorates = []; facility_types = []; plcs = []; site_reviews = []
-
-    # Check if any doctor data was successfully loaded.
-    if doctors_data:
-        # Try block to safely process doctor data for filters.
-        try:
-            # Create a set of unique specializations from doctors data (filtering out None/empty).
-            # Convert to list and sort alphabetically.
-            unique_specs = sorted(list({d.get('specialization') for d in doctors_data if d.get('specialization')}))
-            # Create a set of unique governorates. Sort alphabetically.
-            unique_govs = sorted(list({d.get('governorate') for d in doctors_data if d.get('governorate')}))
-            # Create a set of unique facility types. Sort alphabetically.
-            unique_fac_types = sorted(list({d.get('facility_type') for d in doctors_data if d.get('facility_type')}))
-            # Create a set of unique PLCs (clinic names). Sort alphabetically.
-            unique_plcs = sorted(list({d.get('plc') for d in doctors_data if d.get('plc')}))
-            # Update the stats dictionary with the count of unique specialties.
-            stats['specialty_count'] = len(unique_specs)
-            # Assign the unique lists to the variables used by the template.
-            specialties = unique_specs; governorates = unique_govs; facility_types = unique_fac_types; plcs = unique_plcs
-        # Catch any exception during the processing of doctor data for filters.
-        except Exception as e:
-            # Print a warning if there's an error creating filter lists.
-            print(f"Warn: Error processing doctors_data for filters: {e}")
-
-    # --- Fetch Counts & Site Reviews from Supabase ---
-    # Try block to handle potential errors during Supabase queries for stats and reviews.
+    # Try block to handle potential errors during the Supabase count queries.
     try:
-        # Query 'bookings' table to count non-cancelled bookings.
-        # `count='exact'` requests only the count, not the full rows.
-        # `neq('status', 'Cancelled')` filters out cancelled bookings.
+        # Query 'bookings' table to count non-cancelled bookings. `count='exact'` requests only the count.
         response_active = supabase.table('bookings').select('id', count='exact').neq('status', 'Cancelled').execute()
         # Update stats with the active booking count (if the 'count' attribute exists). Default to 0.
         stats['total_active_bookings'] = response_active.count if hasattr(response_active, 'count') else 0
-
         # Query 'bookings' table to count ALL bookings (including cancelled).
         response_all = supabase.table('bookings').select('id', count='exact').execute()
         # Update stats with the total booking count. Default to 0.
         stats['total_bookings'] = response_all.count if hasattr(response_all, 'count') else 0
-
+        # With moderation on, the approved site review count is read from site_review_summary (one row).
+        if REVIEW_MODERATION_ENABLED:
+            summary_response = supabase.table('site_review_summary').select('approved_count').eq('id', 1).execute()
+            # Update stats with the stored count (no row yet means no approved reviews).
+            stats['review_count'] = (summary_response.data or [{}])[0].get('approved_count') or 0
+        else:
+            # Fetch the TOTAL count of approved site reviews for the stats section.
+            count_response = supabase.table('site_reviews').select('id', count='exact').eq('is_approved', 1).execute()
+            # Update stats with the total approved site review count. Default to 0.
+            stats['review_count'] = count_response.count if hasattr(count_response, 'count') else 0
+    # Catch any exception during the stats queries.
+    except Exception as e:
+        # Print error message and the full traceback.
+        print(f"ERROR: Exception while fetching stats for home:"); traceback.print_exc()
+    # Print the collected stats for debugging.
+    print(f"DEBUG: Home stats: {stats}")
+    # Return the stats dictionary.
+    return stats
+
+# Function to fetch the most recent approved site reviews for the home page.
+def fetch_recent_site_reviews(limit=3):
+    """Returns the latest approved site reviews (newest first), or an empty list on error."""
+    # Try block to handle potential errors during the Supabase query.
+    try:
         # Query 'site_reviews' table for recent, approved reviews.
         response_site_reviews = supabase.table('site_reviews').select(
             'reviewer_name, rating, comment, created_at' # Specify columns needed.
             ).eq('is_approved', 1).order(              # Filter for approved reviews.
                 'created_at', desc=True                 # Order by creation date, newest first.
-            ).limit(3).execute()                        # Limit to the 3 most recent reviews.
-
-        # Check if the site reviews query returned data.
-        if response_site_reviews.data:
-             # Assign the fetched review data to the site_reviews list.
-             site_reviews = response_site_reviews.data
-             # Fetch the TOTAL count of approved site reviews for the stats section.
-             count_response = supabase.table('site_reviews').select('id', count='exact').eq('is_approved', 1).execute()
-             # Update stats with the total approved site review count. Default to 0.
-             stats['review_count'] = count_response.count if hasattr(count_response, 'count') else 0
-             # Print debug message about fetched reviews.
-             print(f"DEBUG: Fetched {len(site_reviews)} recent site reviews (Total approved: {stats['review_count']}).")
-        # If no approved site reviews were found.
-        else:
-             # Print debug message indicating no reviews found.
-             print("DEBUG: No approved site reviews found.")
-             # Check if there was an error object in the response (even if data is empty).
-             if hasattr(response_site_reviews, 'error') and response_site_reviews.error:
-                   # Print details about the fetch error.
-                   print(f"DEBUG: Site reviews fetch error detail: {response_site_reviews.error}")
-                   # Add a flash message for the user about the error.
-                   flash('Error fetching site reviews.', 'error')
-
-    # Catch any exception during the stats/site review fetching process.
+            ).limit(limit).execute()                    # Limit to the most recent reviews.
+        # Check if there was an error object in the response.
+        if hasattr(response_site_reviews, 'error') and response_site_reviews.error:
+            # Print details about the fetch error.
+            print(f"DEBUG: Site reviews fetch error detail: {response_site_reviews.error}")
+        # Print debug message about fetched reviews.
+        print(f"DEBUG: Fetched {len(response_site_reviews.data or [])} recent site reviews.")
+        # Return the fetched review data (or an empty list).
+        return response_site_reviews.data or []
+    # Catch any exception during the site review fetching process.
     except Exception as e:
-        # Print error message.
-        print(f"ERROR: Exception while fetching stats/site reviews for home:")
-        # Print the full traceback.
-        traceback.print_exc()
-        # Add a flash message indicating failure to load stats/reviews.
-        flash('Could not load current statistics or site reviews.', 'warning')
+        # Print error message and the full traceback.
+        print(f"ERROR: Exception while fetching site reviews for home:"); traceback.print_exc()
+        # Return an empty list so the template renders its "no reviews" state.
+        return []
 
-    # Render the 'index.html' template, passing all collected data.
-    return render_template(
+
+# --- Flask Routes ---
+
+# --- Route: Home Page ---
+# Decorator maps the root URL ('/') to this function for GET requests (default).
+@app.route('/')
+# Function to handle requests to the home page.
+def home():
+    # Print separator and message indicating the route is being loaded.
+    print("\n--- Loading '/' Home Route ---")
+    # Wrap each data source in a lazy loader. Nothing is queried yet: the template calls these
+    # when it reaches the section that needs them, so the <head>, navbar and hero are sent first.
+    # Errors met while streaming can't be flashed (the session cookie has already been sent), so the doctors loader
+    # collects them as (category, message) and the template shows them right after loading.
+    load_errors = []
+    load_doctors = lazy_loader(lambda: get_current_doctors_data(notify=lambda message, category: load_errors.append((category, message))))
+    # Filter options are derived from the doctors list (no extra query).
+    load_filters = lazy_loader(lambda: build_home_filter_options(load_doctors()))
+    # Stats reuse the already-loaded doctors and add the count queries.
+    load_stats = lazy_loader(lambda: fetch_home_stats(load_doctors()))
+    # Recent site reviews for the testimonials section.
+    load_site_reviews = lazy_loader(fetch_recent_site_reviews)
+    # Pop the flashed messages now: the session cookie is written before the streamed body, so messages
+    # popped while streaming would stay in the cookie and show again on the next page.
+    flashed_messages = get_flashed_messages(with_categories=True)
+    # Stream 'index.html': chunks are flushed to the browser as each section's data arrives.
+    return stream_template(
         'index.html',                           # The template file to render.
-        doctors=doctors_data,                   # Pass the list of doctors.
-        stats=stats,                            # Pass the dictionary of statistics.
-        specialties=specialties,                # Pass the list of unique specialties.
-        governorates=governorates,              # Pass the list of unique governorates.
-        facility_types=facility_types,          # Pass the list of unique facility types.
-        plcs=plcs,                              # Pass the list of unique clinic names.
-        site_reviews=site_reviews               # Pass the list of recent site reviews.
+        flashed_messages=flashed_messages,      # Flash messages (category, message) popped above.
+        load_doctors=load_doctors,              # Loader for the list of doctors.
+        load_errors=load_errors,                # Errors reported by the loaders (filled while streaming).
+        load_filters=load_filters,              # Loader for the unique specialties/governorates/facility types/PLCs.
+        load_stats=load_stats,                  # Loader for the dictionary of statistics.
+        load_site_reviews=load_site_reviews     # Loader for the list of recent site reviews.
     )
 
 # --- Route: Submit Site Review ---
@@ -465,7 +743,7 @@ def submit_site_review():
             'reviewer_name': reviewer_name, # User's name.
             'rating': rating,               # Validated rating (integer).
             'comment': comment,             # User's comment.
-            'is_approved': 1                # Default to approved (1 means true/approved). Change to 0 for moderation.
+            'is_approved': NEW_REVIEW_STATUS # Pending (0) when moderation is on, otherwise approved (1).
         }
         # Execute the insert operation on the 'site_reviews' table with the payload.
         response = supabase.table('site_reviews').insert(insert_payload).execute()
@@ -474,8 +752,12 @@ def submit_site_review():
         if response.data:
              # Log success message to console.
              print(f"Site review added by {reviewer_name} (Supabase).")
+             # Pending reviews are checked in the background: queue a moderation run and say so.
+             if REVIEW_MODERATION_ENABLED:
+                 job_queue.enqueue('moderate_reviews')
+                 flash('✅ Thank you for your feedback! It will appear once it has been reviewed.', 'success')
              # Flash a success message to the user.
-             flash('✅ Thank you for your feedback!', 'success')
+             else: flash('✅ Thank you for your feedback!', 'success')
         # If insert did not return data or an error occurred.
         else:
             # Set a default error message.
@@ -506,6 +788,29 @@ def submit_site_review():
     return redirect(url_for('home') + '#site-reviews-section')
 
 
+# Returns whether `reviewer` may review the doctor, as a dict: review_exists, last_booking_date / last_booking_time
+# (their latest non-cancelled booking with the doctor that has started, or None) and next_start_at (ISO start of their
+# next upcoming booking, or None). One RPC round trip, or two single queries without it.
+def review_eligibility(doctor_id, reviewer):
+    if REVIEW_ELIGIBILITY_RPC_ENABLED: return patients.fetch_review_eligibility(supabase, doctor_id, reviewer)
+    # Existing review with this doctor by this reviewer (matched by name or phone).
+    res_review = patients.match(supabase.table('reviews').select('id', count='exact').eq('doctor_id', doctor_id),
+                                reviewer, name_col='reviewer_name', phone_col='reviewer_phone').limit(1).execute()
+    # Their non-cancelled bookings with this doctor, newest first.
+    res_bookings = patients.match(supabase.table('bookings').select('booking_date, booking_time').eq('doctor_id', doctor_id), reviewer) \
+        .neq('status', 'Cancelled').order('booking_date', desc=True).order('booking_time', desc=True).limit(50).execute()
+    result = {'review_exists': bool(getattr(res_review, 'count', 0)), 'last_booking_date': None, 'last_booking_time': None, 'next_start_at': None}
+    now = datetime.now()
+    for booking in (res_bookings.data or []):
+        # Typed start of the slot; malformed legacy rows are skipped.
+        try: start = datetime.strptime(f"{booking['booking_date']} {booking['booking_time'].split('-')[0].strip()}", '%Y-%m-%d %H:%M')
+        except (ValueError, TypeError, KeyError, AttributeError): continue
+        # Newest first: every upcoming booking seen before the first started one is earlier than the last.
+        if start > now: result['next_start_at'] = start.isoformat(); continue
+        result['last_booking_date'], result['last_booking_time'] = booking['booking_date'], booking['booking_time']
+        break
+    return result
+
 # --- Route: Submit Doctor Review ---
 # Decorator maps '/submit-review' URL to this function, only for POST requests.
 @app.route('/submit-review', methods=['POST'])
@@ -527,6 +832,11 @@ def submit_review():
     # Print the received form data for debugging.
     print(f"DEBUG: Form Data - doctor_id='{doctor_id_str}', name='{reviewer_name}', phone='{reviewer_phone}', rating='{rating_str}'")
 
+    # Throttle repeated review submits before any validation or database work.
+    if rate_limited('submit_review'):
+        flash('⛔ Too many reviews submitted. Please wait a minute and try again.', 'error')
+        return redirect(request.referrer or url_for('home'))
+
     # --- Basic Validation ---
     # Initialize empty list for errors, and None for parsed values.
     errors = []; doctor_id = None; rating = None
@@ -566,174 +876,47 @@ def submit_review():
         # Print debug message indicating the start of DB checks.
         print(f"DEBUG: Attempting review checks for Dr {doctor_id}, Reviewer {reviewer_name}/{reviewer_phone}")
 
-        # *** CHECK 1: Has this person already reviewed this doctor? (Using TWO queries as OR isn't directly used here) ***
-        # Print debug message for Check 1.
-        print("DEBUG: Check 1 - Existing review?")
-        # Initialize flag for existing review to False.
-        review_exists = False
-        # Start a nested try block for this specific database check.
+        # *** CHECKS 1-3: Not reviewed yet, and has a non-cancelled booking with this doctor that has started ***
+        # Print debug message for the eligibility check.
+        print("DEBUG: Checks 1-3 - Review eligibility...")
+        # Start a nested try block for the eligibility lookup.
         try:
-            # Query 1a: Check if a review exists for this doctor_id matching the reviewer_name.
-            # `select('id', count='exact')` efficiently checks existence without fetching full rows.
-            res_name = supabase.table('reviews').select('id', count='exact') \
-                .eq('doctor_id', doctor_id) \
-                .eq('reviewer_name', reviewer_name) \
-                .limit(1).execute() # Limit 1 as we only need to know if at least one exists.
-            # Check if the query was successful and returned a count greater than 0.
-            if hasattr(res_name, 'count') and res_name.count > 0:
-                # If found by name, set the flag to True.
-                review_exists = True
-
-            # Query 1b: Only check by phone if no review was found by name.
-            if not review_exists:
-                 # Query 'reviews' table checking by doctor_id and reviewer_phone.
-                 res_phone = supabase.table('reviews').select('id', count='exact') \
-                     .eq('doctor_id', doctor_id) \
-                     .eq('reviewer_phone', reviewer_phone) \
-                     .limit(1).execute()
-                 # Check if the phone query found a review.
-                 if hasattr(res_phone, 'count') and res_phone.count > 0:
-                     # If found by phone, set the flag to True.
-                     review_exists = True
-
-            # Print debug summary of Check 1 results. Checks if 'res_phone' exists locally before accessing count.
-            print(f"DEBUG: Check 1 Response (Name Check: {res_name.count if hasattr(res_name, 'count') else 'ERR'}, Phone Check: {res_phone.count if 'res_phone' in locals() and hasattr(res_phone, 'count') else 'N/A'}) - Exists: {review_exists}")
-
-        # Catch any exception during the existing review database checks.
-        except Exception as check1_err:
+            # Resolve the reviewer (name OR phone identifies the same person) and look up their eligibility.
+            eligibility = review_eligibility(doctor_id, identify_patient(reviewer_name, reviewer_phone))
+            # Print the eligibility result for debugging.
+            print(f"DEBUG: Review eligibility: {eligibility}")
+        # Catch any exception during the eligibility lookup.
+        except Exception as check_err:
             # Log the error and print traceback.
-            print(f"ERROR: Exception during DB Check 1 (existing review): {check1_err}"); traceback.print_exc()
+            print(f"ERROR: Exception during review eligibility check: {check_err}"); traceback.print_exc()
             # Flash an error message to the user.
-            flash(f'⛔ Error checking existing reviews: {getattr(check1_err, "message", str(check1_err))}.', 'error')
+            flash(f'⛔ Error checking review eligibility: {getattr(check_err, "message", str(check_err))}.', 'error')
             # Redirect back to the doctor's booking page.
             return redirect(url_for('booking_page', doctor_id=doctor_id))
 
-        # If Check 1 determined a review already exists.
-        if review_exists:
+        # CHECK 1: Has this person already reviewed this doctor?
+        if eligibility.get('review_exists'):
              # Flash an error message indicating a duplicate review attempt.
              flash('⛔ You have already reviewed this doctor using this name or phone number.', 'error')
              # Redirect back to the doctor's booking page.
              return redirect(url_for('booking_page', doctor_id=doctor_id))
-        # --- END CHECK 1 ---
-
-        # *** CHECK 2: Does a non-cancelled booking exist for this reviewer/doctor pair? (Find latest, uses TWO queries) ***
-        # Print debug message for Check 2.
-        print("DEBUG: Check 2 - Finding latest relevant booking...")
-        # Initialize variable to store the latest relevant booking found.
-        latest_booking = None
-        # Start nested try block for the booking check queries.
-        try:
-            # Query 2a: Find the latest non-cancelled booking by doctor_id and patient_name.
-            # Select booking date and time.
-            bk_name_res = supabase.table('bookings') \
-                .select('booking_date, booking_time') \
-                .eq('doctor_id', doctor_id) \
-                .eq('patient_name', reviewer_name) \
-                .neq('status', 'Cancelled') \
-                .order('booking_date', desc=True).order('booking_time', desc=True) \
-                .limit(1).execute() # Limit 1 to get only the most recent.
-
-            # Query 2b: Find the latest non-cancelled booking by doctor_id and patient_phone.
-            bk_phone_res = supabase.table('bookings') \
-                 .select('booking_date, booking_time') \
-                 .eq('doctor_id', doctor_id) \
-                 .eq('patient_phone', reviewer_phone) \
-                 .neq('status', 'Cancelled') \
-                 .order('booking_date', desc=True).order('booking_time', desc=True) \
-                 .limit(1).execute()
-
-            # Extract the first result if data exists for the name query, otherwise None.
-            booking_by_name = bk_name_res.data[0] if bk_name_res.data else None
-            # Extract the first result if data exists for the phone query, otherwise None.
-            booking_by_phone = bk_phone_res.data[0] if bk_phone_res.data else None
-            # Print debug messages showing the results found (or None).
-            print(f"DEBUG: Latest booking by Name: {booking_by_name}")
-            print(f"DEBUG: Latest booking by Phone: {booking_by_phone}")
-
-            # Determine which booking is truly the latest if both name and phone found matches.
-            if booking_by_name and booking_by_phone:
-                 # Combine date and start time (taking only HH:MM part) into strings for comparison.
-                 name_dt_str = f"{booking_by_name.get('booking_date')} {booking_by_name.get('booking_time', '').split('-')[0].strip()}"
-                 phone_dt_str = f"{booking_by_phone.get('booking_date')} {booking_by_phone.get('booking_time', '').split('-')[0].strip()}"
-                 # Try to parse these strings into datetime objects.
-                 try:
-                    # Parse name booking date/time.
-                    name_dt = datetime.strptime(name_dt_str, '%Y-%m-%d %H:%M')
-                    # Parse phone booking date/time.
-                    phone_dt = datetime.strptime(phone_dt_str, '%Y-%m-%d %H:%M')
-                    # Assign the later booking (or name booking if equal) to latest_booking.
-                    latest_booking = booking_by_name if name_dt >= phone_dt else booking_by_phone
-                 # Handle potential errors if time format is unexpected during parsing.
-                 except ValueError:
-                    # Default to the name booking if comparison parsing fails.
-                    latest_booking = booking_by_name
-            # If only a booking by name was found.
-            elif booking_by_name:
-                 # Assign it as the latest booking.
-                 latest_booking = booking_by_name
-            # If only a booking by phone was found.
-            elif booking_by_phone:
-                 # Assign it as the latest booking.
-                 latest_booking = booking_by_phone
-            # Else: latest_booking remains None if neither query found a match.
-
-        # Catch exceptions during the latest booking check queries.
-        except Exception as check2_err:
-             # Log the error and print traceback.
-             print(f"ERROR: Exception during DB Check 2 (latest booking): {check2_err}"); traceback.print_exc()
-             # Flash error message to the user.
-             flash(f'⛔ Error finding your booking: {getattr(check2_err, "message", str(check2_err))}.', 'error')
-             # Redirect back to the booking page.
-             return redirect(url_for('booking_page', doctor_id=doctor_id))
-
-        # If no relevant non-cancelled booking was found after both checks.
-        if not latest_booking:
-             # Flash error message explaining a booking is required to review.
-             flash('⛔ No non-cancelled booking found matching your name/phone for this doctor. Book first to review.', 'error')
-             # Redirect back to the booking page.
-             return redirect(url_for('booking_page', doctor_id=doctor_id))
-        # Print the booking details that will be used for the time check.
-        print(f"DEBUG: Using latest booking: {latest_booking}")
-        # --- END CHECK 2 ---
-
-        # *** CHECK 3: Has the appointment time already passed? ***
-        # Print debug message for Check 3.
-        print("DEBUG: Check 3 - Checking appointment time...")
-        # Start a nested try block for parsing the booking time.
-        try:
-            # Get the booking date string from the found booking.
-            booking_date_str = latest_booking.get('booking_date')
-            # Get the booking time slot string (e.g., "HH:MM - HH:MM").
-            booking_time_slot = latest_booking.get('booking_time')
-            # Validate that necessary date/time parts exist and format seems correct. Raise ValueError if not.
-            if not booking_date_str or not booking_time_slot or '-' not in booking_time_slot: raise ValueError("Invalid format")
-            # Extract the start time part (HH:MM) from the slot string.
-            booking_start_time_str = booking_time_slot.split('-')[0].strip()
-            # Combine date and start time strings and parse into a datetime object.
-            appointment_start_dt = datetime.strptime(f"{booking_date_str} {booking_start_time_str}", '%Y-%m-%d %H:%M')
-            # Get the current date and time.
-            now_dt = datetime.now()
-            # Print comparison values for debugging.
-            print(f"DEBUG: Comparing Now ({now_dt}) vs Appointment Start ({appointment_start_dt})")
-            # Check if the current time is before the appointment start time.
-            if now_dt < appointment_start_dt:
+        # CHECK 2/3: Is there a non-cancelled booking with this doctor whose appointment time has passed?
+        if not eligibility.get('last_booking_date'):
+             # Only an upcoming booking: the review has to wait until the appointment starts.
+             if eligibility.get('next_start_at'):
                 # Format the appointment time nicely for the flash message.
-                time_fmt = appointment_start_dt.strftime('%I:%M %p on %b %d, %Y')
+                time_fmt = datetime.fromisoformat(str(eligibility['next_start_at'])).strftime('%I:%M %p on %b %d, %Y')
                 # Flash error message stating review is too early.
                 flash(f'⛔ Cannot submit review until after your appointment starts ({time_fmt}).', 'error')
-                # Redirect back to the booking page.
-                return redirect(url_for('booking_page', doctor_id=doctor_id))
-            # If current time is at or after the appointment start time.
-            print("DEBUG: Appointment time passed.")
-        # Catch exceptions during parsing or if keys are missing from latest_booking dict.
-        except (ValueError, IndexError, TypeError, KeyError) as e:
-             # Log the parsing error and print traceback.
-             print(f"ERROR: Parsing latest booking time failed: {e}"); traceback.print_exc()
-             # Flash a generic error message about time verification failure.
-             flash('⛔ Could not verify appointment time. Contact support.', 'error')
+             # No booking at all.
+             else:
+                # Flash error message explaining a booking is required to review.
+                flash('⛔ No non-cancelled booking found matching your name/phone for this doctor. Book first to review.', 'error')
              # Redirect back to the booking page.
              return redirect(url_for('booking_page', doctor_id=doctor_id))
-        # --- END CHECK 3 ---
+        # Print the booking being reviewed.
+        print(f"DEBUG: Reviewing visit on {eligibility['last_booking_date']} at {eligibility['last_booking_time']}.")
+        # --- END CHECKS 1-3 ---
 
         # --- If all checks passed, Insert the Doctor Review ---
         # Print debug message indicating checks are complete.
@@ -745,7 +928,7 @@ def submit_review():
             'reviewer_phone': reviewer_phone,   # Reviewer's phone.
             'rating': rating,                   # The validated rating (1-5 integer).
             'comment': comment,                 # The review comment.
-            'is_approved': 1                    # Set to 1 (approved) by default. Change to 0 for manual moderation queue.
+            'is_approved': NEW_REVIEW_STATUS    # Pending (0) when moderation is on, otherwise approved (1).
         }
         # Print the data being sent to Supabase for debugging.
         print(f"DEBUG: Insert Review Data Payload: {insert_data}")
@@ -756,10 +939,17 @@ def submit_review():
 
         # Check if the insert response contains data (usually indicates success).
         if insert_response.data:
-             # Flash a success message to the user.
-             flash('✅ Thank you! Your review has been submitted.', 'success')
              # Log success message to the console.
              print(f"Doctor review added for Dr {doctor_id} by {reviewer_name}.")
+             # Pending review: the moderation job approves it (and re-ranks the doctor) off the request path.
+             if REVIEW_MODERATION_ENABLED:
+                 job_queue.enqueue('moderate_reviews')
+                 flash('✅ Thank you! Your review has been submitted and will appear once it has been reviewed.', 'success')
+             else:
+                 # Flash a success message to the user.
+                 flash('✅ Thank you! Your review has been submitted.', 'success')
+                 # The new review changes the doctor's decayed rating: refresh their rank score.
+                 schedule_rerank(doctor_id)
         # Handle insert failure (no data returned or error object present).
         else:
              # Set a default failure message.
@@ -801,6 +991,8 @@ def submit_review():
 # --- END OF REVISED submit_review ---
 
 # --- Route: Doctor Booking Page ---
+# Number of days ahead the booking page calendar covers (6 months of 31 days, as generated in booking.html).
+BOOKING_CALENDAR_DAYS = 6 * 31
 # Decorator maps '/booking/<integer:doctor_id>' URL to this function. It captures the ID.
 @app.route('/booking/<int:doctor_id>')
 # Function to display the booking page for a specific doctor.
@@ -810,7 +1002,10 @@ def booking_page(doctor_id):
     # Initialize variables to hold doctor data, reviews, and availability.
     doctor = None
     reviews = []
+    reviews_next_cursor = None # Cursor of the second review page (None = no more reviews).
     doctor_availability_data = {} # Default to an empty dictionary.
+    # Dates closed / opened by availability exceptions (migrations/005), for the calendar.
+    availability_overrides = {'closed': [], 'extra': []}
 
     # --- Fetch Doctor Details directly from Supabase ---
     # Start a try block to handle potential errors fetching doctor data.
@@ -835,46 +1030,24 @@ def booking_page(doctor_id):
              doctor['availability'] = doctor_availability_data
              # Print the parsed availability data for debugging.
              print(f"DEBUG: Parsed availability for Dr {doctor_id}: {doctor_availability_data}")
+             # Resolve this doctor's date exceptions over the calendar's window (about 6 months ahead).
+             exception_rows = slot_schedules.fetch_exceptions(supabase, date.today(), doctor_id).get(doctor_id, [])
+             availability_overrides = slot_schedules.build_schedule(doctor_availability_data, exception_rows) \
+                 .overrides_between(date.today(), date.today() + timedelta(days=BOOKING_CALENDAR_DAYS))
 
              # --- Rating Calculation ---
              # Print debug message indicating rating calculation is starting.
              print("DEBUG: Calculating doctor rating...")
-             # Query the 'reviews' table for ratings specific to this doctor.
-             # Select only the 'rating' column.
-             # Filter by 'doctor_id' and ensure reviews are approved ('is_approved' == 1).
-             individual_ratings_response = supabase.table('reviews').select('rating').eq('doctor_id', doctor_id).eq('is_approved', 1).execute()
-             # Check if the ratings query returned any data.
-             if individual_ratings_response.data:
-                 # Use a list comprehension to extract valid ratings.
-                 # Checks if 'rating' key exists, is a number (int or float), and is between 1 and 5.
-                 valid_ratings = [r['rating'] for r in individual_ratings_response.data if r.get('rating') is not None and isinstance(r.get('rating'), (int, float)) and 1 <= r.get('rating') <= 5]
-                 # Count the number of valid ratings.
-                 count = len(valid_ratings)
-                 # Sum the valid ratings.
-                 total_rating = sum(valid_ratings)
-                 # Assign the count to the doctor's 'review_count'.
-                 doctor['review_count'] = count
-                 # Calculate the average rating if count > 0, round to 1 decimal place. Otherwise, set to 0.0.
-                 doctor['average_rating'] = round(total_rating / count, 1) if count > 0 else 0.0
-             # If no ratings were found for this doctor.
-             else:
-                 # Set review count and average rating to 0.
-                 doctor['review_count'] = 0
-                 doctor['average_rating'] = 0.0
+             # Same stats source (and validity rule) as the doctor list, restricted to this doctor.
+             rating_stats.apply_rating_stats([doctor], fetch_doctor_rating_stats([doctor_id]))
              # Print the calculated rating and count for debugging.
              print(f"DEBUG: Rating calculated - Avg: {doctor.get('average_rating', 'N/A')}, Count: {doctor.get('review_count', 'N/A')}")
 
-             # Fetch recent approved reviews for display on the page.
+             # Fetch the first page of approved reviews for display on the page (newest first; more load on scroll).
              # Print debug message.
-             print(f"DEBUG: Fetching recent reviews for doctor {doctor_id}...")
-             # Query the 'reviews' table again for display purposes.
-             reviews_response = supabase.table('reviews').select(
-                 'reviewer_name, rating, comment, created_at' # Select columns needed for display.
-                 ).eq('doctor_id', doctor_id).eq('is_approved', 1).order( # Filter by doctor and approval status.
-                     'created_at', desc=True                               # Order by newest first.
-                 ).limit(10).execute()                                     # Limit to the latest 10 reviews.
-             # Assign the fetched review data to the 'reviews' list (or an empty list if none found).
-             reviews = reviews_response.data or []
+             print(f"DEBUG: Fetching first review page for doctor {doctor_id}...")
+             # One keyset page read; the cursor is handed to the template for /api/doctors/<id>/reviews.
+             reviews, reviews_next_cursor = review_feed.fetch_page(supabase, doctor_id, limit=REVIEW_PAGE_SIZE)
              # Print the number of reviews fetched for display.
              print(f"DEBUG: Fetched {len(reviews)} reviews for display.")
 
@@ -912,12 +1085,18 @@ def booking_page(doctor_id):
     response = make_response(render_template(
         'booking.html', doctor=doctor, doctor_id=doctor_id,
         doctor_availability=doctor_availability_data, # Pass the python dict here
-        reviews=reviews
+        availability_overrides=availability_overrides, # Closed / extra dates from availability exceptions
+        reviews=reviews,
+        reviews_next_cursor=reviews_next_cursor, # Cursor for the next page of reviews (None = all shown)
+        idempotency_key=uuid.uuid4().hex # Fresh key per page load; duplicate submits of this form replay the first result
     ))
     # Set HTTP headers to prevent caching of this dynamic booking page.
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate' # HTTP 1.1.
     response.headers['Pragma'] = 'no-cache' # HTTP 1.0.
     response.headers['Expires'] = '0' # Proxies.
+    # Give the browser a long-lived device ID (recorded with bookings and used as a rate-limit identity).
+    if not request.cookies.get('device_id'):
+        response.set_cookie('device_id', uuid.uuid4().hex, max_age=365 * 24 * 60 * 60, httponly=True, samesite='Lax')
     # Print message indicating the end of the booking page loading process.
     print("--- Finished loading Booking Page data ---")
     # Return the constructed response object to the browser.
@@ -950,31 +1129,9 @@ def center_details(plc_name):
              flash(f'Details not found for clinic/center "{plc_name}".', 'info')
              return redirect(url_for('home'))
         # --- Calculate Ratings for each doctor at this PLC ---
-        # Iterate through the list of doctors found at this PLC.
-        for doc in plc_doctors:
-             # Get the doctor's ID.
-             doc_id = doc.get('id')
-             # If doctor ID is missing, set rating info to 0 and continue to next doctor.
-             if not doc_id:
-                 doc['review_count'] = 0; doc['average_rating'] = 0.0; continue
-             # Query 'reviews' table to get the count of approved reviews for this doctor_id.
-             rating_res = supabase.table('reviews').select('rating', count='exact').eq('doctor_id', doc_id).eq('is_approved', 1).execute()
-             # Assign the count to the doctor's dictionary. Default to 0 if count attribute missing.
-             doc['review_count'] = rating_res.count if hasattr(rating_res, 'count') else 0
-             # Check if there are any reviews for this doctor.
-             if doc['review_count'] > 0:
-                  # If reviews exist, fetch the actual rating values to calculate the average.
-                  avg_res = supabase.table('reviews').select('rating').eq('doctor_id', doc_id).eq('is_approved', 1).execute()
-                  # Check if the query returned rating data.
-                  if avg_res.data:
-                      # Extract valid numerical ratings between 1 and 5.
-                      valid_ratings = [r['rating'] for r in avg_res.data if r.get('rating') is not None and isinstance(r.get('rating'), (int, float)) and 1 <= r.get('rating') <= 5]
-                      # Calculate average if valid ratings exist, otherwise 0.0. Round to 1 decimal.
-                      doc['average_rating'] = round(sum(valid_ratings) / len(valid_ratings), 1) if valid_ratings else 0.0
-                  # If fetching ratings failed or returned no data (shouldn't happen if count > 0, but defensive).
-                  else: doc['average_rating'] = 0.0
-             # If review_count was 0.
-             else: doc['average_rating'] = 0.0
+        # One reviews query for all doctors at this PLC (instead of two per doctor), computed by the shared stats module.
+        plc_doctor_ids = [doc['id'] for doc in plc_doctors if doc.get('id')]
+        rating_stats.apply_rating_stats(plc_doctors, fetch_doctor_rating_stats(plc_doctor_ids))
         # --- Gather PLC Information ---
         # Get the data of the first doctor in the list (assuming all doctors at a PLC share some basic info).
         first_doc = plc_doctors[0]
@@ -1011,64 +1168,34 @@ def center_details(plc_name):
 def get_nearest_available(doctor_id):
     # Print debug message indicating API call with doctor ID.
     print(f"DEBUG: API call /get-nearest-available/ for Dr {doctor_id}")
-    # Fetch the doctor's availability schedule using the helper function.
-    doctor_availability = get_doctor_availability_from_supabase(doctor_id)
-    # Check if the availability schedule was successfully loaded and is not empty.
-    if not doctor_availability:
-        # If no schedule found, return a JSON response indicating failure and a 404 status code.
-        return jsonify({'success': False, 'message': 'Doctor schedule is currently unavailable.'}), 404
-    # Get today's date object.
-    today_date = date.today()
-    # Get the current time object.
-    now_time = datetime.now().time()
-    # Print current date and time for debugging context.
-    print(f"DEBUG: Current date: {today_date}, time: {now_time}")
+    # Throttle before touching the index or the database.
+    if rate_limited('nearest_available'):
+        return jsonify({'success': False, 'message': 'Too many requests. Please wait a moment and try again.'}), 429
     # Start a try block for the logic of finding the nearest slot.
     try:
-        # Loop through the next 90 days (including today).
-        for i in range(90):
-            # Calculate the date being checked in this iteration.
-            current_check_date = today_date + timedelta(days=i)
-            # Format the check date as 'YYYY-MM-DD'.
-            date_str = current_check_date.strftime('%Y-%m-%d')
-            # Get the name of the day (e.g., 'Monday').
-            day_name = current_check_date.strftime('%A')
-            # Get the list of generally available slots for this day name from the schedule. Default to empty list.
-            general_slots_raw = doctor_availability.get(day_name, [])
-            # Ensure the fetched slots data is actually a list before proceeding.
-            if not isinstance(general_slots_raw, list): continue # Skip if format is wrong.
-            # Filter and sort the raw slots: keep only valid strings ("HH:MM - HH:MM", not "unavailable").
-            general_slots = sorted([s for s in general_slots_raw if isinstance(s, str) and '-' in s and ':' in s and s.strip().lower() != "unavailable"])
-            # If no valid general slots exist for this day, continue to the next day.
-            if not general_slots: continue
-            # Query Supabase 'bookings' table to find times already booked for this doctor on this specific date.
-            response_booked = supabase.table('bookings').select('booking_time').eq('doctor_id', doctor_id).eq('booking_date', date_str).neq('status', 'Cancelled').execute()
-            # Create a set of booked time slots for efficient lookup. If no bookings, create an empty set.
-            booked_times = {row['booking_time'] for row in response_booked.data} if response_booked.data else set()
-            # Iterate through the sorted, generally available slots for the day.
-            for slot in general_slots:
-                # Check if this generally available slot is NOT in the set of booked times.
-                if slot not in booked_times:
-                    # Initialize variable for the slot's start time.
-                    slot_start_time = None
-                    # Try to parse the start time (HH:MM) from the slot string.
-                    try:
-                        slot_start_str = slot.split('-')[0].strip(); slot_start_time = datetime.strptime(slot_start_str, '%H:%M').time()
-                    # Handle errors if parsing fails (e.g., unexpected format).
-                    except (ValueError, IndexError) as time_parse_err:
-                        print(f"ERROR: Parse near slot '{slot}': {time_parse_err}. Skipping."); continue # Log error and skip this slot.
-                    # Check if the current check date is today.
-                    if current_check_date == today_date:
-                        # If it's today, check if the slot's start time is in the future compared to now.
-                        if slot_start_time > now_time:
-                            # If found the first future slot for today, return success with date and time.
-                            print(f"SUCCESS: Found nearest (Today): {date_str} {slot}"); return jsonify({'success': True, 'date': date_str, 'time': slot})
-                    # If the current check date is a future date.
-                    else:
-                        # Any available slot on a future date is the nearest, return success.
-                        print(f"SUCCESS: Found nearest (Future): {date_str} {slot}"); return jsonify({'success': True, 'date': date_str, 'time': slot})
-        # If the loop completes without finding any available slot within 90 days.
-        print(f"INFO: Loop finished. No slots found near for Dr {doctor_id}.")
+        # Look the slot up in the in-memory index (weekly schedule + date exceptions, closed periods skipped)
+        # instead of scanning up to 90 days with one query each.
+        slot_index.ensure_built(supabase)
+        # A doctor added since the last rebuild isn't indexed yet: load just them.
+        if doctor_id not in slot_index: slot_index.refresh_doctor(supabase, doctor_id)
+        # Still unknown: the doctor doesn't exist.
+        if doctor_id not in slot_index:
+            # Return a JSON response indicating failure and a 404 status code.
+            return jsonify({'success': False, 'message': 'Doctor schedule is currently unavailable.'}), 404
+        # Another app process may have booked the indexed slot: confirm it with one query (and re-read the doctor if taken).
+        for _attempt in range(3):
+            found = slot_index.next_slot(doctor_id)
+            if not found: break
+            date_str, slot = found
+            response_booked = supabase.table('bookings').select('id').eq('doctor_id', doctor_id).eq('booking_date', date_str).eq('booking_time', slot).neq('status', 'Cancelled').limit(1).execute()
+            # Still free: this is the nearest slot.
+            if not response_booked.data:
+                print(f"SUCCESS: Found nearest: {date_str} {slot}"); return jsonify({'success': True, 'date': date_str, 'time': slot})
+            # Taken elsewhere: reload this doctor's bookings and try the next candidate.
+            print(f"INFO: Indexed slot {date_str} {slot} for Dr {doctor_id} already booked. Refreshing index entry.")
+            slot_index.refresh_doctor(supabase, doctor_id)
+        # No open slot in the index window.
+        print(f"INFO: No slots found near for Dr {doctor_id}.")
         # Return a JSON response indicating no slots found soon, with a 404 status code.
         return jsonify({'success': False, 'message': 'No available slots found soon.'}), 404
     # Catch any unexpected exceptions during the slot finding logic.
@@ -1093,52 +1220,26 @@ def get_available_slots(doctor_id, date_str):
     # Handle error if the date string is not in the expected 'YYYY-MM-DD' format.
     except ValueError:
         print(f"ERROR: Invalid date format: {date_str}"); return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400 # Return 400 Bad Request.
-    # Fetch the doctor's availability schedule using the helper function.
-    doctor_availability = get_doctor_availability_from_supabase(doctor_id)
-    # Check if a schedule was found.
-    if not doctor_availability:
-        print(f"WARN: No schedule found Dr {doctor_id} date {date_str}"); return jsonify([]) # Return empty list if no schedule.
-    # Get the list of generally available slots for the specified day name. Default to empty list.
-    general_slots_raw = doctor_availability.get(day_name, [])
-    # Ensure the fetched schedule data for the day is a list.
-    if not isinstance(general_slots_raw, list):
-        print(f"WARN: Schedule not list {day_name}"); return jsonify([]) # Return empty list if format is wrong.
-    # Filter and sort the raw slots: keep only valid strings ("HH:MM - HH:MM", not "unavailable").
-    general_slots = sorted([ s for s in general_slots_raw if isinstance(s, str) and '-' in s and ':' in s and s.strip().lower() != "unavailable"])
-    # Check if any general slots exist for this day after filtering.
-    if not general_slots:
-        print(f"DEBUG: No general slots {day_name}"); return jsonify([]) # Return empty list if none exist.
-    # Try block for querying booked slots.
+    # Try block for the index lookup and the booked-times query.
     try:
-        # Query Supabase 'bookings' table for slots already booked for this doctor on this date.
+        # The doctor's weekly schedule comes from the in-memory slot index (bitmaps), not a doctors query.
+        slot_index.ensure_built(supabase)
+        # A doctor added since the last rebuild isn't indexed yet: load just them.
+        if doctor_id not in slot_index: slot_index.refresh_doctor(supabase, doctor_id)
+        if doctor_id not in slot_index:
+            print(f"WARN: No schedule found Dr {doctor_id} date {date_str}"); return jsonify([]) # Return empty list if no schedule.
+        # Query Supabase 'bookings' table for slots already booked for this doctor on this date (always fresh: the
+        # slot list is what the patient picks from).
         response_booked = supabase.table('bookings').select('booking_time').eq('doctor_id', doctor_id).eq('booking_date', date_str).neq('status', 'Cancelled').execute()
-        # Create a set of booked time slot strings for efficient lookup.
-        booked_times = {row['booking_time'] for row in response_booked.data} if response_booked.data else set()
-        # Filter the general slots, keeping only those NOT present in the booked_times set.
-        available_slots = [slot for slot in general_slots if slot not in booked_times]
-        # Check if the requested date is today's date.
-        if booking_date == date.today():
-             # If it's today, filter out slots that have already passed.
-             # Get the current time.
-             now_time = datetime.now().time()
-             # Initialize an empty list to hold future slots.
-             future_slots = []
-             # Iterate through the currently available slots for today.
-             for slot in available_slots:
-                # Try to parse the start time from the slot string.
-                try:
-                    slot_start_str = slot.split('-')[0].strip(); slot_start_time = datetime.strptime(slot_start_str, '%H:%M').time()
-                # Handle potential parsing errors.
-                except (ValueError, IndexError) as e:
-                    print(f"ERROR: Parse slot '{slot}' today filter: {e}. Skipping."); continue # Log and skip this slot.
-                # Check if the slot's start time is later than the current time.
-                if slot_start_time > now_time:
-                    # If it is, add it to the list of future slots.
-                    future_slots.append(slot)
-             # Replace the available_slots list with the filtered list containing only future slots.
-             available_slots = future_slots
+        # Store that day's bookings in the index, then read the open slots back as one bitmap operation.
+        # Past slots are dropped for today (and past dates have none).
+        slot_index.sync_booked_day(doctor_id, date_str, [row['booking_time'] for row in (response_booked.data or [])])
+        available_slots = slot_index.free_slots(doctor_id, booking_date) or []
+        # Leave out slots another patient is holding (this browser still sees its own hold).
+        held = slot_holds.held_times(doctor_id, date_str, session.get('hold_token')) if available_slots else set()
+        if held: available_slots = [slot for slot in available_slots if slot not in held]
         # Print debug message showing the final list of available slots being returned.
-        print(f"DEBUG: Returning {len(available_slots)} slots for {date_str}: {available_slots}")
+        print(f"DEBUG: Returning {len(available_slots)} slots for {date_str} ({day_name}): {available_slots}")
         # Return the list of available slot strings as a JSON response.
         return jsonify(available_slots)
     # Catch exceptions during the Supabase query for booked times.
@@ -1148,6 +1249,170 @@ def get_available_slots(doctor_id, date_str):
         # Return a JSON error response with a 500 status code.
         return jsonify({'error': 'Database error fetching times.'}), 500
 
+# --- API Route: Doctors Free on a Date ---
+# Decorator maps '/api/available-doctors' URL to this API endpoint.
+# Query parameters: date=YYYY-MM-DD (required), specialization, governorate, from=HH:MM, to=HH:MM (all optional).
+@app.route('/api/available-doctors')
+# Function to list every doctor with an open slot on a date, answered from the slot index bitmaps.
+def available_doctors():
+    # Parse the required date.
+    date_str = request.args.get('date', '')
+    try:
+        day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400 # Return 400 Bad Request.
+    # Optional start-time window; reject malformed times instead of silently ignoring them.
+    start_time = request.args.get('from') or None
+    end_time = request.args.get('to') or None
+    for value in (start_time, end_time):
+        if value is not None and slot_bit(value) is None:
+            return jsonify({'error': 'Invalid time format. Use HH:MM.'}), 400
+    try:
+        slot_index.ensure_built(supabase)
+        # Governorate isn't in the index: narrow to that governorate's doctor IDs with one query.
+        doctor_ids = None
+        governorate = request.args.get('governorate')
+        if governorate:
+            gov_res = supabase.table('doctors').select('id').eq('governorate', governorate).execute()
+            doctor_ids = [row['id'] for row in (gov_res.data or [])]
+        # One bitmap AND per doctor decides who is free.
+        free = slot_index.doctors_free_on(day, specialization=request.args.get('specialization') or None,
+                                          doctor_ids=doctor_ids, start_time=start_time, end_time=end_time)
+        # Earliest first slot first, so the first entries are the soonest options.
+        results = sorted(({'doctor_id': doctor_id, 'free_slots': slots, 'first_slot': slots[0]} for doctor_id, slots in free.items()),
+                         key=lambda item: (item['first_slot'], item['doctor_id']))
+        return jsonify({'date': date_str, 'count': len(results), 'doctors': results})
+    # Catch any unexpected errors.
+    except Exception as e:
+        print(f"ERROR in available_doctors for {date_str}:"); traceback.print_exc()
+        return jsonify({'error': 'Internal server error searching.'}), 500
+
+# --- API Route: Earliest Slots Across Doctors ---
+# Decorator maps '/api/earliest-slots' URL to this API endpoint.
+# Query parameters: specialization and/or governorate (at least one), plc (optional), limit (default 10, max 50),
+# days (search window, default 14, max SLOT_INDEX_HORIZON_DAYS).
+@app.route('/api/earliest-slots')
+# Function to find the K earliest open slots with ANY matching doctor ("first available dermatologist in Aden").
+def earliest_slots():
+    # Read the filters.
+    specialization = request.args.get('specialization', '').strip()
+    governorate = request.args.get('governorate', '').strip()
+    plc = request.args.get('plc', '').strip()
+    # Refuse unfiltered requests (they would merge every doctor's calendar).
+    if not specialization and not governorate:
+        return jsonify({'error': 'Provide a specialization and/or governorate.'}), 400
+    # Parse and clamp the numeric parameters.
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        days = min(max(int(request.args.get('days', 14)), 1), slot_schedules.SLOT_INDEX_HORIZON_DAYS)
+    except ValueError:
+        return jsonify({'error': 'limit and days must be integers.'}), 400
+    try:
+        now = datetime.now()
+        # 1) Matching doctors with their weekly schedules (one query).
+        query = supabase.table('doctors').select('id, name, plc, specialization, governorate, availability')
+        if specialization: query = query.eq('specialization', specialization)
+        if governorate: query = query.eq('governorate', governorate)
+        if plc: query = query.eq('plc', plc)
+        doctors = {doc['id']: doc for doc in (query.execute().data or [])}
+        if not doctors: return jsonify({'count': 0, 'slots': []})
+        # 2) One bulk fetch of their bookings over the window, and their date exceptions (fresh, not from the index).
+        booked = slot_schedules.fetch_booked(supabase, now, days, list(doctors))
+        exceptions = slot_schedules.fetch_exceptions(supabase, now, list(doctors))
+        # 3) Bitmap schedule per doctor, then a heap merge of their time-ordered open-slot streams.
+        schedules = {}
+        for doctor_id, doc in doctors.items():
+            schedule = slot_schedules.build_schedule(doc.get('availability'), exceptions.get(doctor_id, []))
+            schedule.set_booked(booked.get(doctor_id, set()))
+            schedules[doctor_id] = schedule
+        merged = slot_schedules.earliest_slots(schedules, now=now, limit=limit, horizon_days=days)
+        # Shape the response (doctor details included so the client can render and link directly).
+        results = [{'doctor_id': doctor_id, 'doctor_name': doctors[doctor_id].get('name'), 'plc': doctors[doctor_id].get('plc'),
+                    'date': date_str, 'time': slot} for _start, doctor_id, date_str, slot in merged]
+        print(f"DEBUG: Earliest slots ({specialization or '*'}/{governorate or '*'}/{plc or '*'}): {len(results)} from {len(doctors)} doctor(s).")
+        return jsonify({'count': len(results), 'slots': results})
+    # Catch any unexpected errors.
+    except Exception as e:
+        print(f"ERROR in earliest_slots:"); traceback.print_exc()
+        return jsonify({'error': 'Internal server error searching.'}), 500
+
+# --- API Route: Doctor Review Feed ---
+# Decorator maps '/api/doctors/<id>/reviews' URL (GET, ?after=<cursor>&limit=<n>) to this API endpoint.
+@app.route('/api/doctors/<int:doctor_id>/reviews')
+# Function to return one page of a doctor's approved reviews (newest first) for the booking page's infinite scroll.
+def doctor_reviews_feed(doctor_id):
+    # Page size: REVIEW_PAGE_SIZE unless the client asks for fewer/more (capped).
+    try:
+        limit = max(1, min(int(request.args.get('limit', REVIEW_PAGE_SIZE)), review_feed.REVIEW_PAGE_MAX))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number.'}), 400
+    try:
+        rows, next_cursor = review_feed.fetch_page(supabase, doctor_id, after=request.args.get('after') or None, limit=limit)
+    # A cursor that doesn't decode was not issued by us.
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"ERROR: Review feed failed for Dr {doctor_id}:"); traceback.print_exc()
+        return jsonify({'error': 'Internal server error loading reviews.'}), 500
+    # Compact rows plus the cursor of the next page (null on the last page).
+    return jsonify({'reviews': [review_feed.compact(row) for row in rows], 'next': next_cursor})
+
+# --- API Route: Hold a Slot ---
+# Decorator maps '/api/slot-holds' URL (POST, JSON body {doctor_id, date, time}) to this API endpoint.
+@app.route('/api/slot-holds', methods=['POST'])
+# Function to hold a slot for this browser while the patient fills in the booking form.
+def hold_slot():
+    # Throttle before any work (holds hide slots from every other patient).
+    if rate_limited('slot_hold'):
+        return jsonify({'held': False, 'error': 'Too many requests. Please wait a minute and try again.'}), 429
+    # Read and validate the JSON body.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict): payload = {}
+    doctor_id, date_str, time_str = payload.get('doctor_id'), payload.get('date'), payload.get('time')
+    try:
+        doctor_id = int(doctor_id); hold_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'doctor_id, date (YYYY-MM-DD) and time are required.'}), 400
+    if not isinstance(time_str, str) or slot_bit(time_str.split('-')[0].strip()) is None:
+        return jsonify({'error': 'Invalid time format.'}), 400
+    # Only dates the booking page offers.
+    if not date.today() <= hold_date <= date.today() + timedelta(days=BOOKING_CALENDAR_DAYS):
+        return jsonify({'error': 'Date is outside the booking window.'}), 400
+    try:
+        # Only slots in the doctor's effective schedule can be held.
+        if not slot_is_scheduled(doctor_id, hold_date, time_str):
+            return jsonify({'held': False, 'error': 'This time slot is not offered by the doctor.'}), 400
+        # Acquire (or extend) the hold; this browser's previous hold, if any, is released.
+        owners = {'ip': request.remote_addr, 'device': request.cookies.get('device_id')}
+        if not slot_holds.acquire(doctor_id, date_str, time_str, hold_token(), ttl=SLOT_HOLD_TTL_SECONDS, owners=owners,
+                                  max_holds={'ip': SLOT_HOLDS_PER_IP, 'device': SLOT_HOLDS_PER_DEVICE}):
+            print(f"DEBUG: Slot hold refused Dr {doctor_id} {date_str} {time_str} (held by another patient).")
+            return jsonify({'held': False, 'error': 'This time slot is being booked by another patient. Please pick another.'}), 409
+        return jsonify({'held': True, 'expires_in': SLOT_HOLD_TTL_SECONDS})
+    # This IP / device already holds its share of slots.
+    except holds.HoldLimitError as e:
+        print(f"WARN: Slot hold limit hit Dr {doctor_id} {date_str} {time_str} (ip {request.remote_addr}): {e}")
+        return jsonify({'held': False, 'error': 'Too many slots held at once. Please finish or abandon another booking first.'}), 429
+    # Holds are an optimisation: on a store error let the patient continue (CHECK 3 still guards the insert).
+    except Exception as e:
+        print(f"ERROR: Slot hold failed Dr {doctor_id} {date_str} {time_str}:"); traceback.print_exc()
+        return jsonify({'held': False}), 200
+
+# True if `time_str` is in the doctor's effective schedule on `day` (bookings ignored).
+# Uses the slot index when it has the doctor, else loads the weekly availability and exceptions.
+def slot_is_scheduled(doctor_id, day, time_str):
+    scheduled = slot_index.is_scheduled(doctor_id, day, time_str)
+    if scheduled is not None: return scheduled
+    exception_rows = slot_schedules.fetch_exceptions(supabase, day, doctor_id).get(doctor_id, [])
+    return slot_schedules.build_schedule(get_doctor_availability_from_supabase(doctor_id), exception_rows).is_scheduled(day, time_str)
+
+# Releases a browser's slot hold, logging (not raising) store errors.
+def release_slot_hold(token):
+    try:
+        slot_holds.release(token)
+    except Exception as e:
+        print(f"WARN: Could not release slot hold: {e}")
+
 # --- Route: Confirm Booking ---
 # Decorator maps '/confirm-booking' URL to this function, handling only POST requests.
 @app.route('/confirm-booking', methods=['POST'])
@@ -1175,9 +1440,46 @@ def confirm_booking():
     # Get the IP address of the client making the request.
     ip_address = request.remote_addr
 
+    # Get the form's idempotency key (ignored if missing or malformed, e.g. a page rendered before keys existed).
+    idempotency_key = request.form.get('idempotency_key', '').strip()
+    if not idempotency.valid_key(idempotency_key): idempotency_key = None
+
     # Print the received form data for debugging.
     print(f"DEBUG: Form Data - DrID: {doctor_id_str}, Name: {patient_name}, Phone: {patient_phone}, Date: {booking_date}, Time: {booking_time}")
 
+    # --- Duplicate Submit Check (before any validation or database work) ---
+    if idempotency_key:
+        try:
+            claimed, result = booking_requests.claim(idempotency_key)
+            # The first submit is still running: wait for its outcome; if it gave up (failed), run this one normally.
+            if not claimed and result is None:
+                result = booking_requests.wait(idempotency_key, IDEMPOTENCY_WAIT_SECONDS)
+                if result is None: claimed, result = booking_requests.claim(idempotency_key)
+        # Store errors must not block bookings: continue without idempotency.
+        except Exception as e:
+            print(f"WARN: Idempotency check failed (continuing without it): {e}"); claimed, result, idempotency_key = True, None, None
+        if not claimed:
+            # Replay the first submit's redirect (same confirmation page, nothing re-queried or re-inserted).
+            if result:
+                print(f"DEBUG: Duplicate booking submit (key {idempotency_key}); replaying {result}")
+                flash('✅ Booking confirmed successfully!', 'success'); return redirect(result)
+            flash('ℹ️ Your booking request is still being processed. Please check your bookings shortly.', 'info')
+            return redirect(url_for('booking_page', doctor_id=int(doctor_id_str)) if (doctor_id_str or '').isdigit() else url_for('home'))
+        # If this submit doesn't end in a booking, free the key so a corrected resubmit runs (no-op after success).
+        if idempotency_key:
+            @after_this_request
+            def release_idempotency_key(response):
+                try: booking_requests.release(idempotency_key)
+                except Exception as e: print(f"WARN: Could not release idempotency key: {e}")
+                return response
+    # --- End Duplicate Submit Check ---
+
+    # Throttle repeated booking attempts (per IP, device cookie and fingerprint) before any other work. Runs after the
+    # duplicate check so a replayed double submit doesn't spend a token; a throttled submit frees its idempotency key.
+    if rate_limited('confirm_booking', fingerprint):
+        flash('⛔ Too many booking attempts. Please wait a minute and try again.', 'error')
+        return redirect(url_for('booking_page', doctor_id=int(doctor_id_str)) if (doctor_id_str or '').isdigit() else url_for('home'))
+
     # --- Basic Input Validation ---
     # Initialize list for validation errors.
     errors = []
@@ -1238,6 +1540,24 @@ def confirm_booking():
         return redirect(request.referrer or redir_url)
     # --- End Basic Validation ---
 
+    # --- Slot Hold Check (cheap contention check before the validation queries) ---
+    # A slot held by another patient is turned away right here; otherwise this browser takes (or refreshes) the hold so a
+    # concurrent confirmation for the same slot is turned away instead. Store errors don't block the booking.
+    token = hold_token()
+    try:
+        if not slot_holds.acquire(doctor_id, booking_date, booking_time, token, ttl=SLOT_HOLD_TTL_SECONDS):
+            print(f"DEBUG: Slot {booking_time} on {booking_date} for Dr {doctor_id} is held by another patient.")
+            flash('⛔ Sorry, another patient is booking that time slot right now. Please select another.', 'error')
+            return redirect(url_for('booking_page', doctor_id=doctor_id))
+        # The hold ends with this request either way: a successful booking consumes it (the booking row now keeps the
+        # slot out of listings), and a rejected one frees the slot for other patients.
+        @after_this_request
+        def consume_slot_hold(response):
+            release_slot_hold(token); return response
+    except Exception as e:
+        print(f"WARN: Slot hold check failed (continuing without hold): {e}")
+    # --- End Slot Hold Check ---
+
     # --- Slot Availability & Doctor Name Validation (against current schedule) ---
     # Initialize variable to store the fetched doctor's name.
     fetched_doctor_name = None
@@ -1256,16 +1576,13 @@ def confirm_booking():
         fetched_doctor_name = doc_response.data.get('name', 'Doctor')
         # Parse the fetched availability data using the helper function.
         current_schedule = parse_availability(doc_response.data.get('availability'), doctor_id)
-        # Get the name of the day for the selected booking date (e.g., 'Monday').
-        selected_day_name = booking_date_obj.strftime('%A')
-        # Get the list of scheduled slots for that day from the parsed schedule. Default to empty list.
-        day_schedule = current_schedule.get(selected_day_name, [])
-        # Ensure the day's schedule is actually a list. Raise TypeError if not.
-        if not isinstance(day_schedule, list): raise TypeError("Schedule format error")
-        # Create a set of valid time slot strings from the day's schedule for efficient lookup.
-        valid_slots = {s for s in day_schedule if isinstance(s, str) and '-' in s and ':' in s and s.strip().lower() != 'unavailable'}
-        # Check if the requested booking_time exists in the set of valid slots for that day.
-        if booking_time in valid_slots:
+        # Load the doctor's exceptions covering the booking date (closures / extra slots) fresh from the database.
+        exception_rows = [row for row in slot_schedules.fetch_exceptions(supabase, booking_date_obj, doctor_id).get(doctor_id, [])
+                          if str(row.get('start_date'))[:10] <= booking_date]
+        # Effective schedule for the date = weekly slots minus closures plus extra slots.
+        effective_schedule = slot_schedules.build_schedule(current_schedule, exception_rows)
+        # Check if the requested booking_time is scheduled on that date.
+        if effective_schedule.is_scheduled(booking_date_obj, booking_time):
             is_slot_valid = True; print("DEBUG: Slot is currently valid in schedule.")
         # If the selected time slot is not in the valid list for that day.
         else:
@@ -1281,6 +1598,9 @@ def confirm_booking():
     # --- Booking Logic and Business Rule Checks ---
     # Start try block for the core booking checks and insertion logic.
     try:
+        # Resolve the patient once (phone OR name identifies the same person in every check below).
+        patient = identify_patient(patient_name, patient_phone)
+
         # *** NEW CHECK 1: 10-Day Cooldown for SAME Doctor ***
         # Print debug message for Check 1, indicating check parameters.
         print(f"DEBUG: CHECK 1 (10-Day Cooldown) - Checking recent bookings for Dr {doctor_id} by Phone:{patient_phone} OR Name:{patient_name}")
@@ -1288,35 +1608,16 @@ def confirm_booking():
         ten_days_ago = booking_date_obj - timedelta(days=10)
         # Initialize variable to store the date of the most recent conflicting booking.
         most_recent_booking_date = None
-        # Start nested try block for the cooldown database queries.
+        # Start nested try block for the cooldown database query.
         try:
-            # Check 1a: Look for recent bookings by phone number first.
-            res_phone = supabase.table('bookings') \
-                .select('booking_date') \
-                .eq('doctor_id', doctor_id) \
-                .eq('patient_phone', patient_phone) \
+            # Look for the most recent booking with this doctor by this patient (matched by phone or name) in the window.
+            res_recent = patients.match(supabase.table('bookings').select('booking_date').eq('doctor_id', doctor_id), patient) \
                 .gte('booking_date', ten_days_ago.strftime('%Y-%m-%d')) \
                 .lt('booking_date', booking_date_obj.strftime('%Y-%m-%d')) \
                 .order('booking_date', desc=True).limit(1).execute()
-
-            # If a recent booking was found by phone.
-            if res_phone.data:
-                # Store its booking date.
-                most_recent_booking_date = res_phone.data[0]['booking_date']
-            # If no recent booking found by phone.
-            else:
-                 # Check 1b: Look for recent bookings by patient name.
-                 res_name = supabase.table('bookings') \
-                    .select('booking_date') \
-                    .eq('doctor_id', doctor_id) \
-                    .eq('patient_name', patient_name) \
-                    .gte('booking_date', ten_days_ago.strftime('%Y-%m-%d')) \
-                    .lt('booking_date', booking_date_obj.strftime('%Y-%m-%d')) \
-                    .order('booking_date', desc=True).limit(1).execute()
-                 # If a recent booking was found by name.
-                 if res_name.data:
-                    # Store its booking date.
-                    most_recent_booking_date = res_name.data[0]['booking_date']
+            # If a recent booking was found, store its booking date.
+            if res_recent.data:
+                most_recent_booking_date = res_recent.data[0]['booking_date']
 
             # If a recent booking was found by either phone or name.
             if most_recent_booking_date:
@@ -1348,35 +1649,14 @@ def confirm_booking():
         total_bookings_on_day = 0
         # Start nested try block for the daily limit database queries.
         try:
-            # Use a set to store unique booking IDs found, preventing double counting if name/phone match same booking.
-            booked_ids_on_day = set()
-
-            # Query 2a: Check by phone for any non-cancelled bookings on the target date (across all doctors).
-            res_phone_daily = supabase.table('bookings') \
-                 .select('id') \
-                 .eq('patient_phone', patient_phone) \
+            # Count this patient's non-cancelled bookings on the target date across all doctors (matched by phone or
+            # name; one query, so a booking matching both is counted once).
+            res_daily = patients.match(supabase.table('bookings').select('id'), patient) \
                  .eq('booking_date', booking_date) \
                  .neq('status', 'Cancelled') \
                  .execute()
-            # If bookings found by phone.
-            if res_phone_daily.data:
-                # Add the IDs of these bookings to the set.
-                for booking in res_phone_daily.data: booked_ids_on_day.add(booking['id'])
-
-            # Query 2b: Check by name for any non-cancelled bookings on the target date (across all doctors).
-            res_name_daily = supabase.table('bookings') \
-                 .select('id') \
-                 .eq('patient_name', patient_name) \
-                 .eq('booking_date', booking_date) \
-                 .neq('status', 'Cancelled') \
-                 .execute()
-            # If bookings found by name.
-            if res_name_daily.data:
-                 # Add the IDs of these bookings to the set (duplicates are automatically handled by set).
-                 for booking in res_name_daily.data: booked_ids_on_day.add(booking['id'])
-
             # Calculate the total number of unique bookings found for this patient on this day.
-            total_bookings_on_day = len(booked_ids_on_day)
+            total_bookings_on_day = len(res_daily.data or [])
             # Log the count found.
             print(f"DEBUG: Found {total_bookings_on_day} existing unique non-cancelled bookings for this patient on {booking_date}")
 
@@ -1434,16 +1714,11 @@ def confirm_booking():
         print(f"DEBUG: CHECK 4 (Same Dr/Day Check) - Patient {patient_name}/{patient_phone} on {booking_date}?")
         # Start nested try block for Check 4 queries.
         try:
-            # Use a set to store unique booking IDs found for this patient/doctor/day combination.
-            booked_ids_same_dr_day = set()
-            # Query 4a: Check by phone for non-cancelled bookings with this doctor on this date.
-            res_phone_sdd = supabase.table('bookings').select('id').eq('doctor_id', doctor_id).eq('patient_phone', patient_phone).eq('booking_date', booking_date).neq('status', 'Cancelled').execute()
-            # If results found, add their IDs to the set.
-            if res_phone_sdd.data: booked_ids_same_dr_day.update(b['id'] for b in res_phone_sdd.data)
-            # Query 4b: Check by name for non-cancelled bookings with this doctor on this date.
-            res_name_sdd = supabase.table('bookings').select('id').eq('doctor_id', doctor_id).eq('patient_name', patient_name).eq('booking_date', booking_date).neq('status', 'Cancelled').execute()
-            # If results found, add their IDs to the set (duplicates ignored by set).
-            if res_name_sdd.data: booked_ids_same_dr_day.update(b['id'] for b in res_name_sdd.data)
+            # Non-cancelled bookings with this doctor on this date by this patient (matched by phone or name, one query).
+            res_sdd = patients.match(supabase.table('bookings').select('id').eq('doctor_id', doctor_id), patient) \
+                .eq('booking_date', booking_date).neq('status', 'Cancelled').execute()
+            # Collect their IDs.
+            booked_ids_same_dr_day = {b['id'] for b in (res_sdd.data or [])}
 
             # Check if the set contains any booking IDs (meaning a conflict was found).
             if len(booked_ids_same_dr_day) > 0:
@@ -1501,10 +1776,18 @@ def confirm_booking():
             booking_id = response_insert.data[0]['id']
             # Log success message with the new booking ID.
             print(f"SUCCESS: Booking confirmed (Supabase): ID {booking_id}")
+            # Hand post-booking side work to the background job queue; the redirect is not delayed by it.
+            job_queue.enqueue('booking_confirmed', booking_id=booking_id, doctor_id=doctor_id, booking_date=booking_date, booking_time=booking_time)
             # Flash a success message to the user.
             flash('✅ Booking confirmed successfully!', 'success')
-            # Redirect the user to the confirmation page, passing necessary details as query parameters.
-            return redirect(url_for('confirmation', booking_id=booking_id, doctor_name=fetched_doctor_name, patient_name=patient_name, booking_date=booking_date, booking_time=booking_time))
+            # Build the confirmation page URL, passing necessary details as query parameters.
+            confirmation_url = url_for('confirmation', booking_id=booking_id, doctor_name=fetched_doctor_name, patient_name=patient_name, booking_date=booking_date, booking_time=booking_time)
+            # Remember it against the form's idempotency key so duplicate submits replay it.
+            if idempotency_key:
+                try: booking_requests.complete(idempotency_key, confirmation_url, ttl=IDEMPOTENCY_TTL_SECONDS)
+                except Exception as e: print(f"WARN: Could not store idempotency result: {e}")
+            # Redirect the user to the confirmation page.
+            return redirect(confirmation_url)
         # Handle insertion failure (e.g., database error, constraint violation after checks passed - race condition edge case).
         else:
             # Set a default error message.
@@ -1545,6 +1828,22 @@ def confirm_booking():
 
 # --- END OF FULLY REVISED /confirm-booking ROUTE ---
 
+# --- API Route: Background Job Queue Metrics ---
+# Decorator maps '/api/jobs/metrics' URL to this API endpoint.
+@app.route('/api/jobs/metrics')
+# Function to report the background job queue's depth and latency metrics.
+def job_queue_metrics():
+    # Return the metrics snapshot (depth, processed/failed counts, wait/run latencies) as JSON.
+    return jsonify(job_queue.metrics())
+
+# --- API Route: Rate Limiter Metrics ---
+# Decorator maps '/api/rate-limit/metrics' URL to this API endpoint.
+@app.route('/api/rate-limit/metrics')
+# Function to report allowed/rejected request counts per endpoint (and which identities ran out).
+def rate_limit_metrics():
+    if rate_limiter is None: return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'store': RATE_LIMIT_STORE, **rate_limiter.counters.metrics()})
+
 # --- Route: Booking Confirmation Page ---
 # Decorator maps the '/confirmation' URL to this function.
 @app.route('/confirmation')
@@ -1615,6 +1914,10 @@ def delete_booking(booking_id):
             flash('✅ Booking cancelled.', 'success');
             # Log success message.
             print(f"Booking {booking_id} status -> Cancelled.")
+            # The freed slot can change the doctor's next available time: update the slot index and rank score.
+            cancelled = response.data[0]
+            slot_index.mark_freed(cancelled.get('doctor_id'), cancelled.get('booking_date'), cancelled.get('booking_time'))
+            schedule_rerank(cancelled.get('doctor_id'))
         # If the update didn't change any data (likely because status wasn't 'Pending').
         else:
             # Query the booking's current status to provide a more informative message.
@@ -1708,6 +2011,8 @@ def doctor_login():
 def doctor_dashboard(doctor_id):
     # Print separator and message indicating dashboard load with doctor ID.
     print(f"--- Loading Dr Dashboard ID: {doctor_id} ---")
+    # '?history=1' also reads archived (older) bookings; by default only the hot 'bookings' table is queried.
+    show_history = request.args.get('history') == '1'
     # Initialize variables to hold doctor info, bookings, stats, etc.
     doctor = None; bookings_rows = []; stats = defaultdict(int); appts_per_day = defaultdict(int); unique_patients = set()
     # Start try block for database queries.
@@ -1726,18 +2031,19 @@ def doctor_dashboard(doctor_id):
             return redirect(url_for('doctor_login'))
         # Log confirmation that doctor was found.
         print(f"DEBUG: Found Dr. {doctor.get('name')}")
-        # Fetch all non-cancelled bookings associated with this doctor ID.
-        bookings_response = supabase.table('bookings').select(
-            'id, patient_name, patient_phone, booking_date, booking_time, notes, status' # Select needed columns.
-            ).eq('doctor_id', doctor_id).neq( # Filter by doctor ID.
-                'status', 'Cancelled'         # Exclude cancelled bookings.
-            ).order(                          # Order results:
-                'booking_date', desc=True     # Newest date first.
-            ).order(
-                'booking_time', desc=True     # Newest time first within each date.
-            ).execute()
-        # Assign the fetched booking data (list of dicts) or an empty list if none found.
-        bookings_rows = bookings_response.data or [];
+        # Fetch all non-cancelled bookings associated with this doctor ID (from the archive too when history is requested).
+        for table_name in archive.booking_tables(show_history):
+            bookings_response = supabase.table(table_name).select(
+                'id, patient_name, patient_phone, booking_date, booking_time, notes, status' # Select needed columns.
+                ).eq('doctor_id', doctor_id).neq( # Filter by doctor ID.
+                    'status', 'Cancelled'         # Exclude cancelled bookings.
+                ).order(                          # Order results:
+                    'booking_date', desc=True     # Newest date first.
+                ).order(
+                    'booking_time', desc=True     # Newest time first within each date.
+                ).execute()
+            # Append the fetched booking data (list of dicts); archived rows are older, so order is preserved.
+            bookings_rows.extend(bookings_response.data or [])
         # Log the number of bookings fetched.
         print(f"DEBUG: Fetched {len(bookings_rows)} bookings.")
 
@@ -1787,7 +2093,8 @@ def doctor_dashboard(doctor_id):
                                doctor=doctor or {'id': doctor_id, 'name':'N/A'},
                                doctor_id=doctor_id, bookings_by_month={},
                                stats={'total_bookings_listed': 0},
-                               chart_config_daily={'labels': [], 'data': []})
+                               chart_config_daily={'labels': [], 'data': []},
+                               show_history=show_history)
 
     # --- Chart Preparation (Next 7 Days) ---
     # Initialize lists for chart labels (dates) and data (counts).
@@ -1840,7 +2147,8 @@ def doctor_dashboard(doctor_id):
                            doctor_id=doctor_id,               # Doctor's ID.
                            bookings_by_month=final_grouped,   # Bookings grouped by month, then day.
                            stats=dict(stats),                 # Dictionary of calculated statistics.
-                           chart_config_daily=chart_config)   # Configuration data for the daily chart.
+                           chart_config_daily=chart_config,   # Configuration data for the daily chart.
+                           show_history=show_history)         # Whether archived bookings are included.
 
 # --- Route: Update All Notes (Doctor Dashboard) ---
 # Decorator maps '/update-all-notes' URL, handling only POST requests.
@@ -1956,6 +2264,8 @@ def mark_complete(booking_id):
         if response.data and len(response.data) > 0:
             # Log success.
             print(f"SUCCESS: Mark complete {booking_id}.");
+            # Re-read the doctor's upcoming bookings into the slot index in the background.
+            if response.data[0].get('doctor_id'): job_queue.enqueue('refresh_doctor_slots', doctor_id=response.data[0]['doctor_id'])
             # Return success JSON response.
             return jsonify({'success': True, 'message': 'Marked completed.'})
         # If the update didn't change any rows (likely status wasn't 'Pending').
@@ -2011,35 +2321,17 @@ def patient_login():
         try:
             # Print debug message indicating start of DB check.
             print(f"DEBUG: Patient login check for '{patient_identifier}'")
-            # This uses two separate queries because Supabase Python client might not easily support `OR` conditions across `ilike` and `eq` directly in one query builder chain.
-
-            # Query 1: Check by patient name using case-insensitive 'ilike'.
-            # Use count='exact' for efficiency.
-            # Exclude cancelled bookings. Limit to 1 (we just need existence).
-            name_res = supabase.table('bookings').select('id', count='exact') \
-                .ilike('patient_name', f'%{patient_identifier}%') \
+            # The identifier may be a name or a phone number: match either, in one query.
+            patient = identify_patient(patient_identifier, patient_identifier)
+            # Check for at least one non-cancelled booking (name as case-insensitive substring, phone exact).
+            # Use count='exact' for efficiency. Limit to 1 (we just need existence).
+            exists_res = patients.match(supabase.table('bookings').select('id', count='exact'), patient, name_like=True) \
                 .neq('status', 'Cancelled') \
                 .limit(1).execute()
-            # If the name query found at least one booking.
-            if hasattr(name_res, 'count') and name_res.count > 0:
-                 # Set the flag to True.
-                 booking_exists = True
-
-            # Query 2: Check by exact patient phone number ONLY IF not found by name.
-            phone_res = None # Define before use in print statement.
-            if not booking_exists:
-                # Check using exact match 'eq' for the phone number.
-                phone_res = supabase.table('bookings').select('id', count='exact') \
-                     .eq('patient_phone', patient_identifier) \
-                     .neq('status', 'Cancelled') \
-                     .limit(1).execute()
-                # If the phone query found at least one booking.
-                if hasattr(phone_res, 'count') and phone_res.count > 0:
-                     # Set the flag to True.
-                     booking_exists = True
-
-            # Print debug summary of the two queries' results.
-            print(f"DEBUG: Patient Login Check - Name Count: {name_res.count if hasattr(name_res, 'count') else 'ERR'}, Phone Count: {phone_res.count if phone_res and hasattr(phone_res, 'count') else 'N/A'} -> Exists: {booking_exists}")
+            # If the query found at least one booking, set the flag to True.
+            booking_exists = bool(getattr(exists_res, 'count', 0))
+            # Print debug summary of the query result.
+            print(f"DEBUG: Patient Login Check - Count: {getattr(exists_res, 'count', 'ERR')} -> Exists: {booking_exists}")
 
         # Catch exceptions during the database queries.
         except Exception as e:
@@ -2069,6 +2361,18 @@ def patient_login():
     return render_template('patient_login.html')
 # --- END OF REVISED patient_login ---
 
+# True if a booking can still be deleted by the patient: Pending and its slot hasn't started yet.
+def booking_is_deletable(booking, now):
+    # Only pending bookings can potentially be deleted.
+    if booking.get('status') != 'Pending': return False
+    try:
+        # Combine the date and the slot's start time (HH:MM) and compare with now.
+        start_time_str = (booking.get('booking_time') or '').split('-')[0].strip()
+        return datetime.strptime(f"{booking.get('booking_date')} {start_time_str}", '%Y-%m-%d %H:%M') > now
+    # Malformed legacy rows are simply not deletable.
+    except (ValueError, TypeError) as e:
+        print(f"Warn: Error parsing date/time for delete check on Booking ID {booking.get('id')}: {e}"); return False
+
 # --- Route: Patient Dashboard Page ---
 # Decorator maps '/patient-dashboard/<path:patient_identifier>' URL. 'path' allows name/phone which might contain characters interpreted differently otherwise.
 @app.route('/patient-dashboard/<path:patient_identifier>')
@@ -2081,111 +2385,74 @@ def patient_dashboard(patient_identifier):
         # Flash error and redirect to login if identifier is missing.
         flash('⛔ Patient identifier missing.', 'error'); return redirect(url_for('patient_login'))
 
-    # Use a dictionary to store booking data, using booking ID as key. This automatically handles duplicates
-    # if both name and phone queries return the same booking row.
-    combined_bookings_data = {}
+    # List of bookings shown on this page (with 'is_deletable' flags).
+    processed_bookings = []
     # Flag to indicate if a database error occurred during fetching.
     db_error = False
     # Set a default display name to the identifier itself, may be updated from booking data.
     actual_patient_name = patient_identifier # Default
+    # '?history=1' also reads archived (older) bookings; by default only the hot 'bookings' table is queried.
+    show_history = request.args.get('history') == '1'
+    # '?after=<cursor>' selects the PATIENT_DASHBOARD_PAGE_SIZE bookings just older than the cursor (keyset pagination on
+    # booking_date, booking_time, id, newest first); '?page=N' only numbers the page for display.
+    try:
+        after = patients.decode_booking_cursor(request.args['after']) if request.args.get('after') else None
+        page = max(int(request.args.get('page', 1)), 1) if after else 1
+    # A cursor we didn't issue (or a bad page number) starts again from the newest bookings.
+    except ValueError:
+        after, page = None, 1
+    # Cursor of the next (older) page; None when this is the last page.
+    next_cursor = None
 
     # Start try block for database queries.
     try:
         # Log the identifier being used to fetch bookings.
-        print(f"DEBUG: Fetching bookings for '{patient_identifier}'")
-        # Define the columns needed from the 'bookings' table.
-        select_columns = 'id, doctor_id, doctor_name, patient_name, patient_phone, booking_date, booking_time, status, notes'
+        print(f"DEBUG: Fetching bookings page {page} for '{patient_identifier}'")
+        # The identifier may be a name or a phone number: match either (resolved once).
+        patient = identify_patient(patient_identifier, patient_identifier)
+        # One row more than a page tells whether an older page exists.
+        wanted = PATIENT_DASHBOARD_PAGE_SIZE + 1
+
+        if PATIENT_DASHBOARD_RPC_ENABLED:
+            # One call: matched, merged across tables, ordered, paginated and is_deletable computed in SQL.
+            page_rows = patients.fetch_bookings_page(supabase, patient, include_archive=show_history, limit=wanted, after=after)
+        else:
+            # One ordered query per table (hot, plus archive with history), each reading one page after the cursor.
+            # Define the columns needed from the 'bookings' table.
+            select_columns = 'id, doctor_id, doctor_name, patient_name, patient_phone, booking_date, booking_time, status, notes'
+            rows = []
+            for table_name in archive.booking_tables(show_history):
+                # Fetch by name (case-insensitive substring) OR exact phone number.
+                query = patients.match(supabase.table(table_name).select(select_columns), patient, name_like=True) \
+                    .neq('status', 'Cancelled')
+                if after: query = patients.older_than(query, after)
+                response = patients.order_by(query, 'booking_date.desc', 'booking_time.desc', 'id.desc').limit(wanted).execute()
+                rows.extend(response.data or [])
+            # Merge the tables' results newest first, then keep this page.
+            rows.sort(key=lambda b: (b.get('booking_date') or '', b.get('booking_time') or '', b.get('id') or 0), reverse=True)
+            page_rows = rows[:wanted]
+            # Pending bookings that haven't started yet can still be deleted.
+            now = datetime.now()
+            for booking in page_rows: booking['is_deletable'] = booking_is_deletable(booking, now)
+
+        # Keep one page; the extra row only signals that more exist.
+        processed_bookings = page_rows[:PATIENT_DASHBOARD_PAGE_SIZE]
+        if len(page_rows) > PATIENT_DASHBOARD_PAGE_SIZE: next_cursor = patients.encode_booking_cursor(processed_bookings[-1])
+        # Log the number of bookings on this page.
+        print(f"DEBUG: Bookings on page {page}: {len(processed_bookings)} (more: {next_cursor is not None})")
 
-        # Query 1: Fetch by name using case-insensitive 'ilike'.
-        name_query = supabase.table('bookings').select(select_columns) \
-            .ilike('patient_name', f'%{patient_identifier}%') \
-            .neq('status', 'Cancelled') \
-            .order('booking_date', desc=True).order('booking_time', desc=True) # Order doesn't matter much here as we re-sort later.
-        # Execute the name query.
-        name_response = name_query.execute()
-        # Log how many results were found by name.
-        print(f"DEBUG: Fetch by Name Response count: {len(name_response.data) if name_response.data else 0}")
-        # If data was found by name query.
-        if name_response.data:
-            # Iterate through the results.
-            for booking in name_response.data:
-                 # Use booking ID as key to add/update the entry in the combined dictionary.
-                 if 'id' in booking: combined_bookings_data[booking['id']] = booking
-
-        # Query 2: Fetch by exact phone number match.
-        phone_query = supabase.table('bookings').select(select_columns) \
-             .eq('patient_phone', patient_identifier) \
-             .neq('status', 'Cancelled') \
-             .order('booking_date', desc=True).order('booking_time', desc=True)
-        # Execute the phone query.
-        phone_response = phone_query.execute()
-        # Log how many results were found by phone.
-        print(f"DEBUG: Fetch by Phone Response count: {len(phone_response.data) if phone_response.data else 0}")
-        # If data was found by phone query.
-        if phone_response.data:
-             # Iterate through the results.
-             for booking in phone_response.data:
-                  # Add/update the entry in the combined dictionary using booking ID as key.
-                  if 'id' in booking: combined_bookings_data[booking['id']] = booking
-
-        # Convert the values (booking dictionaries) from the combined dictionary back into a list.
-        # Sort the final combined list properly by date and then time, newest first.
-        bookings_data = sorted(combined_bookings_data.values(),
-                               key=lambda b: (b.get('booking_date', '0000-00-00'), b.get('booking_time', '00:00')), # Use get with defaults for sorting robustness
-                               reverse=True)
-        # Log the total number of unique bookings found.
-        print(f"DEBUG: Total unique bookings found: {len(bookings_data)}")
-
-        # Initialize the list to hold final processed bookings with 'is_deletable' flag.
-        processed_bookings = []
         # Check if any bookings were found for this identifier.
-        if bookings_data:
-             # --- Get display name ---
-             # Get the actual patient name from the most recent booking (first item in the sorted list).
-             # Fallback to the original identifier if 'patient_name' is missing. Strip whitespace.
-             actual_patient_name = bookings_data[0].get('patient_name', patient_identifier).strip()
+        if processed_bookings:
+             # Get the actual patient name from the most recent booking on the page (fallback: the identifier).
+             actual_patient_name = (processed_bookings[0].get('patient_name') or patient_identifier).strip()
              # Log the name that will be displayed on the dashboard.
              print(f"DEBUG: Displaying as '{actual_patient_name}'.")
-
-             # --- Determine if bookings are deletable ---
-             # Get the current time once for comparison.
-             now = datetime.now()
-             # Iterate through the sorted list of unique bookings.
-             for booking in bookings_data:
-                 # Default the 'is_deletable' flag to False.
-                 booking['is_deletable'] = False
-                 # Check if the booking status is 'Pending'. Only pending bookings can potentially be deleted.
-                 if booking.get('status') == 'Pending':
-                      # Start nested try block for parsing date/time of this booking.
-                      try:
-                           # Get date string and time slot string.
-                           date_str = booking.get('booking_date'); time_slot = booking.get('booking_time', '');
-                           # Check if date and time slot seem valid.
-                           if date_str and time_slot and '-' in time_slot and ':' in time_slot:
-                                # Extract the start time (HH:MM).
-                                start_time_str = time_slot.split('-')[0].strip()
-                                # Combine date and start time, parse into a datetime object.
-                                appointment_dt = datetime.strptime(f"{date_str} {start_time_str}", '%Y-%m-%d %H:%M')
-                                # Check if the appointment datetime is in the future compared to now.
-                                if appointment_dt > now:
-                                    # If it's a pending appointment in the future, mark it as deletable.
-                                    booking['is_deletable'] = True
-                           #else: # Optional: log if format seems invalid for delete check.
-                           #    print(f"Warn: Invalid date/time format for delete check on Booking ID {booking.get('id')}")
-                      # Catch any errors during parsing or dictionary access for the delete check.
-                      except (ValueError, IndexError, TypeError, KeyError) as e:
-                           # Log the warning if parsing fails for a specific booking.
-                           print(f"Warn: Error parsing date/time for delete check on Booking ID {booking.get('id')}: {e}")
-                 # Append the booking dictionary (with the potentially updated 'is_deletable' flag) to the final list.
-                 processed_bookings.append(booking)
-        # If no bookings were found for the identifier after both queries.
-        else:
-             # Check if identifier was actually provided (it passed the initial check).
-             if patient_identifier.strip():
-                 # Flash an informational message that no bookings were found.
-                 flash('ℹ️ No active bookings found for this identifier.', 'info');
-                 # Log this information.
-                 print(f"INFO: No active bookings found for '{patient_identifier}'")
+        # If no bookings were found for the identifier on the first page.
+        elif page == 1:
+             # Flash an informational message that no bookings were found.
+             flash('ℹ️ No active bookings found for this identifier.', 'info');
+             # Log this information.
+             print(f"INFO: No active bookings found for '{patient_identifier}'")
 
     # Catch any exceptions during the database queries or processing for the patient dashboard.
     except Exception as e:
@@ -2195,14 +2462,15 @@ def patient_dashboard(patient_identifier):
         flash(f'⛔ Database error loading your bookings: {getattr(e, "message", str(e))}', 'error');
         # Set the database error flag to True.
         db_error = True
-        # `processed_bookings` will remain empty or partially filled if error occurred mid-loop.
 
     # Render the 'patient_dashboard.html' template.
     return render_template('patient_dashboard.html',
                            bookings=processed_bookings,          # Pass the list of processed bookings (with is_deletable).
                            patient_identifier=patient_identifier, # Pass the original identifier used.
                            patient_display_name=actual_patient_name, # Pass the name determined from bookings (or identifier).
-                           error=db_error)                      # Pass the database error flag (template might use this).
+                           error=db_error,                      # Pass the database error flag (template might use this).
+                           show_history=show_history,           # Whether archived bookings are included.
+                           page=page, next_cursor=next_cursor)  # Pagination (page number, cursor of the older page or None).
 # --- END OF REVISED patient_dashboard ---
 
 
@@ -0,0 +1,43 @@
+# --- START OF FILE archive.py ---
+# Cold-storage archival of old bookings, used by app.py.
+# Old and cancelled bookings are moved from `bookings` into `bookings_archive` (migrations/003) in
+# chunks by the archive_bookings() database function, so the hot table - and every dashboard and
+# count query against it - stays small. Dashboards read the archive only when the user asks for
+# older history (see `booking_tables()`).
+
+# Name of the archive table (same columns as `bookings`).
+ARCHIVE_TABLE = 'bookings_archive'
+# Default number of bookings moved per archive_bookings() call.
+ARCHIVE_CHUNK_SIZE = 500
+
+
+# Returns the tables a bookings history query should read.
+def booking_tables(include_archive=False):
+    """Returns ['bookings'] for the hot window, plus the archive table when older history is requested."""
+    return ['bookings', ARCHIVE_TABLE] if include_archive else ['bookings']
+
+# Moves old and cancelled bookings into the archive, chunk by chunk.
+def archive_old_bookings(supabase, horizon_days=365, cancelled_after_days=10, chunk_size=ARCHIVE_CHUNK_SIZE, max_chunks=100):
+    """Archives bookings older than `horizon_days` and cancelled bookings older than `cancelled_after_days`.
+
+    Each chunk is one transactional DELETE ... RETURNING / INSERT in the database. Returns a dict
+    with the number of chunks run and bookings moved.
+    """
+    # Counters for the report.
+    chunks = 0; moved = 0
+    # Keep moving chunks until a chunk comes back short or the per-run cap is reached.
+    while chunks < max_chunks:
+        res = supabase.rpc('archive_bookings', {'p_horizon_days': horizon_days,
+                                                'p_cancelled_after_days': cancelled_after_days,
+                                                'p_limit': chunk_size}).execute()
+        # The function returns the number of rows it moved.
+        moved_now = res.data or 0
+        chunks += 1
+        moved += moved_now
+        if moved_now < chunk_size: break
+    # Build and log the report.
+    report = {'horizon_days': horizon_days, 'cancelled_after_days': cancelled_after_days, 'chunks': chunks, 'moved': moved}
+    print(f"INFO (archive): Moved {moved} booking(s) to {ARCHIVE_TABLE} in {chunks} chunk(s).")
+    return report
+
+# --- END OF FILE archive.py ---
@@ -1,17 +1,32 @@
 import sqlite3
-import io
 import os
+import sys
 import json
+import gzip
+import hashlib
+import argparse
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 
 # --- Configuration ---
 # *** REPLACE THIS WITH THE ACTUAL PATH TO YOUR SQLITE DB FILE ***
 SQLITE_DB_PATH = 'database/bookings.db'
-# Output SQL file (optional, if None, prints to console)
+# Output SQL file (optional, if None, prints to console). A name ending in '.gz' is gzip-compressed.
 OUTPUT_SQL_FILE = 'supabase_import.sql'
 # Number of rows per INSERT statement batch (adjust based on row size/complexity)
+# This is also the cursor fetchmany() size, so at most one batch of rows is held in memory.
 INSERT_BATCH_SIZE = 200
 # Schema name in PostgreSQL (Supabase default)
 PG_SCHEMA = 'public'
+# High-water marks and block checksums for --incremental runs
+SYNC_STATE_FILE = 'as_sync_state.json'
+# Rows per checksum block in incremental mode (rowid // SYNC_BLOCK_ROWS); a changed block is re-sent whole
+SYNC_BLOCK_ROWS = 1000
+# With --jobs > 1, tables with more rows than this are split into rowid ranges exported by separate workers
+PARALLEL_CHUNK_ROWS = 250000
 # --- End Configuration ---
 
 
@@ -54,7 +69,7 @@ def map_sqlite_type_to_pg(sqlite_type, column_name, is_pk, is_auto_increment_lik
          # TIMESTAMPTZ (Timestamp with Time Zone) is generally recommended in Postgres
          return 'TIMESTAMPTZ' # Assumption
     else:
-        print(f"Warning: Unrecognized SQLite type '{sqlite_type}' for column '{column_name}'. Defaulting to TEXT.")
+        print(f"Warning: Unrecognized SQLite type '{sqlite_type}' for column '{column_name}'. Defaulting to TEXT.", file=sys.stderr)
         return 'TEXT'
 
 def format_value_for_pg(value):
@@ -83,192 +98,591 @@ def format_value_for_pg(value):
         return f"'{escaped_value}'"
 
 
-def generate_supabase_sql(db_path, output_file=None):
-    """Connects to SQLite DB, reads schema & data, generates PG SQL."""
+def format_value_for_copy_text(value):
+    """Formats a Python value as one field of a COPY ... FROM stdin (text format) data line."""
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (int, float)):
+        return str(value)
+    elif isinstance(value, bytes):
+        # bytea hex input; the backslash itself must be escaped in COPY text format
+        return f"\\\\x{value.hex()}"
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+    # Escape backslash first, then the characters that delimit fields/rows (JSON text goes through here unchanged otherwise)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def format_value_for_copy_csv(value):
+    """Formats a Python value as one field of a COPY ... FROM stdin WITH (FORMAT csv) data line."""
+    if value is None:
+        # Unquoted empty field = NULL in Postgres CSV (a quoted "" is an empty string)
+        return ''
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (int, float)):
+        return str(value)
+    elif isinstance(value, bytes):
+        value = f"\\x{value.hex()}"
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+    # Always quote text so embedded commas, newlines and a lone "\." line are safe
+    return '"' + value.replace('"', '""') + '"'
+
+
+@contextmanager
+def open_sql_output(output_file=None, use_gzip=False):
+    """Yields a text stream to write SQL to: a (optionally gzip-compressed) file, or stdout if output_file is None."""
+    if output_file is None:
+        if use_gzip:
+            # Compressed bytes straight to stdout (e.g. `python as.py --stdout --gzip > dump.sql.gz`)
+            with gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8') as f:
+                yield f
+        else:
+            yield sys.stdout
+    elif use_gzip or output_file.endswith('.gz'):
+        with gzip.open(output_file, 'wt', encoding='utf-8') as f:
+            yield f
+    else:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            yield f
+
+
+def write_sql_header(out):
+    """Writes the session settings that start every generated script."""
+    out.write(f"-- SQLite to PostgreSQL Conversion Script Output --\n")
+    out.write(f"-- Generated on: {datetime.now().isoformat()} --\n\n")
+    out.write(f"SET statement_timeout = 0;\n")
+    out.write(f"SET lock_timeout = 0;\n")
+    out.write(f"SET idle_in_transaction_session_timeout = 0;\n")
+    out.write(f"SET client_encoding = 'UTF8';\n")
+    out.write(f"SET standard_conforming_strings = on;\n")
+    out.write(f"SELECT pg_catalog.set_config('search_path', '', false);\n")
+    out.write(f"SET check_function_bodies = false;\n")
+    out.write(f"SET xmloption = content;\n")
+    out.write(f"SET client_min_messages = warning;\n")
+    out.write(f"SET row_security = off;\n\n")
+    # out.write(f"CREATE SCHEMA IF NOT EXISTS {PG_SCHEMA};\n") # Schema usually exists
+    # out.write(f"ALTER SCHEMA {PG_SCHEMA} OWNER TO postgres; -- Adjust owner if needed\n\n")
+
+
+def list_tables(conn):
+    """Returns the user table names in the SQLite database."""
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def write_table_schema(conn, table_name, out):
+    """Writes DROP/CREATE TABLE for one table and returns its FOREIGN KEY statements (written later)."""
+    print(f"Processing schema for table: {table_name}", file=sys.stderr)
+    out.write(f"\n-- Schema for table: {table_name} --\n")
+    out.write(f"DROP TABLE IF EXISTS {PG_SCHEMA}.\"{table_name}\" CASCADE;\n") # Drop if exists
+    out.write(f"CREATE TABLE {PG_SCHEMA}.\"{table_name}\" (\n")
+
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info('{table_name}');")
+    columns_info = cursor.fetchall()
+
+    # Detect if integer primary key behaves like auto-increment
+    pk_cols = [col['name'] for col in columns_info if col['pk'] > 0]
+    is_auto_increment_like = False
+    if len(pk_cols) == 1:
+         pk_col_name = pk_cols[0]
+         pk_col_info = next((col for col in columns_info if col['name'] == pk_col_name), None)
+         # Simple check: if PK is INTEGER type in SQLite, likely auto-increment
+         if pk_col_info and 'INT' in (pk_col_info['type'] or '').upper():
+             is_auto_increment_like = True
+
+
+    column_definitions = []
+    for i, col in enumerate(columns_info):
+        col_name = col['name']
+        sqlite_type = col['type']
+        is_pk = col['pk'] > 0
+        is_not_null = col['notnull'] == 1
+        default_val = col['dflt_value']
+
+        pg_type_mapping = map_sqlite_type_to_pg(sqlite_type, col_name, is_pk, is_auto_increment_like and len(pk_cols) == 1)
+
+        col_def = f"    \"{col_name}\" {pg_type_mapping}"
+
+         # Add NOT NULL constraint *unless* type already includes PRIMARY KEY
+        if is_not_null and 'PRIMARY KEY' not in pg_type_mapping:
+            col_def += " NOT NULL"
+
+        # Handle DEFAULT values (basic handling, might need adjustment)
+        if default_val is not None:
+             # Special cases for current time
+             if 'CURRENT_TIMESTAMP' in str(default_val).upper():
+                  col_def += " DEFAULT now()"
+             elif 'CURRENT_DATE' in str(default_val).upper():
+                  col_def += " DEFAULT CURRENT_DATE"
+             elif 'CURRENT_TIME' in str(default_val).upper():
+                  col_def += " DEFAULT CURRENT_TIME"
+             else:
+                  # Use the formatting function for default constants
+                  col_def += f" DEFAULT {format_value_for_pg(default_val)}"
+
+        column_definitions.append(col_def)
+
+     # Add multi-column primary key constraint if needed (and not handled by SERIAL types)
+    if len(pk_cols) > 1:
+         quoted_pk_cols = ', '.join(f'"{col}"' for col in pk_cols)
+         pk_constraint = f"    PRIMARY KEY ({quoted_pk_cols})"
+         column_definitions.append(pk_constraint)
+
+
+    out.write(",\n".join(column_definitions))
+    out.write("\n);\n")
+    # Add table owner if needed (usually handled by Supabase role)
+    # out.write(f"ALTER TABLE {PG_SCHEMA}.\"{table_name}\" OWNER TO postgres;\n")
+
+    # Collect foreign key definitions to add after all tables are created
+    foreign_keys_sql = []
+    cursor.execute(f"PRAGMA foreign_key_list('{table_name}');")
+    fks = cursor.fetchall()
+    for fk in fks:
+        fk_id = fk['id'] # Used to group composite FKs if any
+        from_col = fk['from']
+        target_table = fk['table']
+        to_col = fk['to']
+        on_update = fk['on_update'].upper()
+        on_delete = fk['on_delete'].upper()
+
+        fk_sql = f"ALTER TABLE ONLY {PG_SCHEMA}.\"{table_name}\" ADD CONSTRAINT \"{table_name}_{from_col}_fk_{fk_id}\" FOREIGN KEY (\"{from_col}\") REFERENCES {PG_SCHEMA}.\"{target_table}\"(\"{to_col}\")"
+        if on_update != 'NO ACTION': fk_sql += f" ON UPDATE {on_update}"
+        if on_delete != 'NO ACTION': fk_sql += f" ON DELETE {on_delete}"
+        fk_sql += ";\n"
+        foreign_keys_sql.append(fk_sql)
+    return foreign_keys_sql
+
+
+def select_table_rows(conn, table_name, key_range=None):
+    """Returns a cursor over a table's rows, optionally limited to rowid range [start, end)."""
+    cursor = conn.cursor()
+    if key_range is None:
+        cursor.execute(f"SELECT * FROM \"{table_name}\";")
+    else:
+        cursor.execute(f"SELECT * FROM \"{table_name}\" WHERE rowid >= ? AND rowid < ? ORDER BY rowid;", key_range)
+    return cursor
+
+
+def write_table_data(conn, table_name, out, batch_size=INSERT_BATCH_SIZE, data_format='insert', key_range=None):
+    """Streams one table's rows as batched INSERT statements or a COPY block. Returns the number of rows written.
+
+    data_format is 'insert', 'copy' (COPY text format) or 'copy-csv'. Rows are pulled with
+    fetchmany(batch_size) and each batch is written out immediately, so memory use stays at
+    one batch regardless of table size. key_range=(start, end) exports only that rowid range
+    (used by the parallel export).
+    """
+    if data_format in ('copy', 'copy-csv'):
+        return write_table_copy(conn, table_name, out, batch_size, csv_mode=(data_format == 'copy-csv'), key_range=key_range)
+
+    range_label = f" (rowid {key_range[0]}..{key_range[1] - 1})" if key_range else ""
+    print(f"Processing data for table: {table_name}{range_label}", file=sys.stderr)
+    out.write(f"\n-- Data for table: {table_name}{range_label} --\n")
+
+    cursor = select_table_rows(conn, table_name, key_range)
+
+    # Get column names in the correct order from the cursor description
+    column_names = [description[0] for description in cursor.description]
+    quoted_column_names = ', '.join(f'\"{name}\"' for name in column_names)
+
+    insert_prefix = f"INSERT INTO {PG_SCHEMA}.\"{table_name}\" ({quoted_column_names}) VALUES\n"
+
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        # Map Python row values to SQL formatted strings and write the batch as one INSERT
+        out.write(insert_prefix)
+        out.write(",\n".join(f"({', '.join(format_value_for_pg(value) for value in row)})" for row in rows))
+        out.write(";\n")
+        print(f"  Generated INSERT batch for rows {row_count + 1} to {row_count + len(rows)}", file=sys.stderr)
+        row_count += len(rows)
+
+    if row_count == 0:
+        print(f"Table '{table_name}' is empty. Skipping INSERT.", file=sys.stderr)
+    return row_count
+
+
+def write_table_copy(conn, table_name, out, batch_size=INSERT_BATCH_SIZE, csv_mode=False, key_range=None):
+    """Streams one table's rows as a single COPY ... FROM stdin block. Returns the number of rows written."""
+    range_label = f" (rowid {key_range[0]}..{key_range[1] - 1})" if key_range else ""
+    print(f"Processing data for table: {table_name}{range_label} (COPY {'csv' if csv_mode else 'text'})", file=sys.stderr)
+    out.write(f"\n-- Data for table: {table_name}{range_label} --\n")
+
+    cursor = select_table_rows(conn, table_name, key_range)
+    column_names = [description[0] for description in cursor.description]
+    quoted_column_names = ', '.join(f'\"{name}\"' for name in column_names)
+
+    # Field formatter and separator for the chosen COPY flavour
+    format_field = format_value_for_copy_csv if csv_mode else format_value_for_copy_text
+    separator = ',' if csv_mode else '\t'
+
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        # Open the COPY block lazily so empty tables produce no block at all
+        if row_count == 0:
+            options = " WITH (FORMAT csv)" if csv_mode else ""
+            out.write(f"COPY {PG_SCHEMA}.\"{table_name}\" ({quoted_column_names}) FROM stdin{options};\n")
+        for row in rows:
+            out.write(separator.join(format_field(value) for value in row))
+            out.write("\n")
+        row_count += len(rows)
+
+    if row_count:
+        # End-of-data marker
+        out.write("\\.\n")
+        print(f"  Generated COPY block with {row_count} rows", file=sys.stderr)
+    else:
+        print(f"Table '{table_name}' is empty. Skipping COPY.", file=sys.stderr)
+    return row_count
+
+
+def plan_table_parts(conn, table_name, chunk_rows=PARALLEL_CHUNK_ROWS):
+    """Splits a table into rowid ranges of about chunk_rows rows. Returns a list of key ranges (None = whole table)."""
+    try:
+        lo, hi, count = conn.execute(f"SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM \"{table_name}\";").fetchone()
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID table: export it in one piece
+        return [None]
+    if count <= chunk_rows:
+        return [None]
+    # Even split of the rowid span; gaps from deleted rows only make some chunks smaller
+    num_chunks = -(-count // chunk_rows)
+    step = -(-(hi - lo + 1) // num_chunks)
+    return [(start, min(start + step, hi + 1)) for start in range(lo, hi + 1, step)]
+
+
+def export_table_part(db_path, table_name, part_path, batch_size, data_format, key_range):
+    """Worker process entry point: exports one table (or rowid range) to its own part file. Returns the row count."""
+    # Each worker opens its own read-only connection; SQLite connections can't be shared across processes
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        with open(part_path, 'w', encoding='utf-8') as part:
+            return write_table_data(conn, table_name, part, batch_size, data_format, key_range)
+    finally:
+        conn.close()
+
+
+def write_tables_data_parallel(conn, db_path, tables, out, batch_size=INSERT_BATCH_SIZE, data_format='insert', jobs=2):
+    """Exports the data of all tables with `jobs` worker processes, then appends the part files to out in table order."""
+    # One part per table, or per rowid range for tables above PARALLEL_CHUNK_ROWS
+    parts = [(table_name, key_range) for table_name in tables for key_range in plan_table_parts(conn, table_name)]
+    print(f"Exporting {len(parts)} part(s) with {jobs} worker process(es)", file=sys.stderr)
+
+    part_dir = tempfile.mkdtemp(prefix='as_export_parts_')
+    try:
+        part_paths = [os.path.join(part_dir, f"part_{i:05d}.sql") for i in range(len(parts))]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(export_table_part, db_path, table_name, part_path, batch_size, data_format, key_range)
+                       for (table_name, key_range), part_path in zip(parts, part_paths)]
+            # result() re-raises a worker's exception here, aborting the export
+            row_count = sum(future.result() for future in futures)
+        # Concatenate in plan order so each table's rows stay together and in rowid order
+        for part_path in part_paths:
+            with open(part_path, 'r', encoding='utf-8') as part:
+                shutil.copyfileobj(part, out)
+        return row_count
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+
+def generate_supabase_sql(db_path, output_file=None, use_gzip=False, batch_size=INSERT_BATCH_SIZE, data_format='insert', jobs=1):
+    """Connects to SQLite DB, reads schema & data, streams PG SQL to output_file (or stdout).
+
+    data_format selects how rows are written: 'insert' (multi-row INSERT batches), 'copy'
+    (COPY text format) or 'copy-csv' (COPY CSV format). COPY output must be run with psql
+    (e.g. `psql "$DATABASE_URL" -f supabase_import.sql`); the Supabase SQL editor cannot feed stdin.
+    With jobs > 1 the table data is exported by worker processes; the script layout
+    (schema, then data, then foreign keys) is the same as a sequential run.
+    """
 
     if not os.path.exists(db_path):
-        print(f"Error: SQLite database file not found at '{db_path}'")
+        print(f"Error: SQLite database file not found at '{db_path}'", file=sys.stderr)
         return
 
-    print(f"Connecting to SQLite database: {db_path}")
+    # Progress messages go to stderr so stdout can carry the SQL itself.
+    print(f"Connecting to SQLite database: {db_path}", file=sys.stderr)
     conn = None
     try:
         conn = sqlite3.connect(db_path)
         # Use dictionary row factory for easier access by column name
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
 
         # Get list of tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
-        tables = [row['name'] for row in cursor.fetchall()]
-        print(f"Found tables: {tables}")
-
-        # Use io.StringIO to build the SQL string efficiently
-        sql_output = io.StringIO()
-        sql_output.write(f"-- SQLite to PostgreSQL Conversion Script Output --\n")
-        sql_output.write(f"-- Generated on: {datetime.now().isoformat()} --\n\n")
-        sql_output.write(f"SET statement_timeout = 0;\n")
-        sql_output.write(f"SET lock_timeout = 0;\n")
-        sql_output.write(f"SET idle_in_transaction_session_timeout = 0;\n")
-        sql_output.write(f"SET client_encoding = 'UTF8';\n")
-        sql_output.write(f"SET standard_conforming_strings = on;\n")
-        sql_output.write(f"SELECT pg_catalog.set_config('search_path', '', false);\n")
-        sql_output.write(f"SET check_function_bodies = false;\n")
-        sql_output.write(f"SET xmloption = content;\n")
-        sql_output.write(f"SET client_min_messages = warning;\n")
-        sql_output.write(f"SET row_security = off;\n\n")
-        # sql_output.write(f"CREATE SCHEMA IF NOT EXISTS {PG_SCHEMA};\n") # Schema usually exists
-        # sql_output.write(f"ALTER SCHEMA {PG_SCHEMA} OWNER TO postgres; -- Adjust owner if needed\n\n")
-
-
-        # Process each table for schema (CREATE TABLE)
-        print("\n--- Generating CREATE TABLE statements ---")
-        foreign_keys_sql = [] # Store FK constraints to add later
-        for table_name in tables:
-            print(f"Processing schema for table: {table_name}")
-            sql_output.write(f"\n-- Schema for table: {table_name} --\n")
-            sql_output.write(f"DROP TABLE IF EXISTS {PG_SCHEMA}.\"{table_name}\" CASCADE;\n") # Drop if exists
-            sql_output.write(f"CREATE TABLE {PG_SCHEMA}.\"{table_name}\" (\n")
-
-            cursor.execute(f"PRAGMA table_info('{table_name}');")
-            columns_info = cursor.fetchall()
-
-            # Detect if integer primary key behaves like auto-increment
-            pk_cols = [col['name'] for col in columns_info if col['pk'] > 0]
-            is_auto_increment_like = False
-            if len(pk_cols) == 1:
-                 pk_col_name = pk_cols[0]
-                 pk_col_info = next((col for col in columns_info if col['name'] == pk_col_name), None)
-                 # Simple check: if PK is INTEGER type in SQLite, likely auto-increment
-                 if pk_col_info and 'INT' in (pk_col_info['type'] or '').upper():
-                     is_auto_increment_like = True
-
-
-            column_definitions = []
-            for i, col in enumerate(columns_info):
-                col_name = col['name']
-                sqlite_type = col['type']
-                is_pk = col['pk'] > 0
-                is_not_null = col['notnull'] == 1
-                default_val = col['dflt_value']
-
-                pg_type_mapping = map_sqlite_type_to_pg(sqlite_type, col_name, is_pk, is_auto_increment_like and len(pk_cols) == 1)
-
-                col_def = f"    \"{col_name}\" {pg_type_mapping}"
-
-                 # Add NOT NULL constraint *unless* type already includes PRIMARY KEY
-                if is_not_null and 'PRIMARY KEY' not in pg_type_mapping:
-                    col_def += " NOT NULL"
-
-                # Handle DEFAULT values (basic handling, might need adjustment)
-                if default_val is not None:
-                     # Special cases for current time
-                     if 'CURRENT_TIMESTAMP' in str(default_val).upper():
-                          col_def += " DEFAULT now()"
-                     elif 'CURRENT_DATE' in str(default_val).upper():
-                          col_def += " DEFAULT CURRENT_DATE"
-                     elif 'CURRENT_TIME' in str(default_val).upper():
-                          col_def += " DEFAULT CURRENT_TIME"
-                     else:
-                          # Use the formatting function for default constants
-                          col_def += f" DEFAULT {format_value_for_pg(default_val)}"
-
-                column_definitions.append(col_def)
-
-             # Add multi-column primary key constraint if needed (and not handled by SERIAL types)
-            if len(pk_cols) > 1:
-                 pk_constraint = f",\n    PRIMARY KEY ({', '.join(f'\"{col}\"' for col in pk_cols)})"
-                 column_definitions.append(pk_constraint)
-             # Remove trailing comma from the *last non-PK* definition if PK is separate
-            elif not column_definitions[-1].strip().endswith(')') and len(pk_cols) > 1 : # Check last item is not already PK clause
-                 pass # PK clause already added
-
-
-            sql_output.write(",\n".join(column_definitions))
-            sql_output.write("\n);\n")
-            # Add table owner if needed (usually handled by Supabase role)
-            # sql_output.write(f"ALTER TABLE {PG_SCHEMA}.\"{table_name}\" OWNER TO postgres;\n")
-
-            # Store foreign key definitions to add after all tables are created
-            cursor.execute(f"PRAGMA foreign_key_list('{table_name}');")
-            fks = cursor.fetchall()
-            if fks:
-                for fk in fks:
-                    fk_id = fk['id'] # Used to group composite FKs if any
-                    from_col = fk['from']
-                    target_table = fk['table']
-                    to_col = fk['to']
-                    on_update = fk['on_update'].upper()
-                    on_delete = fk['on_delete'].upper()
-
-                    fk_sql = f"ALTER TABLE ONLY {PG_SCHEMA}.\"{table_name}\" ADD CONSTRAINT \"{table_name}_{from_col}_fk_{fk_id}\" FOREIGN KEY (\"{from_col}\") REFERENCES {PG_SCHEMA}.\"{target_table}\"(\"{to_col}\")"
-                    if on_update != 'NO ACTION': fk_sql += f" ON UPDATE {on_update}"
-                    if on_delete != 'NO ACTION': fk_sql += f" ON DELETE {on_delete}"
-                    fk_sql += ";\n"
-                    foreign_keys_sql.append(fk_sql)
-
-        # Process each table for data (INSERT INTO)
-        print("\n--- Generating INSERT INTO statements ---")
-        for table_name in tables:
-            print(f"Processing data for table: {table_name}")
-            sql_output.write(f"\n-- Data for table: {table_name} --\n")
-
-            cursor.execute(f"SELECT * FROM \"{table_name}\";") # Fetch all rows
-            rows = cursor.fetchall()
-
-            if not rows:
-                print(f"Table '{table_name}' is empty. Skipping INSERT.")
-                continue
-
-            # Get column names in the correct order from the cursor description
-            column_names = [description[0] for description in cursor.description]
-            quoted_column_names = ', '.join(f'\"{name}\"' for name in column_names)
-
-            insert_prefix = f"INSERT INTO {PG_SCHEMA}.\"{table_name}\" ({quoted_column_names}) VALUES\n"
-
-            value_rows = []
-            for i, row in enumerate(rows):
-                # Map Python row values to SQL formatted strings
-                formatted_values = [format_value_for_pg(row[col_name]) for col_name in column_names]
-                value_rows.append(f"({', '.join(formatted_values)})")
-
-                # Write INSERT statement in batches
-                if len(value_rows) >= INSERT_BATCH_SIZE or i == len(rows) - 1:
-                    sql_output.write(insert_prefix)
-                    sql_output.write(",\n".join(value_rows))
-                    sql_output.write(";\n")
-                    print(f"  Generated INSERT batch for rows {i - len(value_rows) + 1} to {i+1}")
-                    value_rows = [] # Reset batch
-
-
-        # Add Foreign Key constraints at the end
-        if foreign_keys_sql:
-            print("\n--- Generating FOREIGN KEY constraints ---")
-            sql_output.write("\n\n-- Foreign Key Constraints --\n")
-            for fk_sql in foreign_keys_sql:
-                sql_output.write(fk_sql)
-
-
-        # Write the output
-        generated_sql = sql_output.getvalue()
+        tables = list_tables(conn)
+        print(f"Found tables: {tables}", file=sys.stderr)
+
+        with open_sql_output(output_file, use_gzip) as out:
+            write_sql_header(out)
+
+            # Process each table for schema (CREATE TABLE)
+            print("\n--- Generating CREATE TABLE statements ---", file=sys.stderr)
+            foreign_keys_sql = [] # Store FK constraints to add later
+            for table_name in tables:
+                foreign_keys_sql.extend(write_table_schema(conn, table_name, out))
+
+            # Process each table for data (INSERT INTO or COPY)
+            print(f"\n--- Generating {'COPY' if data_format != 'insert' else 'INSERT INTO'} statements ---", file=sys.stderr)
+            if jobs > 1:
+                write_tables_data_parallel(conn, db_path, tables, out, batch_size, data_format, jobs)
+            else:
+                for table_name in tables:
+                    write_table_data(conn, table_name, out, batch_size, data_format)
+
+            # Add Foreign Key constraints at the end
+            if foreign_keys_sql:
+                print("\n--- Generating FOREIGN KEY constraints ---", file=sys.stderr)
+                out.write("\n\n-- Foreign Key Constraints --\n")
+                for fk_sql in foreign_keys_sql:
+                    out.write(fk_sql)
+
         if output_file:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(generated_sql)
-            print(f"\nSQL script successfully written to: {output_file}")
-        else:
-            print("\n--- Generated SQL Script ---")
-            print(generated_sql)
-            print("--- End of SQL Script ---")
+            print(f"\nSQL script successfully written to: {output_file}", file=sys.stderr)
 
     except sqlite3.Error as e:
-        print(f"An error occurred with the SQLite database: {e}")
+        print(f"An error occurred with the SQLite database: {e}", file=sys.stderr)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        print(f"An unexpected error occurred: {e}", file=sys.stderr)
     finally:
         if conn:
             conn.close()
-            print("SQLite connection closed.")
+            print("SQLite connection closed.", file=sys.stderr)
+
+
+# --- Incremental sync (--incremental) ---
+# Instead of DROP/CREATE/INSERT, emits upserts for rows that are new or changed since the last run.
+# New rows are found with a rowid high-water mark; changed rows are found by comparing per-block
+# checksums (SYNC_BLOCK_ROWS rowids per block) against the ones saved in the state file. The state
+# file is only replaced after the SQL has been completely written, and the SQL runs in one
+# transaction with idempotent upserts, so an interrupted generate or load can simply be re-run.
+
+
+def load_sync_state(state_file):
+    """Reads the incremental sync state file. Returns an empty state if it doesn't exist yet."""
+    if not os.path.exists(state_file):
+        return {'tables': {}}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_sync_state(state_file, state):
+    """Atomically replaces the state file (write to a temp file, then rename)."""
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_file)
+
+
+def order_tables_by_dependencies(conn, tables):
+    """Orders tables so FOREIGN KEY parents come before children (upserts run against live constraints)."""
+    parents = {table: {fk['table'] for fk in conn.execute(f"PRAGMA foreign_key_list('{table}');").fetchall()} for table in tables}
+    ordered = []
+    def visit(table, seen):
+        if table in ordered or table in seen or table not in parents:
+            return
+        seen.add(table)
+        for parent in sorted(parents[table]):
+            visit(parent, seen)
+        ordered.append(table)
+    for table in tables:
+        visit(table, set())
+    return ordered
+
+
+def write_upsert_batch(table_name, column_names, pk_cols, rows, out):
+    """Writes one multi-row INSERT ... ON CONFLICT (pk) DO UPDATE statement."""
+    quoted_column_names = ', '.join(f'\"{name}\"' for name in column_names)
+    quoted_pk_cols = ', '.join(f'\"{name}\"' for name in pk_cols)
+    update_cols = [name for name in column_names if name not in pk_cols]
+    out.write(f"INSERT INTO {PG_SCHEMA}.\"{table_name}\" ({quoted_column_names}) VALUES\n")
+    out.write(",\n".join(f"({', '.join(format_value_for_pg(value) for value in row)})" for row in rows))
+    if update_cols:
+        out.write(f"\nON CONFLICT ({quoted_pk_cols}) DO UPDATE SET ")
+        out.write(', '.join(f'\"{name}\" = EXCLUDED.\"{name}\"' for name in update_cols))
+    else:
+        out.write(f"\nON CONFLICT ({quoted_pk_cols}) DO NOTHING")
+    out.write(";\n")
+
+
+def write_table_upserts(conn, table_name, out, table_state, batch_size=INSERT_BATCH_SIZE):
+    """Writes upserts for one table's new/changed rows. Returns (new table state, rows upserted).
+
+    table_state is this table's entry from the previous run ({} on the first run, which sends everything).
+    """
+    print(f"Processing incremental data for table: {table_name}", file=sys.stderr)
+    columns_info = conn.execute(f"PRAGMA table_info('{table_name}');").fetchall()
+    column_names = [col['name'] for col in columns_info]
+    pk_cols = [col['name'] for col in sorted(columns_info, key=lambda col: col['pk']) if col['pk'] > 0]
+    if not pk_cols:
+        print(f"Warning: Table '{table_name}' has no PRIMARY KEY; it can't be upserted. Skipping.", file=sys.stderr)
+        return table_state, 0
+
+    # A schema change invalidates the saved checksums: send the whole table again
+    if table_state.get('columns') != column_names:
+        table_state = {}
+    old_max_rowid = table_state.get('max_rowid', 0)
+    old_hashes = table_state.get('block_hashes', {})
+
+    try:
+        cursor = conn.execute(f"SELECT rowid, * FROM \"{table_name}\" ORDER BY rowid;")
+    except sqlite3.OperationalError:
+        print(f"Warning: Table '{table_name}' has no rowid; incremental sync not supported. Skipping.", file=sys.stderr)
+        return table_state, 0
+
+    new_hashes = {}
+    pending = []        # Rows waiting to be written in the next upsert batch
+    upserted = 0
+    max_rowid = old_max_rowid
+    max_created_at = table_state.get('max_created_at')
+    created_idx = column_names.index('created_at') if 'created_at' in column_names else None
+    # Current block: old rows are held until the block ends, since only then do we know if it changed
+    block_id, block_old_rows, old_hasher, all_hasher = None, [], None, None
+
+    def flush(force=False):
+        nonlocal pending, upserted
+        while pending and (force or len(pending) >= batch_size):
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            write_upsert_batch(table_name, column_names, pk_cols, batch, out)
+            upserted += len(batch)
+
+    def close_block():
+        # Re-send the block's existing rows if their checksum differs from last run's
+        if block_id is None:
+            return
+        new_hashes[str(block_id)] = all_hasher.hexdigest()
+        if block_old_rows and old_hasher.hexdigest() != old_hashes.get(str(block_id)):
+            pending.extend(block_old_rows)
+            flush()
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            rowid, values = row[0], tuple(row[1:])
+            if rowid // SYNC_BLOCK_ROWS != block_id:
+                close_block()
+                block_id, block_old_rows = rowid // SYNC_BLOCK_ROWS, []
+                old_hasher, all_hasher = hashlib.sha1(), hashlib.sha1()
+            row_digest = repr((rowid, values)).encode('utf-8')
+            all_hasher.update(row_digest)
+            if rowid <= old_max_rowid:
+                # Existing row: part of the change-detection checksum
+                old_hasher.update(row_digest)
+                block_old_rows.append(values)
+            else:
+                # New row past the high-water mark: always sent
+                pending.append(values)
+                flush()
+            max_rowid = max(max_rowid, rowid)
+            if created_idx is not None and values[created_idx] is not None:
+                max_created_at = max(max_created_at or '', str(values[created_idx]))
+    close_block()
+    flush(force=True)
+
+    # Keep the serial sequence ahead of the synced ids so rows inserted on the Supabase side don't collide
+    if upserted and len(pk_cols) == 1 and 'INT' in (next(col for col in columns_info if col['name'] == pk_cols[0])['type'] or '').upper():
+        out.write(f"SELECT setval(pg_get_serial_sequence('{PG_SCHEMA}.\"{table_name}\"', '{pk_cols[0]}'), "
+                  f"GREATEST((SELECT MAX(\"{pk_cols[0]}\") FROM {PG_SCHEMA}.\"{table_name}\"), 1));\n")
+
+    print(f"  {upserted} new/changed row(s) (high-water rowid {old_max_rowid} -> {max_rowid})", file=sys.stderr)
+    new_state = {'columns': column_names, 'max_rowid': max_rowid, 'max_created_at': max_created_at,
+                 'block_hashes': new_hashes, 'synced_at': datetime.now().isoformat()}
+    return new_state, upserted
+
+
+def generate_incremental_sql(db_path, output_file=None, state_file=SYNC_STATE_FILE, use_gzip=False, batch_size=INSERT_BATCH_SIZE):
+    """Writes upserts for rows added or changed since the last run, then updates state_file.
+
+    Tables must already exist in Postgres (from a full export or the migrations). Rows deleted
+    in SQLite are not deleted in Postgres, since Postgres may hold rows that never came from
+    this SQLite file. If loading the script fails, re-run the same file or regenerate it; the
+    state only moves forward once a script has been completely written.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: SQLite database file not found at '{db_path}'", file=sys.stderr)
+        return
+
+    print(f"Connecting to SQLite database: {db_path}", file=sys.stderr)
+    state = load_sync_state(state_file)
+    if state.get('db_path') not in (None, os.path.abspath(db_path)):
+        print(f"Warning: State file '{state_file}' was written for '{state['db_path']}'. Starting a full sync.", file=sys.stderr)
+        state = {'tables': {}}
+    conn = None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        tables = order_tables_by_dependencies(conn, list_tables(conn))
+        print(f"Found tables (dependency order): {tables}", file=sys.stderr)
+
+        new_tables_state = {}
+        total = 0
+        with open_sql_output(output_file, use_gzip) as out:
+            write_sql_header(out)
+            out.write(f"-- Incremental sync since: {state.get('synced_at', 'never')} --\n")
+            # One transaction: a failed load leaves Postgres unchanged
+            out.write("BEGIN;\n")
+            for table_name in tables:
+                new_tables_state[table_name], count = write_table_upserts(conn, table_name, out, state['tables'].get(table_name, {}), batch_size)
+                total += count
+            out.write("\nCOMMIT;\n")
+
+        # Only advance the high-water marks after the script was fully written
+        save_sync_state(state_file, {'db_path': os.path.abspath(db_path), 'synced_at': datetime.now().isoformat(), 'tables': new_tables_state})
+        print(f"\n{total} row(s) to upsert. State saved to: {state_file}", file=sys.stderr)
+        if output_file:
+            print(f"SQL script successfully written to: {output_file}", file=sys.stderr)
+
+    except sqlite3.Error as e:
+        print(f"An error occurred with the SQLite database: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}", file=sys.stderr)
+    finally:
+        if conn:
+            conn.close()
+            print("SQLite connection closed.", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    """Command-line options; the defaults reproduce the original behaviour (write OUTPUT_SQL_FILE)."""
+    parser = argparse.ArgumentParser(description="Export the SQLite bookings database as a PostgreSQL/Supabase SQL script.")
+    parser.add_argument('--db', default=SQLITE_DB_PATH, help=f"SQLite database path (default: {SQLITE_DB_PATH})")
+    parser.add_argument('--output', '-o', default=OUTPUT_SQL_FILE, help=f"Output file; '.gz' suffix enables gzip (default: {OUTPUT_SQL_FILE})")
+    parser.add_argument('--stdout', action='store_true', help="Write the SQL to stdout instead of a file")
+    parser.add_argument('--gzip', action='store_true', help="Gzip-compress the output")
+    parser.add_argument('--batch-size', type=int, default=INSERT_BATCH_SIZE, help=f"Rows per INSERT/fetchmany batch (default: {INSERT_BATCH_SIZE})")
+    parser.add_argument('--format', choices=['insert', 'copy'], default='insert', help="Row format: batched INSERTs (default) or COPY ... FROM stdin blocks (needs psql)")
+    parser.add_argument('--copy-format', choices=['text', 'csv'], default='text', help="COPY data format when --format copy (default: text)")
+    parser.add_argument('--incremental', action='store_true', help="Emit upserts for new/changed rows only, tracked in --state-file (no DROP/CREATE)")
+    parser.add_argument('--state-file', default=SYNC_STATE_FILE, help=f"High-water mark state for --incremental (default: {SYNC_STATE_FILE})")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help=f"Worker processes for table data; tables over {PARALLEL_CHUNK_ROWS} rows are split by rowid range (default: 1)")
+    args = parser.parse_args(argv)
+    if args.incremental and args.format != 'insert':
+        parser.error("--incremental writes upserts and only supports --format insert")
+    return args
+
 
 # --- Run the script ---
-from datetime import datetime
-generate_supabase_sql(SQLITE_DB_PATH, OUTPUT_SQL_FILE)
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    if args.incremental:
+        generate_incremental_sql(args.db, None if args.stdout else args.output, state_file=args.state_file,
+                                 use_gzip=args.gzip, batch_size=args.batch_size)
+    else:
+        data_format = 'insert' if args.format == 'insert' else ('copy-csv' if args.copy_format == 'csv' else 'copy')
+        generate_supabase_sql(args.db, None if args.stdout else args.output, use_gzip=args.gzip,
+                              batch_size=args.batch_size, data_format=data_format, jobs=args.jobs)
\ No newline at end of file
@@ -0,0 +1,151 @@
+# --- START OF FILE backfill_patients.py ---
+# One-off backfill for the patient identity index (migrations/009): clusters existing bookings (hot and archived)
+# and reviews into patients by normalized phone number, creates the missing `patients` rows and sets patient_id on
+# every unlinked row. New rows are linked by the insert triggers from the migration, so this only has to run once
+# (it is safe to re-run: only rows with patient_id IS NULL are read, and existing patients are kept as they are).
+#
+#   python backfill_patients.py                  # uses SUPABASE_URL / SUPABASE_KEY from .env
+#   python backfill_patients.py --dry-run        # report the clusters without writing anything
+#   python backfill_patients.py --no-archive --page-size 2000
+#
+# A patient's name is taken from their most recent booking/review. Rows without a usable phone number are left
+# unlinked (they are still found by the name/phone fallback queries in app.py when the index is disabled).
+
+# --- Standard Library Imports ---
+import argparse                 # Command-line options.
+import os                       # Environment variables.
+import sys                      # Exit code and stderr output.
+import time                     # Timing for the summary line.
+import traceback                # Detailed error output.
+
+# --- Third-Party Imports ---
+from dotenv import load_dotenv  # Loads SUPABASE_URL / SUPABASE_KEY from .env, like app.py.
+from supabase import create_client # Supabase client.
+
+# --- Local Module Imports ---
+import archive                  # Name of the bookings archive table.
+import patients                 # Phone / name normalization (identical to the SQL functions).
+
+# --- Configuration ---
+# Rows fetched per Supabase request. PostgREST caps responses at 1000 rows by default.
+BACKFILL_PAGE_SIZE = 1000
+# Patients upserted / row ids updated per request.
+BACKFILL_WRITE_BATCH = 500
+# --- End Configuration ---
+
+# Source tables: name -> (name column, phone column, column used to pick the latest name).
+SOURCES = {
+    'bookings': ('patient_name', 'patient_phone', 'booking_date'),
+    archive.ARCHIVE_TABLE: ('patient_name', 'patient_phone', 'booking_date'),
+    'reviews': ('reviewer_name', 'reviewer_phone', 'created_at'),
+}
+
+
+# --- Reading ---
+
+# Yields pages of unlinked rows from a table using keyset pagination on id.
+# Stops only on an empty page: a page can come back shorter than `page_size` (the server's max-rows cap) mid-table.
+def fetch_unlinked(supabase, table_name, columns, page_size=BACKFILL_PAGE_SIZE):
+    last_id = None
+    while True:
+        query = supabase.table(table_name).select(columns).is_('patient_id', 'null').order('id', desc=False).limit(page_size)
+        if last_id is not None: query = query.gt('id', last_id)
+        rows = query.execute().data or []
+        if not rows: return
+        yield rows
+        last_id = rows[-1]['id']
+
+
+# --- Clustering ---
+
+# Groups every unlinked row by normalized phone. Returns (clusters, skipped) where clusters maps
+# phone_norm -> {'name': latest raw name, 'latest': sort key of that name, 'names': set of normalized names,
+# 'rows': {table: [ids]}} and skipped counts rows per table without a usable phone.
+def cluster_rows(supabase, tables, page_size=BACKFILL_PAGE_SIZE):
+    clusters = {}; skipped = {}
+    for table_name in tables:
+        name_col, phone_col, order_col = SOURCES[table_name]
+        for page in fetch_unlinked(supabase, table_name, f"id, {name_col}, {phone_col}, {order_col}", page_size):
+            for row in page:
+                phone_norm = patients.normalize_phone(row.get(phone_col))
+                if not phone_norm:
+                    skipped[table_name] = skipped.get(table_name, 0) + 1; continue
+                cluster = clusters.setdefault(phone_norm, {'name': None, 'latest': '', 'names': set(), 'rows': {}})
+                cluster['rows'].setdefault(table_name, []).append(row['id'])
+                name = (row.get(name_col) or '').strip()
+                if not name: continue
+                cluster['names'].add(patients.normalize_name(name))
+                latest = str(row.get(order_col) or '')
+                if cluster['name'] is None or latest >= cluster['latest']: cluster['name'], cluster['latest'] = name, latest
+        print(f"INFO (backfill_patients): Read {table_name}.")
+    return clusters, skipped
+
+
+# --- Writing ---
+
+# Yields consecutive slices of at most `size` items.
+def chunks(items, size):
+    for start in range(0, len(items), size): yield items[start:start + size]
+
+# Creates the missing patients (existing ones are left untouched) and returns phone_norm -> patient id.
+def upsert_patients(supabase, clusters, batch_size=BACKFILL_WRITE_BATCH):
+    ids = {}
+    for batch in chunks(sorted(clusters), batch_size):
+        payload = [{'phone_norm': phone_norm, 'name_norm': patients.normalize_name(clusters[phone_norm]['name']),
+                    'display_name': clusters[phone_norm]['name']} for phone_norm in batch]
+        supabase.table('patients').upsert(payload, on_conflict='phone_norm', ignore_duplicates=True).execute()
+        res = supabase.table('patients').select('id, phone_norm').in_('phone_norm', batch).execute()
+        ids.update({row['phone_norm']: row['id'] for row in (res.data or [])})
+    return ids
+
+# Sets patient_id on every clustered row; returns the number of rows updated per table.
+def link_rows(supabase, clusters, patient_ids, batch_size=BACKFILL_WRITE_BATCH):
+    linked = {}
+    for phone_norm, cluster in clusters.items():
+        patient_id = patient_ids.get(phone_norm)
+        if patient_id is None: continue
+        for table_name, row_ids in cluster['rows'].items():
+            for batch in chunks(row_ids, batch_size):
+                supabase.table(table_name).update({'patient_id': patient_id}).in_('id', batch).is_('patient_id', 'null').execute()
+            linked[table_name] = linked.get(table_name, 0) + len(row_ids)
+    return linked
+
+
+# --- Command Line ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster existing bookings and reviews into patients and link them (migrations/009).")
+    parser.add_argument('--dry-run', action='store_true', help="Report the clusters without writing anything")
+    parser.add_argument('--page-size', type=int, default=BACKFILL_PAGE_SIZE, help=f"Rows per Supabase read (default: {BACKFILL_PAGE_SIZE})")
+    parser.add_argument('--no-archive', action='store_true', help=f"Skip {archive.ARCHIVE_TABLE}")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    supabase_url = os.environ.get("SUPABASE_URL"); supabase_key = os.environ.get("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        print("ERROR (backfill_patients): SUPABASE_URL and SUPABASE_KEY must be set in the .env file", file=sys.stderr)
+        return 2
+    supabase = create_client(supabase_url, supabase_key)
+    tables = [name for name in SOURCES if not (args.no_archive and name == archive.ARCHIVE_TABLE)]
+    try:
+        started = time.perf_counter()
+        clusters, skipped = cluster_rows(supabase, tables, args.page_size)
+        multi_name = sum(1 for cluster in clusters.values() if len(cluster['names']) > 1)
+        print(f"INFO (backfill_patients): {len(clusters)} patient(s) from {sum(sum(len(ids) for ids in c['rows'].values()) for c in clusters.values())} row(s); "
+              f"{multi_name} used more than one name; skipped without phone: {skipped or 0}.")
+        if args.dry_run: return 0
+        patient_ids = upsert_patients(supabase, clusters)
+        linked = link_rows(supabase, clusters, patient_ids)
+    except Exception as e:
+        print(f"ERROR (backfill_patients): Backfill failed: {e}", file=sys.stderr); traceback.print_exc()
+        return 1
+    print(f"INFO (backfill_patients): Linked {linked} in {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# --- END OF FILE backfill_patients.py ---
@@ -0,0 +1,119 @@
+# Benchmark for as.py: INSERT batches vs COPY blocks.
+# Builds a synthetic SQLite bookings table (default 1,000,000 rows), exports it with each as.py
+# format, and - when a Postgres connection string is given - loads each file with psql and
+# reports the load time.
+#
+#   python bench_export.py                              # export timings and file sizes only
+#   python bench_export.py --dsn "$DATABASE_URL"        # also time `psql -f` loads (needs psql on PATH)
+#   python bench_export.py --rows 100000 --keep         # smaller run, keep the generated files
+
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# as.py is not importable by name ('as' is a keyword), so load it from its path.
+_spec = importlib.util.spec_from_file_location('as_export', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'as.py'))
+as_export = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(as_export)
+
+# Same layout as the real SQLite bookings table.
+BOOKINGS_DDL = '''CREATE TABLE bookings
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   doctor_id INTEGER NOT NULL,
+                   doctor_name TEXT,
+                   patient_name TEXT NOT NULL,
+                   patient_phone TEXT,
+                   booking_date TEXT NOT NULL,
+                   booking_time TEXT NOT NULL,
+                   notes TEXT,
+                   appointment_type TEXT DEFAULT 'Consultation',
+                   status TEXT DEFAULT 'Pending',
+                   ip_address TEXT,
+                   cookie_id TEXT,
+                   fingerprint TEXT,
+                   user_id INTEGER,
+                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'''
+
+# Notes deliberately include quotes, tabs, newlines and backslashes to exercise escaping.
+SAMPLE_NOTES = ['', "Patient's first visit", 'Bring "old" reports', 'Line one\nLine two', 'Tab\tseparated', 'C:\\path\\scan.pdf', None]
+
+
+def build_synthetic_db(path, rows, seed=42):
+    """Creates a SQLite DB at `path` with `rows` synthetic bookings."""
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    slots = [f"{h:02d}:{m:02d} - {h + (m + 30) // 60:02d}:{(m + 30) % 60:02d}" for h in range(8, 17) for m in (0, 30)]
+
+    def generate():
+        for i in range(rows):
+            yield (rng.randint(1, 50), f"Dr. {rng.randint(1, 50)}", f"Patient {i}", f"7{rng.randint(10**8, 10**9 - 1)}",
+                   (start + timedelta(days=rng.randint(0, 730))).isoformat(), rng.choice(slots), rng.choice(SAMPLE_NOTES),
+                   'Consultation', rng.choice(['Pending', 'Completed', 'Cancelled']), f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+                   None, None, None, '2024-01-01 00:00:00')
+
+    conn = sqlite3.connect(path)
+    conn.execute(BOOKINGS_DDL)
+    conn.executemany('''INSERT INTO bookings (doctor_id, doctor_name, patient_name, patient_phone, booking_date, booking_time, notes,
+                        appointment_type, status, ip_address, cookie_id, fingerprint, user_id, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', generate())
+    conn.commit()
+    conn.close()
+
+
+def psql_load(dsn, sql_path):
+    """Runs `psql -f sql_path` against `dsn` and returns the elapsed seconds."""
+    started = time.perf_counter()
+    subprocess.run(['psql', dsn, '-q', '-v', 'ON_ERROR_STOP=1', '-f', sql_path], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare as.py INSERT vs COPY export/load on a synthetic bookings table.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Synthetic bookings rows (default: 1,000,000)")
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN'), help="Postgres connection string for load timing (default: $BENCH_PG_DSN)")
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary directory with the generated files")
+    args = parser.parse_args(argv)
+
+    if args.dsn and not shutil.which('psql'):
+        parser.error("--dsn needs the psql client on PATH")
+
+    workdir = tempfile.mkdtemp(prefix='bench_export_')
+    db_path = os.path.join(workdir, 'bookings.db')
+    print(f"Building synthetic SQLite DB with {args.rows:,} bookings in {workdir} ...", file=sys.stderr)
+    started = time.perf_counter()
+    build_synthetic_db(db_path, args.rows)
+    print(f"  built in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = []
+    for label, data_format in [('insert', 'insert'), ('copy text', 'copy'), ('copy csv', 'copy-csv')]:
+        sql_path = os.path.join(workdir, f"export_{data_format}.sql")
+        started = time.perf_counter()
+        as_export.generate_supabase_sql(db_path, sql_path, data_format=data_format, batch_size=as_export.INSERT_BATCH_SIZE)
+        export_seconds = time.perf_counter() - started
+        load_seconds = psql_load(args.dsn, sql_path) if args.dsn else None
+        results.append((label, export_seconds, os.path.getsize(sql_path), load_seconds))
+
+    print(f"\nResults for {args.rows:,} bookings rows:")
+    print(f"{'format':<12}{'export (s)':>12}{'size (MB)':>12}{'load (s)':>12}")
+    for label, export_seconds, size, load_seconds in results:
+        load_str = f"{load_seconds:.1f}" if load_seconds is not None else 'n/a'
+        print(f"{label:<12}{export_seconds:>12.1f}{size / 1e6:>12.1f}{load_str:>12}")
+    if not args.dsn:
+        print("(pass --dsn or set BENCH_PG_DSN to time the Postgres loads)")
+
+    if args.keep:
+        print(f"\nFiles kept in {workdir}")
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# --- START OF FILE bulk_load.py ---
+# Direct bulk loader: reads the legacy SQLite database (database/bookings.db) and pushes its rows
+# into the Supabase tables with batched PostgREST upserts, instead of generating
+# supabase_import.sql with as.py and pasting it into the SQL editor.
+# Batches are sent by a small thread pool, failed batches are retried with exponential backoff,
+# and a per-table throughput report is printed at the end.
+#
+#   python bulk_load.py                                   # uses SUPABASE_URL / SUPABASE_KEY from .env
+#   python bulk_load.py --batch-size 1000 --concurrency 8 --tables doctors bookings
+#   python bulk_load.py --postgrest-url http://localhost:3000   # plain PostgREST (local stand-in), no /rest/v1 prefix
+#
+# Tables must already exist in Postgres (migrations or an as.py schema export). Upserts conflict on
+# each table's primary key, so the loader can be re-run safely after a partial failure.
+
+# --- Standard Library Imports ---
+import argparse                 # Command-line options.
+import json                     # Decodes JSON text columns (doctor availability) before sending.
+import os                       # Environment variables and file checks.
+import sqlite3                  # Reads the legacy database.
+import sys                      # Exit code and stderr output.
+import threading                # Per-thread API clients.
+import time                     # Backoff sleeps and throughput timing.
+import traceback                # Detailed error output for unexpected failures.
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait # Bounded pool of in-flight batches.
+
+# --- Third-Party Imports ---
+from dotenv import load_dotenv  # Loads SUPABASE_URL / SUPABASE_KEY from .env, like app.py.
+from postgrest import APIError, SyncPostgrestClient # Error type and the plain PostgREST client.
+from postgrest.types import ReturnMethod # `returning=minimal` so the server doesn't echo rows back.
+from supabase import create_client # Supabase client (PostgREST under /rest/v1).
+
+# --- Configuration ---
+# Default SQLite database to load from.
+SQLITE_DB_PATH = 'database/bookings.db'
+# Default rows per upsert request.
+LOAD_BATCH_SIZE = 500
+# Default number of batches in flight at once.
+LOAD_CONCURRENCY = 4
+# Attempts per batch before it is reported as failed.
+LOAD_MAX_ATTEMPTS = 5
+# First retry delay in seconds (doubled after each failed attempt).
+LOAD_RETRY_BACKOFF = 0.5
+# Columns stored as JSON text in SQLite that are JSON/JSONB in Supabase.
+JSON_COLUMNS = {'availability'}
+# --- End Configuration ---
+
+
+# --- Client Setup ---
+
+# Builds a function that returns one API client per worker thread.
+def make_client_factory(postgrest_url=None, postgrest_token=None):
+    """Returns a zero-argument function giving the calling thread its own client.
+
+    With `postgrest_url` a plain PostgREST client is used (e.g. a local stand-in on
+    http://localhost:3000); otherwise a Supabase client is built from SUPABASE_URL / SUPABASE_KEY.
+    """
+    # Thread-local storage so each worker reuses its own HTTP connection pool.
+    local = threading.local()
+    # Resolve Supabase credentials up front so a missing .env fails before any work starts.
+    if not postgrest_url:
+        load_dotenv()
+        supabase_url = os.environ.get("SUPABASE_URL")
+        supabase_key = os.environ.get("SUPABASE_KEY")
+        if not supabase_url or not supabase_key:
+            raise ValueError("ERROR: SUPABASE_URL and SUPABASE_KEY must be set in the .env file (or pass --postgrest-url)")
+
+    # Creates (once per thread) and returns the client.
+    def get_client():
+        if getattr(local, 'client', None) is None:
+            if postgrest_url:
+                # Optional JWT for PostgREST instances that require a role.
+                headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+                if postgrest_token: headers['Authorization'] = f"Bearer {postgrest_token}"
+                local.client = SyncPostgrestClient(postgrest_url, headers=headers, timeout=60)
+            else:
+                local.client = create_client(supabase_url, supabase_key)
+        return local.client
+    return get_client
+
+
+# --- SQLite Reading ---
+
+# Returns the user tables ordered so FOREIGN KEY parents load before their children.
+def list_tables_in_load_order(conn):
+    """Lists SQLite tables with referenced (parent) tables first."""
+    # All user tables (sqlite_sequence etc. excluded).
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")]
+    # Parent tables referenced by each table.
+    parents = {table: {fk[2] for fk in conn.execute(f"PRAGMA foreign_key_list('{table}');")} for table in tables}
+    ordered = []
+    # Depth-first: a table is appended after all of its parents.
+    def visit(table, seen):
+        if table in ordered or table in seen or table not in parents: return
+        seen.add(table)
+        for parent in sorted(parents[table]): visit(parent, seen)
+        ordered.append(table)
+    for table in tables: visit(table, set())
+    return ordered
+
+# Returns the primary key column names of a table (used as the upsert conflict target).
+def primary_key_columns(conn, table_name):
+    """Returns the table's primary key columns in key order."""
+    columns_info = conn.execute(f"PRAGMA table_info('{table_name}');").fetchall()
+    return [col[1] for col in sorted(columns_info, key=lambda col: col[5]) if col[5] > 0]
+
+# Converts one SQLite row into the JSON object sent to PostgREST.
+def row_to_payload(row):
+    """Turns a sqlite3.Row into a dict, decoding JSON text columns."""
+    payload = dict(row)
+    for column in JSON_COLUMNS & payload.keys():
+        value = payload[column]
+        # Only decode strings that look like JSON objects/arrays; anything else is sent unchanged.
+        if isinstance(value, str) and value.lstrip()[:1] in ('{', '['):
+            try: payload[column] = json.loads(value)
+            except ValueError: pass
+    return payload
+
+# Streams a table as lists of row dicts.
+def read_batches(conn, table_name, batch_size):
+    """Yields the table's rows in batches of `batch_size` dicts (only one batch is read at a time)."""
+    cursor = conn.execute(f'SELECT * FROM "{table_name}";')
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows: break
+        yield [row_to_payload(row) for row in rows]
+
+
+# --- Upserting ---
+
+# Decides whether a failed upsert is worth retrying.
+def is_retryable(error):
+    """Returns False for deterministic database errors (bad data / constraint violations), True otherwise."""
+    # PostgREST reports the Postgres SQLSTATE as the error code; classes 22 and 23 won't succeed on retry.
+    if isinstance(error, APIError) and isinstance(error.code, str) and error.code[:2] in ('22', '23'):
+        return False
+    # Timeouts, connection resets, 5xx responses, rate limits...
+    return True
+
+# Sends one batch, retrying transient failures with exponential backoff.
+def upsert_batch(get_client, table_name, rows, on_conflict, max_attempts=LOAD_MAX_ATTEMPTS, backoff=LOAD_RETRY_BACKOFF):
+    """Upserts `rows` into `table_name`. Returns the number of attempts used; raises the last error on failure."""
+    delay = backoff
+    for attempt in range(1, max_attempts + 1):
+        try:
+            get_client().table(table_name).upsert(rows, on_conflict=on_conflict, returning=ReturnMethod.minimal).execute()
+            return attempt
+        except Exception as e:
+            # Give up on the last attempt or on errors a retry can't fix.
+            if attempt == max_attempts or not is_retryable(e):
+                raise
+            print(f"WARN (bulk_load): {table_name} batch failed (attempt {attempt}/{max_attempts}): {e}. Retrying in {delay:.1f}s.", file=sys.stderr)
+            time.sleep(delay)
+            delay *= 2
+
+# Loads one table with up to `concurrency` batches in flight.
+def load_table(get_client, conn, table_name, batch_size=LOAD_BATCH_SIZE, concurrency=LOAD_CONCURRENCY,
+               max_attempts=LOAD_MAX_ATTEMPTS, backoff=LOAD_RETRY_BACKOFF):
+    """Upserts every row of `table_name`. Returns a report dict (rows, batches, retries, failures, seconds)."""
+    # Conflict target for the upsert.
+    pk_cols = primary_key_columns(conn, table_name)
+    report = {'table': table_name, 'rows': 0, 'batches': 0, 'retries': 0, 'failed_batches': 0, 'failed_rows': 0, 'seconds': 0.0}
+    if not pk_cols:
+        print(f"WARN (bulk_load): Table '{table_name}' has no PRIMARY KEY; it can't be upserted. Skipping.", file=sys.stderr)
+        return report
+    on_conflict = ','.join(pk_cols)
+    started = time.perf_counter()
+    # Future -> rows in that batch (for failure reporting).
+    in_flight = {}
+
+    # Collects finished batches into the report.
+    def collect(done):
+        for future in done:
+            rows = in_flight.pop(future)
+            try:
+                attempts = future.result()
+                report['rows'] += len(rows); report['retries'] += attempts - 1
+            except Exception as e:
+                report['failed_batches'] += 1; report['failed_rows'] += len(rows)
+                first, last = rows[0].get(pk_cols[0]), rows[-1].get(pk_cols[0])
+                print(f"ERROR (bulk_load): {table_name} batch {pk_cols[0]} {first}..{last} failed: {e}", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"load-{table_name}") as pool:
+        for rows in read_batches(conn, table_name, batch_size):
+            # Bound memory: wait for a slot before reading more of the table.
+            if len(in_flight) >= concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[pool.submit(upsert_batch, get_client, table_name, rows, on_conflict, max_attempts, backoff)] = rows
+            report['batches'] += 1
+        # Drain the remaining batches.
+        collect(wait(in_flight).done)
+    report['seconds'] = time.perf_counter() - started
+    return report
+
+# Prints the per-table throughput report.
+def print_report(reports, total_seconds):
+    """Prints rows, batches, retries, failures and rows/second for each table and overall."""
+    print(f"\n{'table':<20}{'rows':>10}{'batches':>9}{'retries':>9}{'failed':>8}{'seconds':>9}{'rows/s':>10}")
+    for r in reports:
+        rate = r['rows'] / r['seconds'] if r['seconds'] else 0.0
+        print(f"{r['table']:<20}{r['rows']:>10}{r['batches']:>9}{r['retries']:>9}{r['failed_rows']:>8}{r['seconds']:>9.2f}{rate:>10.0f}")
+    total_rows = sum(r['rows'] for r in reports)
+    total_rate = total_rows / total_seconds if total_seconds else 0.0
+    print(f"{'TOTAL':<20}{total_rows:>10}{sum(r['batches'] for r in reports):>9}{sum(r['retries'] for r in reports):>9}"
+          f"{sum(r['failed_rows'] for r in reports):>8}{total_seconds:>9.2f}{total_rate:>10.0f}")
+
+
+# --- Command Line ---
+
+# Parses command-line options.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Upsert the legacy SQLite database into Supabase through the PostgREST API.")
+    parser.add_argument('--db', default=SQLITE_DB_PATH, help=f"SQLite database path (default: {SQLITE_DB_PATH})")
+    parser.add_argument('--tables', nargs='+', help="Tables to load (default: all, parents before children)")
+    parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE, help=f"Rows per upsert request (default: {LOAD_BATCH_SIZE})")
+    parser.add_argument('--concurrency', type=int, default=LOAD_CONCURRENCY, help=f"Batches in flight at once (default: {LOAD_CONCURRENCY})")
+    parser.add_argument('--max-attempts', type=int, default=LOAD_MAX_ATTEMPTS, help=f"Attempts per batch before giving up (default: {LOAD_MAX_ATTEMPTS})")
+    parser.add_argument('--retry-backoff', type=float, default=LOAD_RETRY_BACKOFF, help=f"First retry delay in seconds, doubled each retry (default: {LOAD_RETRY_BACKOFF})")
+    parser.add_argument('--postgrest-url', default=os.environ.get('POSTGREST_URL'), help="Plain PostgREST base URL instead of Supabase (default: $POSTGREST_URL)")
+    parser.add_argument('--postgrest-token', default=os.environ.get('POSTGREST_TOKEN'), help="Bearer token for --postgrest-url (default: $POSTGREST_TOKEN)")
+    return parser.parse_args(argv)
+
+# Entry point: load the requested tables and print the report. Returns the process exit code.
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"ERROR (bulk_load): SQLite database file not found at '{args.db}'", file=sys.stderr)
+        return 2
+    get_client = make_client_factory(args.postgrest_url, args.postgrest_token)
+    # Read-only connection; the loader never modifies the legacy database.
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        tables = list_tables_in_load_order(conn)
+        if args.tables:
+            # Keep dependency order but only for the requested tables.
+            unknown = set(args.tables) - set(tables)
+            if unknown:
+                print(f"ERROR (bulk_load): Unknown table(s): {', '.join(sorted(unknown))}", file=sys.stderr)
+                return 2
+            tables = [t for t in tables if t in args.tables]
+        print(f"INFO (bulk_load): Loading {tables} from {args.db} -> {args.postgrest_url or os.environ.get('SUPABASE_URL')} "
+              f"(batch {args.batch_size}, concurrency {args.concurrency})", file=sys.stderr)
+        started = time.perf_counter()
+        reports = []
+        for table_name in tables:
+            reports.append(load_table(get_client, conn, table_name, args.batch_size, args.concurrency, args.max_attempts, args.retry_backoff))
+        print_report(reports, time.perf_counter() - started)
+    except Exception as e:
+        print(f"ERROR (bulk_load): Load aborted: {e}", file=sys.stderr); traceback.print_exc()
+        return 1
+    finally:
+        conn.close()
+    # Explicit ids were written, so serial sequences must be moved past them before the app inserts rows.
+    print("\nNOTE: PostgREST can't reset sequences. Run in the SQL editor for each loaded table with a serial id:\n"
+          "  SELECT setval(pg_get_serial_sequence('public.<table>', 'id'), (SELECT MAX(id) FROM public.<table>));")
+    # Non-zero exit when any batch failed, so scripts/CI notice.
+    return 1 if any(r['failed_batches'] for r in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# --- END OF FILE bulk_load.py ---
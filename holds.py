@@ -0,0 +1,133 @@
+# --- START OF FILE holds.py ---
+# Short-lived slot holds used by app.py.
+# When a patient picks a time on the booking page, the browser acquires a hold on (doctor, date, time) for
+# HOLD_TTL_SECONDS. Other patients' slot listings leave held slots out, and /confirm-booking rejects a slot
+# held by someone else before running its validation queries. A successful booking consumes the hold; an
+# abandoned one simply expires. Each browser session (hold token) holds at most one slot at a time, and since a
+# client can drop its session cookie, /api/slot-holds also caps the live holds per owner (IP address, device cookie).
+#
+# Two interchangeable stores (same methods):
+#   * MemoryHoldStore:   a dict in this process (default; correct for a single app process).
+#   * SupabaseHoldStore: the slot_holds table + acquire_slot_hold() function (migrations/006), shared by
+#                        every app process; each call is one round trip.
+
+# --- Standard Library Imports ---
+import threading                # Lock protecting the in-memory store.
+import time                     # Monotonic clock for in-memory expiry.
+from datetime import datetime, timezone # Expiry timestamps for the Supabase store.
+
+# How long a hold lasts without being consumed.
+HOLD_TTL_SECONDS = 300
+# Owner kinds a hold can be attributed to (and capped by).
+OWNER_KINDS = ('ip', 'device')
+
+
+# Raised by acquire() when an owner already has its maximum number of live holds.
+class HoldLimitError(Exception):
+    pass
+
+
+# In-process hold store.
+class MemoryHoldStore:
+    """Slot holds kept in a dict: (doctor_id, date, time) -> (token, expires_at, owners)."""
+
+    # Constructor: empty store.
+    def __init__(self):
+        # (doctor_id, booking_date, booking_time) -> (token, monotonic expiry, {owner kind: value}).
+        self._holds = {}
+        # token -> key of the slot it currently holds.
+        self._by_token = {}
+        # Lock protecting both maps.
+        self._lock = threading.Lock()
+
+    # Returns the live hold on a key (dropping it if expired). Caller holds the lock.
+    def _live(self, key, now):
+        hold = self._holds.get(key)
+        if hold and hold[1] <= now:
+            del self._holds[key]
+            if self._by_token.get(hold[0]) == key: del self._by_token[hold[0]]
+            return None
+        return hold
+
+    # Takes (or extends) a hold for `token`; returns False if someone else holds the slot.
+    # `owners` ({'ip': ..., 'device': ...}) are recorded on the hold; with `max_holds` ({kind: n}) an owner that already
+    # has n live holds under other tokens gets HoldLimitError instead.
+    def acquire(self, doctor_id, booking_date, booking_time, token, ttl=HOLD_TTL_SECONDS, owners=None, max_holds=None):
+        key = (doctor_id, booking_date, booking_time); now = time.monotonic(); owners = owners or {}
+        with self._lock:
+            hold = self._live(key, now)
+            if hold and hold[0] != token: return False
+            for kind, limit in (max_holds or {}).items():
+                if limit is None or not owners.get(kind): continue
+                held = sum(1 for other in list(self._holds) if (h := self._live(other, now))
+                           and h[0] != token and h[2].get(kind) == owners[kind])
+                if held >= limit: raise HoldLimitError(f"{kind} already holds {held} slot(s)")
+            # One slot per token: drop the token's previous hold.
+            previous = self._by_token.get(token)
+            if previous and previous != key: self._holds.pop(previous, None)
+            self._holds[key] = (token, now + ttl, dict(owners)); self._by_token[token] = key
+            return True
+
+    # True if someone other than `token` holds the slot right now.
+    def held_by_other(self, doctor_id, booking_date, booking_time, token):
+        with self._lock:
+            hold = self._live((doctor_id, booking_date, booking_time), time.monotonic())
+            return bool(hold and hold[0] != token)
+
+    # Times on a date held by anyone other than `token`.
+    def held_times(self, doctor_id, booking_date, token=None):
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key in self._holds if key[0] == doctor_id and key[1] == booking_date]
+            return {key[2] for key in keys if (hold := self._live(key, now)) and hold[0] != token}
+
+    # Releases the token's hold (after a booking, or when the patient gives up).
+    def release(self, token):
+        with self._lock:
+            key = self._by_token.pop(token, None)
+            if key and self._holds.get(key, (None,))[0] == token: del self._holds[key]
+
+
+# Hold store shared through Supabase (requires migrations/006).
+class SupabaseHoldStore:
+    """Slot holds in the slot_holds table; acquire is one atomic upsert (acquire_slot_hold RPC)."""
+
+    # Constructor: keep the client.
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    # Current UTC time as ISO text for comparisons with expires_at.
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat()
+
+    # Takes (or extends) a hold for `token`; returns False if someone else holds the slot (see MemoryHoldStore.acquire).
+    # The RPC (migrations/015) returns 1 = acquired, 0 = held by someone else, -1 = owner limit reached.
+    def acquire(self, doctor_id, booking_date, booking_time, token, ttl=HOLD_TTL_SECONDS, owners=None, max_holds=None):
+        owners = owners or {}; max_holds = max_holds or {}
+        res = self.supabase.rpc('acquire_slot_hold', {'p_doctor_id': doctor_id, 'p_booking_date': booking_date,
+                                                      'p_booking_time': booking_time, 'p_token': token,
+                                                      'p_ttl_seconds': ttl,
+                                                      'p_owner_ip': owners.get('ip'), 'p_owner_device': owners.get('device'),
+                                                      'p_max_per_ip': max_holds.get('ip'),
+                                                      'p_max_per_device': max_holds.get('device')}).execute()
+        if res.data == -1: raise HoldLimitError("owner hold limit reached")
+        return res.data == 1
+
+    # True if someone other than `token` holds the slot right now.
+    def held_by_other(self, doctor_id, booking_date, booking_time, token):
+        res = self.supabase.table('slot_holds').select('token').eq('doctor_id', doctor_id) \
+            .eq('booking_date', booking_date).eq('booking_time', booking_time).gt('expires_at', self._now()).execute()
+        return any(row.get('token') != token for row in (res.data or []))
+
+    # Times on a date held by anyone other than `token`.
+    def held_times(self, doctor_id, booking_date, token=None):
+        res = self.supabase.table('slot_holds').select('booking_time, token').eq('doctor_id', doctor_id) \
+            .eq('booking_date', booking_date).gt('expires_at', self._now()).execute()
+        return {row['booking_time'] for row in (res.data or []) if row.get('token') != token}
+
+    # Releases the token's hold.
+    def release(self, token):
+        self.supabase.table('slot_holds').delete().eq('token', token).execute()
+
+# --- END OF FILE holds.py ---
@@ -0,0 +1,116 @@
+# --- START OF FILE idempotency.py ---
+# Idempotency keys for form posts (used by /confirm-booking in app.py).
+# The booking form carries a random key rendered with the page. The first request with a key claims it; when it
+# succeeds its result (the redirect URL) is stored against the key for IDEMPOTENCY_TTL_SECONDS. A duplicate (double
+# click, mobile retry, back-button resubmit) gets that result replayed instead of running the booking again; a
+# duplicate that arrives while the first request is still running waits briefly for its result. A request that
+# fails releases its key, so a corrected resubmit runs normally.
+#
+# Two interchangeable stores (same methods, same choice as holds.py):
+#   * MemoryIdempotencyStore:   a dict in this process (default; correct for a single app process).
+#   * SupabaseIdempotencyStore: the idempotency_keys table + claim_idempotency_key() function (migrations/007).
+
+# --- Standard Library Imports ---
+import threading                # Lock + per-key events for the in-memory store.
+import time                     # Monotonic clock for in-memory expiry; sleeps while polling Supabase.
+from datetime import datetime, timezone, timedelta # Expiry timestamps for the Supabase store.
+
+# How long a completed key's result is replayed.
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+# How long a claimed key may stay unfinished before it can be claimed again (a request that crashed mid-way).
+PENDING_TTL_SECONDS = 60
+# Longest a key is accepted (keys are generated by the server as 32 hex chars).
+MAX_KEY_LENGTH = 64
+
+
+# True if `key` looks like a key the booking page would have rendered.
+def valid_key(key):
+    return bool(key) and len(key) <= MAX_KEY_LENGTH and all(ch.isalnum() or ch in '-_' for ch in key)
+
+
+# In-process idempotency store.
+class MemoryIdempotencyStore:
+    """Keys kept in a dict: key -> [result or None, monotonic expiry, threading.Event set on completion]."""
+
+    # Constructor: empty store.
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Expired entries are swept at most once a minute (during claims).
+        self._next_sweep = 0.0
+
+    # Drops expired entries. Caller holds the lock.
+    def _sweep(self, now):
+        if now < self._next_sweep: return
+        self._next_sweep = now + 60
+        for key in [key for key, entry in self._entries.items() if entry[1] <= now]: del self._entries[key]
+
+    # Claims `key`. Returns (True, None) if this request should run, or (False, result) for a duplicate, where result
+    # is None while the first request is still running.
+    def claim(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._entries.get(key)
+            if entry and entry[1] > now: return False, entry[0]
+            self._entries[key] = [None, now + PENDING_TTL_SECONDS, threading.Event()]
+            return True, None
+
+    # Stores the result of the request that claimed `key`.
+    def complete(self, key, result, ttl=IDEMPOTENCY_TTL_SECONDS):
+        with self._lock:
+            entry = self._entries.setdefault(key, [None, 0, threading.Event()])
+            entry[0] = result; entry[1] = time.monotonic() + ttl
+            entry[2].set()
+
+    # Releases a key whose request did not complete (no-op once a result is stored).
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] is None:
+                del self._entries[key]; entry[2].set()
+
+    # Waits up to `timeout` seconds for the first request's result; returns it, or None.
+    def wait(self, key, timeout):
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry: return None
+        entry[2].wait(timeout)
+        return entry[0]
+
+
+# Idempotency store shared through Supabase (requires migrations/007).
+class SupabaseIdempotencyStore:
+    """Keys in the idempotency_keys table; a claim is one atomic upsert (claim_idempotency_key RPC)."""
+
+    # Constructor: keep the client.
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    # Claims `key` (same contract as MemoryIdempotencyStore.claim).
+    def claim(self, key):
+        res = self.supabase.rpc('claim_idempotency_key', {'p_key': key, 'p_pending_seconds': PENDING_TTL_SECONDS}).execute()
+        row = (res.data or [{}])[0] if isinstance(res.data, list) else (res.data or {})
+        return bool(row.get('claimed')), row.get('result')
+
+    # Stores the result of the request that claimed `key`.
+    def complete(self, key, result, ttl=IDEMPOTENCY_TTL_SECONDS):
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=ttl)).isoformat()
+        self.supabase.table('idempotency_keys').update({'result': result, 'expires_at': expires_at}).eq('key', key).execute()
+
+    # Releases a key whose request did not complete (no-op once a result is stored).
+    def release(self, key):
+        self.supabase.table('idempotency_keys').delete().eq('key', key).is_('result', 'null').execute()
+
+    # Polls for the first request's result for up to `timeout` seconds; returns it, or None.
+    def wait(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            res = self.supabase.table('idempotency_keys').select('result').eq('key', key).execute()
+            rows = res.data or []
+            # Done, or released (row gone): stop waiting.
+            if not rows or rows[0].get('result'): return rows[0].get('result') if rows else None
+            if time.monotonic() >= deadline: return None
+            time.sleep(0.25)
+
+# --- END OF FILE idempotency.py ---
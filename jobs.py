@@ -0,0 +1,258 @@
+# --- START OF FILE jobs.py ---
+# Lightweight in-process background job queue used by app.py.
+# Routes enqueue non-critical work (analytics, notifications, cache warming) and return immediately;
+# a small pool of worker threads runs the registered handler for each job.
+# Optionally, jobs are also written to a local SQLite "spool" file so queued work survives a restart.
+
+# --- Standard Library Imports ---
+import contextlib               # Context manager that commits and closes spool connections.
+import json                     # Used to serialize job payloads into the SQLite spool.
+import os                       # Process id recorded as the owner of a claimed spool job.
+import queue                    # Thread-safe FIFO queue feeding the worker threads.
+import sqlite3                  # Used for the optional on-disk spool.
+import threading                # Worker threads and locks.
+import time                     # Timestamps for latency metrics.
+import traceback                # Detailed error output when a handler fails.
+
+# Seconds a claimed spool job belongs to the process running it. A restarting process only re-runs 'running'
+# jobs whose lease has expired, so jobs still being run by another live process sharing the spool are left alone.
+JOB_LEASE_SECONDS = 900
+
+
+# Class implementing the job queue and its worker pool.
+class JobQueue:
+    """In-process job queue with a worker thread pool and an optional SQLite spool for durability."""
+
+    # Constructor: configure worker count and optional spool path. Workers start lazily on first enqueue.
+    def __init__(self, num_workers=2, spool_path=None, lease_seconds=JOB_LEASE_SECONDS):
+        # Number of worker threads to run.
+        self.num_workers = max(1, int(num_workers))
+        # Path to the SQLite spool file (None disables durability).
+        self.spool_path = spool_path
+        # Lease taken on a spooled job when a worker claims it.
+        self.lease_seconds = lease_seconds
+        # Owner recorded on claimed spool rows (for debugging shared spools).
+        self._owner = f"pid-{os.getpid()}"
+        # Mapping of job name -> handler function.
+        self.handlers = {}
+        # The in-memory queue of (spool_id, name, payload, enqueued_at) tuples.
+        self._queue = queue.Queue()
+        # Lock protecting the metrics counters and worker startup.
+        self._lock = threading.Lock()
+        # List of started worker threads.
+        self._workers = []
+        # Counters and latency totals exposed via metrics().
+        self._stats = {'enqueued': 0, 'processed': 0, 'failed': 0, 'dropped': 0,
+                       'wait_seconds_total': 0.0, 'run_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+        # Create the spool table if a spool path was configured.
+        if self.spool_path: self._init_spool()
+
+    # --- Spool Helpers ---
+
+    # Opens a short-lived connection to the spool database; commits (or rolls back) and closes it on exit.
+    @contextlib.contextmanager
+    def _spool_conn(self):
+        # `timeout` lets concurrent workers/processes wait on the SQLite write lock instead of failing.
+        conn = sqlite3.connect(self.spool_path, timeout=10)
+        try:
+            with conn: yield conn
+        finally:
+            conn.close()
+
+    # Creates the spool table if needed.
+    def _init_spool(self):
+        # Open the spool and create the table (status is 'queued' or 'running'; running rows carry an owner and lease).
+        with self._spool_conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             name TEXT NOT NULL,
+                             payload TEXT NOT NULL,
+                             enqueued_at REAL NOT NULL,
+                             status TEXT NOT NULL DEFAULT 'queued',
+                             claimed_by TEXT,
+                             lease_expires_at REAL)''')
+            # Spools created before leases existed: add the columns.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'claimed_by' not in columns: conn.execute("ALTER TABLE jobs ADD COLUMN claimed_by TEXT")
+            if 'lease_expires_at' not in columns: conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+
+    # Re-queues jobs left in the spool by a previous process (called once when workers start).
+    def _replay_spool(self):
+        # Nothing to replay without a spool.
+        if not self.spool_path: return 0
+        # Try block so a corrupt spool never prevents the app from running.
+        try:
+            with self._spool_conn() as conn:
+                # 'running' jobs whose lease expired were interrupted mid-flight (their process died): queue them again.
+                # Jobs with a live lease belong to another process that is still running them.
+                conn.execute("UPDATE jobs SET status = 'queued', claimed_by = NULL, lease_expires_at = NULL "
+                             "WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)", (time.time(),))
+                # Read every queued job (_claim() still makes sure each one runs only once).
+                rows = conn.execute("SELECT id, name, payload, enqueued_at FROM jobs WHERE status = 'queued' ORDER BY id").fetchall()
+            # Push each spooled job onto the in-memory queue.
+            for spool_id, name, payload, enqueued_at in rows:
+                self._queue.put((spool_id, name, json.loads(payload), enqueued_at))
+            # Log how many jobs were recovered.
+            if rows: print(f"INFO (jobs): Replayed {len(rows)} spooled job(s) from {self.spool_path}.")
+            return len(rows)
+        # Catch any spool error and continue with an empty queue.
+        except Exception as e:
+            print(f"ERROR (jobs): Failed to replay spool {self.spool_path}: {e}"); traceback.print_exc()
+            return 0
+
+    # --- Public API ---
+
+    # Decorator-friendly registration of a handler function for a job name.
+    def register(self, name, handler=None):
+        """Registers `handler(**payload)` for jobs called `name`. Usable as `@job_queue.register('name')`."""
+        # Support decorator usage when handler is omitted.
+        if handler is None:
+            return lambda fn: self.register(name, fn)
+        # Store the handler.
+        self.handlers[name] = handler
+        # Return the handler unchanged so decorated functions stay callable.
+        return handler
+
+    # Starts the worker threads (idempotent).
+    def start(self):
+        """Starts the worker threads and replays any spooled jobs. Safe to call more than once."""
+        # Guard with the lock so two concurrent first enqueues don't start two pools.
+        with self._lock:
+            # Already running - nothing to do.
+            if self._workers: return
+            # Recover jobs left over from a previous run before accepting new ones.
+            self._replay_spool()
+            # Start daemon worker threads (they won't block interpreter shutdown).
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        # Log the pool start.
+        print(f"INFO (jobs): Started {self.num_workers} job worker(s). Spool: {self.spool_path or 'disabled'}.")
+
+    # Adds a job to the queue and returns immediately.
+    def enqueue(self, name, **payload):
+        """Queues job `name` with keyword `payload` (must be JSON-serializable if spooling). Returns True if queued."""
+        # Reject unknown job names early so typos surface in the logs.
+        if name not in self.handlers:
+            print(f"WARN (jobs): No handler registered for job '{name}'. Dropped.")
+            with self._lock: self._stats['dropped'] += 1
+            return False
+        # Start the workers on first use.
+        if not self._workers: self.start()
+        # Record the enqueue time for wait-latency metrics.
+        enqueued_at = time.time()
+        # Spool id stays None when durability is disabled.
+        spool_id = None
+        # Persist the job first so it survives a crash before it runs.
+        if self.spool_path:
+            try:
+                with self._spool_conn() as conn:
+                    cur = conn.execute("INSERT INTO jobs (name, payload, enqueued_at) VALUES (?, ?, ?)",
+                                       (name, json.dumps(payload), enqueued_at))
+                    spool_id = cur.lastrowid
+            # A spool failure should not lose the job: fall back to memory only.
+            except Exception as e:
+                print(f"ERROR (jobs): Could not spool job '{name}': {e}. Running in-memory only.")
+        # Hand the job to the workers.
+        self._queue.put((spool_id, name, payload, enqueued_at))
+        # Count it.
+        with self._lock: self._stats['enqueued'] += 1
+        return True
+
+    # Enqueues a job on a fixed interval from a background timer thread.
+    def every(self, interval_seconds, name, **payload):
+        """Enqueues job `name` every `interval_seconds` (first run after one interval). Returns the timer thread."""
+        # Loop run by the timer thread: sleep one interval, then enqueue.
+        def tick():
+            while True:
+                time.sleep(interval_seconds)
+                self.enqueue(name, **payload)
+        # Daemon thread so it never blocks shutdown.
+        timer = threading.Thread(target=tick, name=f"job-timer-{name}", daemon=True)
+        timer.start()
+        # Log the schedule.
+        print(f"INFO (jobs): Scheduled job '{name}' every {interval_seconds}s.")
+        return timer
+
+    # Returns a snapshot of queue depth and latency metrics.
+    def metrics(self):
+        """Returns queue depth, worker count, processed/failed counters and average/max latencies (seconds)."""
+        # Copy the counters under the lock.
+        with self._lock: stats = dict(self._stats)
+        # Number of jobs that finished (successfully or not) for averaging.
+        finished = stats['processed'] + stats['failed']
+        # Build the metrics dictionary.
+        return {
+            'depth': self._queue.qsize(),                 # Jobs waiting to run.
+            'workers': len(self._workers),                # Running worker threads.
+            'enqueued': stats['enqueued'],                # Jobs accepted since start.
+            'processed': stats['processed'],              # Jobs whose handler returned normally.
+            'failed': stats['failed'],                    # Jobs whose handler raised.
+            'dropped': stats['dropped'],                  # Jobs rejected (unknown name).
+            'avg_wait_seconds': round(stats['wait_seconds_total'] / finished, 4) if finished else 0.0,
+            'max_wait_seconds': round(stats['wait_seconds_max'], 4),
+            'avg_run_seconds': round(stats['run_seconds_total'] / finished, 4) if finished else 0.0,
+        }
+
+    # Blocks until every queued job has been processed (useful for scripts and shutdown).
+    def join(self):
+        """Waits until the queue is empty and all in-flight jobs have finished."""
+        self._queue.join()
+
+    # --- Worker ---
+
+    # Loop run by each worker thread.
+    def _worker_loop(self):
+        # Workers run forever (daemon threads exit with the process).
+        while True:
+            # Block until a job is available.
+            spool_id, name, payload, enqueued_at = self._queue.get()
+            # Mark the spooled row as running; skip it if another process already claimed it.
+            if spool_id is not None and not self._claim(spool_id):
+                self._queue.task_done(); continue
+            # Measure how long the job waited.
+            started_at = time.time()
+            # Flag used for the metrics update.
+            ok = False
+            try:
+                # Run the handler with the job's payload.
+                self.handlers[name](**payload)
+                ok = True
+            # Handler errors are logged but never kill the worker.
+            except Exception as e:
+                print(f"ERROR (jobs): Job '{name}' failed: {e}"); traceback.print_exc()
+            finally:
+                # Remove the job from the spool whether it succeeded or failed (no automatic retries).
+                if spool_id is not None: self._unspool(spool_id)
+                # Update counters.
+                finished_at = time.time()
+                with self._lock:
+                    self._stats['processed' if ok else 'failed'] += 1
+                    self._stats['wait_seconds_total'] += started_at - enqueued_at
+                    self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], started_at - enqueued_at)
+                    self._stats['run_seconds_total'] += finished_at - started_at
+                # Tell the queue this item is done (for join()).
+                self._queue.task_done()
+
+    # Atomically moves a spooled job from 'queued' to 'running' under this process's lease. Returns False if it was already taken.
+    def _claim(self, spool_id):
+        try:
+            with self._spool_conn() as conn:
+                cur = conn.execute("UPDATE jobs SET status = 'running', claimed_by = ?, lease_expires_at = ? WHERE id = ? AND status = 'queued'",
+                                   (self._owner, time.time() + self.lease_seconds, spool_id))
+                return cur.rowcount == 1
+        # If the spool is unavailable, run the job anyway rather than lose it.
+        except Exception as e:
+            print(f"WARN (jobs): Could not claim spooled job {spool_id}: {e}")
+            return True
+
+    # Deletes a finished job from the spool.
+    def _unspool(self, spool_id):
+        try:
+            with self._spool_conn() as conn:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (spool_id,))
+        except Exception as e:
+            print(f"WARN (jobs): Could not remove spooled job {spool_id}: {e}")
+
+# --- END OF FILE jobs.py ---
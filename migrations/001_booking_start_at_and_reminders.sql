@@ -0,0 +1,36 @@
+-- Migration 001: typed appointment start time + reminder tracking on bookings.
+-- Run once in the Supabase SQL editor (safe to re-run).
+--
+-- bookings.booking_date ('YYYY-MM-DD') and bookings.booking_time ('HH:MM - HH:MM') are TEXT, so
+-- "bookings starting in the next N hours" cannot use an index. start_at is the parsed start of
+-- the slot (local clinic time, same as datetime.now() in app.py), kept in sync by a trigger.
+
+ALTER TABLE public."bookings" ADD COLUMN IF NOT EXISTS "start_at" TIMESTAMP;
+ALTER TABLE public."bookings" ADD COLUMN IF NOT EXISTS "reminder_sent_at" TIMESTAMPTZ;
+
+-- Parses booking_date + the start of booking_time into start_at on every insert/update.
+CREATE OR REPLACE FUNCTION public.bookings_set_start_at() RETURNS trigger AS $$
+BEGIN
+    BEGIN
+        NEW.start_at := (NEW.booking_date || ' ' || trim(split_part(NEW.booking_time, '-', 1)))::timestamp;
+    EXCEPTION WHEN others THEN
+        NEW.start_at := NULL; -- Malformed legacy rows simply get no start_at.
+    END;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bookings_set_start_at ON public."bookings";
+CREATE TRIGGER bookings_set_start_at
+    BEFORE INSERT OR UPDATE OF booking_date, booking_time ON public."bookings"
+    FOR EACH ROW EXECUTE FUNCTION public.bookings_set_start_at();
+
+-- Backfill existing rows (fires the trigger).
+UPDATE public."bookings" SET booking_date = booking_date WHERE start_at IS NULL;
+
+-- Reminder scan: only Pending bookings that have not been reminded yet, ordered by start time.
+-- Rows drop out of this partial index as soon as reminder_sent_at is set, so each tick reads
+-- only the upcoming window instead of the whole table.
+CREATE INDEX IF NOT EXISTS bookings_reminder_due_idx
+    ON public."bookings" (start_at)
+    WHERE status = 'Pending' AND reminder_sent_at IS NULL;
@@ -0,0 +1,9 @@
+-- Migration 002: index for the booking lifecycle sweeper (sweeper.py).
+-- Run once in the Supabase SQL editor after 001 (safe to re-run).
+--
+-- The sweeper looks for Pending bookings whose start_at is in the past. This partial index keeps
+-- that lookup proportional to the number of stale rows; swept rows leave the index immediately.
+
+CREATE INDEX IF NOT EXISTS bookings_pending_start_at_idx
+    ON public."bookings" (start_at)
+    WHERE status = 'Pending';
@@ -0,0 +1,48 @@
+-- Migration 003: cold-storage archive for old bookings (archive.py).
+-- Run once in the Supabase SQL editor after 001 (safe to re-run).
+--
+-- bookings_archive has exactly the same columns, in the same order, as bookings, so rows can be
+-- moved with INSERT ... SELECT *. Any later migration that adds a column to bookings must add the
+-- same column to bookings_archive.
+
+CREATE TABLE IF NOT EXISTS public."bookings_archive" (LIKE public."bookings" INCLUDING DEFAULTS);
+-- Archived rows keep their original IDs; they must not draw from the bookings sequence.
+ALTER TABLE public."bookings_archive" ALTER COLUMN "id" DROP DEFAULT;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bookings_archive_pkey') THEN
+        ALTER TABLE public."bookings_archive" ADD CONSTRAINT bookings_archive_pkey PRIMARY KEY ("id");
+    END IF;
+END $$;
+
+-- History lookups on the archive (doctor dashboard, patient dashboard by phone).
+CREATE INDEX IF NOT EXISTS bookings_archive_doctor_idx ON public."bookings_archive" (doctor_id, booking_date);
+CREATE INDEX IF NOT EXISTS bookings_archive_phone_idx ON public."bookings_archive" (patient_phone);
+-- Candidate selection in archive_bookings() below.
+CREATE INDEX IF NOT EXISTS bookings_start_at_idx ON public."bookings" (start_at);
+
+-- Moves up to p_limit bookings to the archive in one transaction and returns how many moved:
+--   * bookings that started more than p_horizon_days ago, and
+--   * cancelled bookings that started more than p_cancelled_after_days ago (kept a little longer
+--     because the 10-day cooldown check in /confirm-booking still looks at recent cancelled rows).
+-- SKIP LOCKED lets it run alongside normal traffic without waiting on rows being edited.
+CREATE OR REPLACE FUNCTION public.archive_bookings(p_horizon_days INT, p_cancelled_after_days INT, p_limit INT)
+RETURNS INT AS $$
+DECLARE
+    moved_count INT;
+BEGIN
+    WITH candidates AS (
+        SELECT id FROM public."bookings"
+        WHERE start_at < now()::timestamp - make_interval(days => p_horizon_days)
+           OR (status = 'Cancelled' AND start_at < now()::timestamp - make_interval(days => p_cancelled_after_days))
+        ORDER BY id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM public."bookings" b USING candidates c WHERE b.id = c.id RETURNING b.*
+    )
+    INSERT INTO public."bookings_archive" SELECT * FROM moved;
+    GET DIAGNOSTICS moved_count = ROW_COUNT;
+    RETURN moved_count;
+END;
+$$ LANGUAGE plpgsql;
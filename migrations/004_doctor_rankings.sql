@@ -0,0 +1,14 @@
+-- Migration 004: precomputed doctor rank scores for the "recommended" search order (ranking.py).
+-- Run once in the Supabase SQL editor (safe to re-run).
+--
+-- One row per doctor, written by ranking.refresh_rank_scores() in a single upsert. Kept out of the
+-- doctors table so frequent score refreshes never touch (or lock) doctor rows.
+
+CREATE TABLE IF NOT EXISTS public."doctor_rankings" (
+    "doctor_id" BIGINT PRIMARY KEY REFERENCES public."doctors"("id") ON DELETE CASCADE,
+    "rank_score" DOUBLE PRECISION NOT NULL DEFAULT 0,     -- 0..1, higher ranks first.
+    "ranked_rating" DOUBLE PRECISION NOT NULL DEFAULT 0,  -- Time-decayed Bayesian rating (1..5).
+    "next_slot_at" TIMESTAMP,                             -- Next free slot (local clinic time, like bookings.start_at).
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS "idx_doctor_rankings_rank_score" ON public."doctor_rankings" ("rank_score" DESC);
@@ -0,0 +1,25 @@
+-- Migration 005: date-specific availability exceptions (holidays, one-off closures, extra slots).
+-- Run once in the Supabase SQL editor (safe to re-run).
+--
+-- Each row applies to every date in [start_date, end_date] for one doctor, on top of the weekly
+-- `doctors.availability` schedule:
+--   * kind 'closed': removes `slots` (JSON list of "HH:MM - HH:MM" strings) from those dates, or the
+--     whole day when `slots` is NULL / empty;
+--   * kind 'extra':  adds `slots` to those dates.
+-- Where a closure and extra slots overlap, the extra slots win (closures only remove weekly slots).
+
+CREATE TABLE IF NOT EXISTS public."doctor_availability_exceptions" (
+    "id" BIGSERIAL PRIMARY KEY,
+    "doctor_id" BIGINT NOT NULL REFERENCES public."doctors"("id") ON DELETE CASCADE,
+    "start_date" DATE NOT NULL,
+    "end_date" DATE NOT NULL,
+    "kind" TEXT NOT NULL DEFAULT 'closed' CHECK ("kind" IN ('closed', 'extra')),
+    "slots" JSONB,
+    "note" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CHECK ("end_date" >= "start_date")
+);
+
+-- Upcoming exceptions per doctor (slot_index loads rows with end_date >= today).
+CREATE INDEX IF NOT EXISTS availability_exceptions_doctor_idx ON public."doctor_availability_exceptions" (doctor_id, end_date);
+CREATE INDEX IF NOT EXISTS availability_exceptions_end_idx ON public."doctor_availability_exceptions" (end_date);
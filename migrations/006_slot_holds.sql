@@ -0,0 +1,38 @@
+-- Migration 006: short-lived slot holds shared by all app processes (holds.SupabaseHoldStore).
+-- Run once in the Supabase SQL editor (safe to re-run). Only needed with HOLD_STORE=supabase.
+--
+-- One row per held (doctor, date, time). A hold belongs to one browser session token and stops
+-- counting once expires_at has passed; expired rows are overwritten by the next acquire.
+
+CREATE TABLE IF NOT EXISTS public."slot_holds" (
+    "doctor_id" BIGINT NOT NULL,
+    "booking_date" TEXT NOT NULL,          -- Same format as bookings.booking_date ('YYYY-MM-DD').
+    "booking_time" TEXT NOT NULL,          -- Same format as bookings.booking_time ('HH:MM - HH:MM').
+    "token" TEXT NOT NULL,
+    "expires_at" TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY ("doctor_id", "booking_date", "booking_time")
+);
+-- Releasing / replacing a session's hold.
+CREATE INDEX IF NOT EXISTS slot_holds_token_idx ON public."slot_holds" (token);
+
+-- Takes (or extends) the hold on one slot for p_token and returns TRUE, or returns FALSE if another
+-- token holds it and the hold hasn't expired. The token's hold on any other slot is dropped first
+-- (one slot per session). The conditional upsert makes concurrent acquires race-free.
+CREATE OR REPLACE FUNCTION public.acquire_slot_hold(p_doctor_id BIGINT, p_booking_date TEXT, p_booking_time TEXT,
+                                                    p_token TEXT, p_ttl_seconds INT)
+RETURNS BOOLEAN AS $$
+DECLARE
+    acquired INT;
+BEGIN
+    DELETE FROM public."slot_holds"
+     WHERE token = p_token
+       AND (doctor_id, booking_date, booking_time) IS DISTINCT FROM (p_doctor_id, p_booking_date, p_booking_time);
+    INSERT INTO public."slot_holds" (doctor_id, booking_date, booking_time, token, expires_at)
+    VALUES (p_doctor_id, p_booking_date, p_booking_time, p_token, now() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (doctor_id, booking_date, booking_time) DO UPDATE
+       SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at
+     WHERE slot_holds.token = EXCLUDED.token OR slot_holds.expires_at <= now();
+    GET DIAGNOSTICS acquired = ROW_COUNT;
+    RETURN acquired > 0;
+END;
+$$ LANGUAGE plpgsql;
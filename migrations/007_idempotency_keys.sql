@@ -0,0 +1,31 @@
+-- Migration 007: idempotency keys for /confirm-booking shared by all app processes (idempotency.SupabaseIdempotencyStore).
+-- Run once in the Supabase SQL editor (safe to re-run). Only needed with IDEMPOTENCY_STORE=supabase.
+--
+-- One row per key. `result` is NULL while the claiming request is still running and holds the redirect URL
+-- to replay once it has succeeded. Expired rows are reclaimed by the next claim of the same key and can
+-- be cleaned up at any time with: DELETE FROM public."idempotency_keys" WHERE expires_at < now();
+
+CREATE TABLE IF NOT EXISTS public."idempotency_keys" (
+    "key" TEXT PRIMARY KEY,
+    "result" TEXT,
+    "expires_at" TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx ON public."idempotency_keys" (expires_at);
+
+-- Claims p_key for the calling request. Returns claimed = TRUE (run the request) when the key is new or
+-- expired, otherwise claimed = FALSE with the stored result (NULL while the first request is running).
+CREATE OR REPLACE FUNCTION public.claim_idempotency_key(p_key TEXT, p_pending_seconds INT)
+RETURNS TABLE (claimed BOOLEAN, result TEXT) AS $$
+BEGIN
+    INSERT INTO public."idempotency_keys" AS k ("key", "result", "expires_at")
+    VALUES (p_key, NULL, now() + make_interval(secs => p_pending_seconds))
+    ON CONFLICT ("key") DO UPDATE
+       SET "result" = NULL, "expires_at" = EXCLUDED."expires_at"
+     WHERE k."expires_at" <= now();
+    IF FOUND THEN
+        RETURN QUERY SELECT TRUE, NULL::TEXT;
+    ELSE
+        RETURN QUERY SELECT FALSE, k."result" FROM public."idempotency_keys" AS k WHERE k."key" = p_key;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,45 @@
+-- Migration 008: token buckets for rate limiting shared by all app processes (ratelimit.SupabaseRateLimiter).
+-- Run once in the Supabase SQL editor (safe to re-run). Only needed with RATE_LIMIT_STORE=supabase.
+--
+-- One row per bucket ("endpoint:kind:value", e.g. 'confirm_booking:ip:203.0.113.7'). Idle rows can be
+-- cleaned up at any time with: DELETE FROM public."rate_limit_buckets" WHERE updated_at < now() - interval '1 day';
+
+CREATE TABLE IF NOT EXISTS public."rate_limit_buckets" (
+    "key" TEXT PRIMARY KEY,
+    "tokens" DOUBLE PRECISION NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS rate_limit_buckets_updated_idx ON public."rate_limit_buckets" (updated_at);
+
+-- Refills each bucket in p_keys (capacity p_capacities[i], refilled over p_period_seconds) and takes one token
+-- from each, all or nothing. Returns the keys whose bucket was empty; no rows means the request is allowed.
+CREATE OR REPLACE FUNCTION public.take_rate_limit_tokens(p_keys TEXT[], p_capacities INT[], p_period_seconds INT)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    empty_keys TEXT[];
+BEGIN
+    -- New buckets start full.
+    INSERT INTO public."rate_limit_buckets" ("key", "tokens", "updated_at")
+    SELECT k, c, now() FROM unnest(p_keys, p_capacities) AS t(k, c)
+    ON CONFLICT ("key") DO NOTHING;
+
+    -- Lock the buckets (in key order, so concurrent calls can't deadlock) and find the empty ones after refilling.
+    WITH locked AS (
+        SELECT "key", "tokens", "updated_at" FROM public."rate_limit_buckets"
+         WHERE "key" = ANY(p_keys) ORDER BY "key" FOR UPDATE
+    )
+    SELECT array_agg(l."key") INTO empty_keys
+      FROM locked AS l JOIN unnest(p_keys, p_capacities) AS t(k, c) ON t.k = l."key"
+     WHERE LEAST(t.c, l."tokens" + EXTRACT(EPOCH FROM now() - l."updated_at") * t.c / p_period_seconds) < 1;
+
+    -- Store the refilled levels, minus one token each if every bucket had one.
+    UPDATE public."rate_limit_buckets" AS b
+       SET "tokens" = LEAST(t.c, b."tokens" + EXTRACT(EPOCH FROM now() - b."updated_at") * t.c / p_period_seconds)
+                      - CASE WHEN empty_keys IS NULL THEN 1 ELSE 0 END,
+           "updated_at" = now()
+      FROM unnest(p_keys, p_capacities) AS t(k, c)
+     WHERE b."key" = t.k;
+
+    RETURN QUERY SELECT unnest(COALESCE(empty_keys, ARRAY[]::TEXT[]));
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,90 @@
+-- Migration 009: patient identity index (patients.py) referenced by bookings and reviews.
+-- Run once in the Supabase SQL editor after 001 and 003 (safe to re-run), then run backfill_patients.py
+-- to link existing rows, then set PATIENT_INDEX_ENABLED=1.
+--
+-- One patient per normalized phone number. name_norm is the normalized name from the patient's latest
+-- booking/review and is indexed too, because the app still treats "same name" as the same person.
+-- Triggers fill bookings.patient_id / reviews.patient_id on insert, so every insert path stays linked.
+-- normalize_phone() / normalize_name() must stay identical to their Python twins in patients.py.
+
+CREATE TABLE IF NOT EXISTS public."patients" (
+    "id" BIGSERIAL PRIMARY KEY,
+    "phone_norm" TEXT NOT NULL UNIQUE,
+    "name_norm" TEXT,
+    "display_name" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS patients_name_idx ON public."patients" (name_norm);
+
+-- Same column on bookings and bookings_archive (archive_bookings() moves rows with SELECT *; see 003).
+ALTER TABLE public."bookings" ADD COLUMN IF NOT EXISTS "patient_id" BIGINT REFERENCES public."patients"("id");
+ALTER TABLE public."bookings_archive" ADD COLUMN IF NOT EXISTS "patient_id" BIGINT;
+ALTER TABLE public."reviews" ADD COLUMN IF NOT EXISTS "patient_id" BIGINT REFERENCES public."patients"("id");
+
+-- Booking checks and the patient dashboard (by patient, then date); review duplicate check.
+CREATE INDEX IF NOT EXISTS bookings_patient_idx ON public."bookings" (patient_id, booking_date);
+CREATE INDEX IF NOT EXISTS bookings_archive_patient_idx ON public."bookings_archive" (patient_id, booking_date);
+CREATE INDEX IF NOT EXISTS reviews_patient_idx ON public."reviews" (patient_id, doctor_id);
+
+-- Digits only, without the 00 / +967 prefix or a leading trunk 0. NULL if there are no digits.
+CREATE OR REPLACE FUNCTION public.normalize_phone(p_phone TEXT) RETURNS TEXT AS $$
+DECLARE
+    d TEXT := regexp_replace(coalesce(p_phone, ''), '\D', '', 'g');
+BEGIN
+    IF d LIKE '00%' THEN d := substr(d, 3); END IF;
+    IF length(d) = 12 AND d LIKE '967%' THEN d := substr(d, 4); END IF;
+    IF length(d) = 10 AND d LIKE '0%' THEN d := substr(d, 2); END IF;
+    RETURN nullif(d, '');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- No Arabic diacritics/tatweel, folded alef/teh marbuta/alef maksura variants, single spaces, lower case.
+CREATE OR REPLACE FUNCTION public.normalize_name(p_name TEXT) RETURNS TEXT AS $$
+    SELECT nullif(lower(trim(regexp_replace(
+               translate(regexp_replace(coalesce(p_name, ''), '[\u064B-\u0652\u0640]', '', 'g'), 'أإآٱةى', 'ااااهي'),
+               '\s+', ' ', 'g'))), '');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Returns the patient id for a phone (creating the patient on first sight) and records their latest name.
+CREATE OR REPLACE FUNCTION public.resolve_patient(p_phone TEXT, p_name TEXT) RETURNS BIGINT AS $$
+DECLARE
+    v_phone TEXT := public.normalize_phone(p_phone);
+    v_id BIGINT;
+BEGIN
+    IF v_phone IS NULL THEN RETURN NULL; END IF;
+    INSERT INTO public."patients" (phone_norm, name_norm, display_name)
+    VALUES (v_phone, public.normalize_name(p_name), nullif(trim(p_name), ''))
+    ON CONFLICT (phone_norm) DO UPDATE
+       SET name_norm = coalesce(EXCLUDED.name_norm, patients.name_norm),
+           display_name = coalesce(EXCLUDED.display_name, patients.display_name),
+           updated_at = now()
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Links new bookings / reviews to their patient.
+CREATE OR REPLACE FUNCTION public.bookings_set_patient_id() RETURNS trigger AS $$
+BEGIN
+    IF NEW.patient_id IS NULL THEN NEW.patient_id := public.resolve_patient(NEW.patient_phone, NEW.patient_name); END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.reviews_set_patient_id() RETURNS trigger AS $$
+BEGIN
+    IF NEW.patient_id IS NULL THEN NEW.patient_id := public.resolve_patient(NEW.reviewer_phone, NEW.reviewer_name); END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bookings_set_patient_id ON public."bookings";
+CREATE TRIGGER bookings_set_patient_id
+    BEFORE INSERT ON public."bookings"
+    FOR EACH ROW EXECUTE FUNCTION public.bookings_set_patient_id();
+
+DROP TRIGGER IF EXISTS reviews_set_patient_id ON public."reviews";
+CREATE TRIGGER reviews_set_patient_id
+    BEFORE INSERT ON public."reviews"
+    FOR EACH ROW EXECUTE FUNCTION public.reviews_set_patient_id();
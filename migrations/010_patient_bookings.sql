@@ -0,0 +1,36 @@
+-- Migration 010: one-call, paginated patient dashboard query (PATIENT_DASHBOARD_RPC_ENABLED in app.py).
+-- Run once in the Supabase SQL editor after 001, 003 and 009 (safe to re-run).
+--
+-- Returns one page of a patient's non-cancelled bookings (hot table, plus the archive when requested),
+-- newest first, de-duplicated by construction (each row comes from exactly one table) and with
+-- is_deletable computed from the typed start_at (Pending and not started yet, clinic-local time as in 001).
+-- The patient is matched by patient_id (p_patient_ids, from the patients index) or, when that is NULL,
+-- by exact phone OR case-insensitive name substring on the raw columns.
+
+CREATE OR REPLACE FUNCTION public.patient_bookings(p_patient_ids BIGINT[], p_phone TEXT, p_name TEXT,
+                                                   p_include_archive BOOLEAN, p_limit INT, p_offset INT)
+RETURNS TABLE (id BIGINT, doctor_id BIGINT, doctor_name TEXT, patient_name TEXT, patient_phone TEXT,
+               booking_date TEXT, booking_time TEXT, status TEXT, notes TEXT, is_deletable BOOLEAN) AS $$
+    WITH matched AS (
+        SELECT b.id, b.doctor_id, b.doctor_name, b.patient_name, b.patient_phone, b.booking_date, b.booking_time,
+               b.status, b.notes, b.start_at
+          FROM public."bookings" AS b
+         WHERE b.status <> 'Cancelled'
+           AND ((p_patient_ids IS NOT NULL AND b.patient_id = ANY(p_patient_ids))
+             OR (p_patient_ids IS NULL AND (b.patient_phone = p_phone OR b.patient_name ILIKE '%' || p_name || '%')))
+        UNION ALL
+        SELECT a.id, a.doctor_id, a.doctor_name, a.patient_name, a.patient_phone, a.booking_date, a.booking_time,
+               a.status, a.notes, a.start_at
+          FROM public."bookings_archive" AS a
+         WHERE p_include_archive
+           AND a.status <> 'Cancelled'
+           AND ((p_patient_ids IS NOT NULL AND a.patient_id = ANY(p_patient_ids))
+             OR (p_patient_ids IS NULL AND (a.patient_phone = p_phone OR a.patient_name ILIKE '%' || p_name || '%')))
+    )
+    SELECT m.id::BIGINT, m.doctor_id::BIGINT, m.doctor_name::TEXT, m.patient_name::TEXT, m.patient_phone::TEXT,
+           m.booking_date::TEXT, m.booking_time::TEXT, m.status::TEXT, m.notes::TEXT,
+           coalesce(m.status = 'Pending' AND m.start_at > now()::timestamp, FALSE)
+      FROM matched AS m
+     ORDER BY m.booking_date DESC, m.booking_time DESC, m.id DESC
+     LIMIT p_limit OFFSET p_offset;
+$$ LANGUAGE sql STABLE;
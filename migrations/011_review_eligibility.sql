@@ -0,0 +1,39 @@
+-- Migration 011: one-call review eligibility check (REVIEW_ELIGIBILITY_RPC_ENABLED in app.py).
+-- Run once in the Supabase SQL editor after 001 and 009 (safe to re-run).
+--
+-- Answers, for one doctor and one reviewer, in a single round trip:
+--   * has this person already reviewed the doctor?
+--   * their latest non-cancelled booking with the doctor that has already started (the visit being reviewed);
+--   * the start of their next upcoming one (only used for the "review after your appointment" message).
+-- The reviewer is matched by patient_id (p_patient_ids, from the patients index) or, when that is NULL,
+-- by exact phone OR exact name on the raw columns — the same matching as the booking checks.
+
+-- Duplicate-review check by phone / name, and booking lookups by phone / name / patient ordered by start.
+CREATE INDEX IF NOT EXISTS reviews_doctor_phone_idx ON public."reviews" (doctor_id, reviewer_phone);
+CREATE INDEX IF NOT EXISTS reviews_doctor_name_idx ON public."reviews" (doctor_id, reviewer_name);
+CREATE INDEX IF NOT EXISTS bookings_doctor_phone_start_idx ON public."bookings" (doctor_id, patient_phone, start_at);
+CREATE INDEX IF NOT EXISTS bookings_doctor_name_start_idx ON public."bookings" (doctor_id, patient_name, start_at);
+CREATE INDEX IF NOT EXISTS bookings_doctor_patient_start_idx ON public."bookings" (doctor_id, patient_id, start_at);
+
+CREATE OR REPLACE FUNCTION public.review_eligibility(p_doctor_id BIGINT, p_patient_ids BIGINT[], p_phone TEXT, p_name TEXT)
+RETURNS TABLE (review_exists BOOLEAN, last_booking_date TEXT, last_booking_time TEXT, next_start_at TIMESTAMP) AS $$
+    WITH mine AS (
+        SELECT b.booking_date, b.booking_time, b.start_at
+          FROM public."bookings" AS b
+         WHERE b.doctor_id = p_doctor_id
+           AND b.status <> 'Cancelled'
+           AND ((p_patient_ids IS NOT NULL AND b.patient_id = ANY(p_patient_ids))
+             OR (p_patient_ids IS NULL AND (b.patient_phone = p_phone OR b.patient_name = p_name)))
+    ), last_visit AS (
+        SELECT booking_date, booking_time FROM mine
+         WHERE start_at <= now()::timestamp
+         ORDER BY start_at DESC LIMIT 1
+    )
+    SELECT EXISTS (SELECT 1 FROM public."reviews" AS r
+                    WHERE r.doctor_id = p_doctor_id
+                      AND ((p_patient_ids IS NOT NULL AND r.patient_id = ANY(p_patient_ids))
+                        OR (p_patient_ids IS NULL AND (r.reviewer_phone = p_phone OR r.reviewer_name = p_name)))),
+           (SELECT booking_date::TEXT FROM last_visit),
+           (SELECT booking_time::TEXT FROM last_visit),
+           (SELECT min(start_at) FROM mine WHERE start_at > now()::timestamp);
+$$ LANGUAGE sql STABLE;
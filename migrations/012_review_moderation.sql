@@ -0,0 +1,107 @@
+-- Migration 012: review moderation queue and incrementally maintained review summaries (moderation.py,
+-- REVIEW_MODERATION_INTERVAL_SECONDS in app.py).
+-- Run once in the Supabase SQL editor (safe to re-run; a re-run rebuilds both summaries from the approved rows).
+--
+-- is_approved on reviews / site_reviews: 0 = pending, 1 = approved, -1 = rejected (reason in moderation_reason).
+-- Readers only ever ask for is_approved = 1, so the read indexes are partial on approved rows; the moderation
+-- job reads pending rows through a partial index of its own.
+-- doctor_rating_summary / site_review_summary hold the numbers the pages used to compute by scanning every
+-- approved review; approve_reviews() / approve_site_reviews() add each approval to them in the same statement.
+
+ALTER TABLE public."reviews" ADD COLUMN IF NOT EXISTS "moderation_reason" TEXT;
+ALTER TABLE public."reviews" ADD COLUMN IF NOT EXISTS "moderated_at" TIMESTAMPTZ;
+ALTER TABLE public."site_reviews" ADD COLUMN IF NOT EXISTS "moderation_reason" TEXT;
+ALTER TABLE public."site_reviews" ADD COLUMN IF NOT EXISTS "moderated_at" TIMESTAMPTZ;
+
+-- Booking page review list (per doctor, newest first) and home page testimonials.
+CREATE INDEX IF NOT EXISTS reviews_approved_doctor_idx ON public."reviews" (doctor_id, created_at DESC) WHERE is_approved = 1;
+CREATE INDEX IF NOT EXISTS site_reviews_approved_idx ON public."site_reviews" (created_at DESC) WHERE is_approved = 1;
+-- Moderation queue (oldest pending first).
+CREATE INDEX IF NOT EXISTS reviews_pending_idx ON public."reviews" (id) WHERE is_approved = 0;
+CREATE INDEX IF NOT EXISTS site_reviews_pending_idx ON public."site_reviews" (id) WHERE is_approved = 0;
+
+-- Approved review totals per doctor (rating_stats.summary_stats() turns a row into the page stats).
+-- Same validity rule as rating_stats.py: a doctor_id and a rating between 1 and 5; stars = rounded rating.
+CREATE TABLE IF NOT EXISTS public."doctor_rating_summary" (
+    "doctor_id" BIGINT PRIMARY KEY REFERENCES public."doctors"("id") ON DELETE CASCADE,
+    "review_count" INT NOT NULL DEFAULT 0,
+    "rating_sum" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "stars_1" INT NOT NULL DEFAULT 0,
+    "stars_2" INT NOT NULL DEFAULT 0,
+    "stars_3" INT NOT NULL DEFAULT 0,
+    "stars_4" INT NOT NULL DEFAULT 0,
+    "stars_5" INT NOT NULL DEFAULT 0,
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Single row (id = 1): number of approved site reviews for the home page stats.
+CREATE TABLE IF NOT EXISTS public."site_review_summary" (
+    "id" SMALLINT PRIMARY KEY DEFAULT 1 CHECK ("id" = 1),
+    "approved_count" BIGINT NOT NULL DEFAULT 0,
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- (Re)build both summaries from the rows approved so far.
+DELETE FROM public."doctor_rating_summary";
+INSERT INTO public."doctor_rating_summary" (doctor_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT r.doctor_id, count(*), sum(r.rating),
+       count(*) FILTER (WHERE round(r.rating) = 1), count(*) FILTER (WHERE round(r.rating) = 2),
+       count(*) FILTER (WHERE round(r.rating) = 3), count(*) FILTER (WHERE round(r.rating) = 4),
+       count(*) FILTER (WHERE round(r.rating) = 5)
+  FROM public."reviews" AS r
+  JOIN public."doctors" AS d ON d.id = r.doctor_id
+ WHERE r.is_approved = 1 AND r.rating BETWEEN 1 AND 5
+ GROUP BY r.doctor_id;
+INSERT INTO public."site_review_summary" (id, approved_count)
+SELECT 1, count(*) FROM public."site_reviews" WHERE is_approved = 1
+ON CONFLICT (id) DO UPDATE SET approved_count = EXCLUDED.approved_count, updated_at = now();
+
+-- Approves the given reviews that are still pending and adds them to doctor_rating_summary.
+-- Returns the doctors whose reviews were approved (rows already moderated by another run are skipped,
+-- so a review is never counted twice).
+CREATE OR REPLACE FUNCTION public.approve_reviews(p_ids BIGINT[])
+RETURNS TABLE (doctor_id BIGINT) AS $$
+    WITH approved AS (
+        UPDATE public."reviews" AS r
+           SET is_approved = 1, moderation_reason = NULL, moderated_at = now()
+         WHERE r.id = ANY(p_ids) AND r.is_approved = 0
+        RETURNING r.doctor_id AS doc_id, r.rating AS rating
+    ), counted AS (
+        INSERT INTO public."doctor_rating_summary" AS s
+               (doctor_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT a.doc_id, count(*), sum(a.rating),
+               count(*) FILTER (WHERE round(a.rating) = 1), count(*) FILTER (WHERE round(a.rating) = 2),
+               count(*) FILTER (WHERE round(a.rating) = 3), count(*) FILTER (WHERE round(a.rating) = 4),
+               count(*) FILTER (WHERE round(a.rating) = 5)
+          FROM approved AS a
+         WHERE a.doc_id IS NOT NULL AND a.rating BETWEEN 1 AND 5
+         GROUP BY a.doc_id
+        ON CONFLICT ON CONSTRAINT doctor_rating_summary_pkey DO UPDATE
+           SET review_count = s.review_count + EXCLUDED.review_count,
+               rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+               stars_1 = s.stars_1 + EXCLUDED.stars_1, stars_2 = s.stars_2 + EXCLUDED.stars_2,
+               stars_3 = s.stars_3 + EXCLUDED.stars_3, stars_4 = s.stars_4 + EXCLUDED.stars_4,
+               stars_5 = s.stars_5 + EXCLUDED.stars_5, updated_at = now()
+        RETURNING 1
+    )
+    SELECT DISTINCT a.doc_id::BIGINT FROM approved AS a WHERE a.doc_id IS NOT NULL;
+$$ LANGUAGE sql;
+
+-- Approves the given site reviews that are still pending and adds them to site_review_summary.
+-- Returns the number approved.
+CREATE OR REPLACE FUNCTION public.approve_site_reviews(p_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    UPDATE public."site_reviews" AS r
+       SET is_approved = 1, moderation_reason = NULL, moderated_at = now()
+     WHERE r.id = ANY(p_ids) AND r.is_approved = 0;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    IF v_count > 0 THEN
+        INSERT INTO public."site_review_summary" AS s (id, approved_count) VALUES (1, v_count)
+        ON CONFLICT (id) DO UPDATE SET approved_count = s.approved_count + EXCLUDED.approved_count, updated_at = now();
+    END IF;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
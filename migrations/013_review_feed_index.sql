@@ -0,0 +1,9 @@
+-- Migration 013: index for the keyset-paginated review feed (review_feed.py, /api/doctors/<id>/reviews).
+-- Run once in the Supabase SQL editor after 012 (safe to re-run).
+--
+-- Each feed page reads one doctor's approved reviews strictly older than the cursor, ordered by
+-- (created_at DESC, id DESC). Including id in the partial index lets every page be one index range scan,
+-- so it supersedes reviews_approved_doctor_idx from 012.
+
+CREATE INDEX IF NOT EXISTS reviews_approved_feed_idx ON public."reviews" (doctor_id, created_at DESC, id DESC) WHERE is_approved = 1;
+DROP INDEX IF EXISTS public.reviews_approved_doctor_idx;
@@ -0,0 +1,11 @@
+-- Migration 014: reminder claim lease (reminders.py). Requires 001.
+-- Run once in the Supabase SQL editor (safe to re-run).
+--
+-- A reminder tick used to claim a booking by setting reminder_sent_at before anything was sent, so a
+-- process dying between the claim and the send lost that reminder for good. Ticks now claim with
+-- reminder_claimed_at, a lease that the next tick can take over once it is older than the lease time,
+-- and reminder_sent_at is only set after the sender succeeded.
+
+ALTER TABLE public."bookings" ADD COLUMN IF NOT EXISTS "reminder_claimed_at" TIMESTAMPTZ;
+-- bookings_archive must keep the same columns as bookings (see 003).
+ALTER TABLE public."bookings_archive" ADD COLUMN IF NOT EXISTS "reminder_claimed_at" TIMESTAMPTZ;
@@ -0,0 +1,47 @@
+-- Migration 015: per-owner caps on slot holds (holds.SupabaseHoldStore). Requires 006.
+-- Run once in the Supabase SQL editor (safe to re-run). Only needed with HOLD_STORE=supabase.
+--
+-- A hold's session token comes from a cookie the client can drop, so "one hold per token" alone let a
+-- script hold every slot. Holds now also record the IP address and device cookie they were taken from,
+-- and acquire_slot_hold() refuses a new hold when that IP / device already has its maximum of live holds
+-- under other tokens. It now returns 1 (acquired), 0 (held by another token) or -1 (owner limit reached).
+
+ALTER TABLE public."slot_holds" ADD COLUMN IF NOT EXISTS "owner_ip" TEXT;
+ALTER TABLE public."slot_holds" ADD COLUMN IF NOT EXISTS "owner_device" TEXT;
+CREATE INDEX IF NOT EXISTS slot_holds_owner_ip_idx ON public."slot_holds" (owner_ip, expires_at);
+CREATE INDEX IF NOT EXISTS slot_holds_owner_device_idx ON public."slot_holds" (owner_device, expires_at);
+
+-- The return type changes (BOOLEAN -> INT), so the 006 version has to be dropped first.
+DROP FUNCTION IF EXISTS public.acquire_slot_hold(BIGINT, TEXT, TEXT, TEXT, INT);
+CREATE OR REPLACE FUNCTION public.acquire_slot_hold(p_doctor_id BIGINT, p_booking_date TEXT, p_booking_time TEXT,
+                                                    p_token TEXT, p_ttl_seconds INT,
+                                                    p_owner_ip TEXT DEFAULT NULL, p_owner_device TEXT DEFAULT NULL,
+                                                    p_max_per_ip INT DEFAULT NULL, p_max_per_device INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+    acquired INT;
+BEGIN
+    IF p_max_per_ip IS NOT NULL AND p_owner_ip IS NOT NULL AND
+       (SELECT count(*) FROM public."slot_holds" AS h
+         WHERE h.owner_ip = p_owner_ip AND h.expires_at > now() AND h.token <> p_token) >= p_max_per_ip THEN
+        RETURN -1;
+    END IF;
+    IF p_max_per_device IS NOT NULL AND p_owner_device IS NOT NULL AND
+       (SELECT count(*) FROM public."slot_holds" AS h
+         WHERE h.owner_device = p_owner_device AND h.expires_at > now() AND h.token <> p_token) >= p_max_per_device THEN
+        RETURN -1;
+    END IF;
+    DELETE FROM public."slot_holds"
+     WHERE token = p_token
+       AND (doctor_id, booking_date, booking_time) IS DISTINCT FROM (p_doctor_id, p_booking_date, p_booking_time);
+    INSERT INTO public."slot_holds" (doctor_id, booking_date, booking_time, token, expires_at, owner_ip, owner_device)
+    VALUES (p_doctor_id, p_booking_date, p_booking_time, p_token, now() + make_interval(secs => p_ttl_seconds),
+            p_owner_ip, p_owner_device)
+    ON CONFLICT (doctor_id, booking_date, booking_time) DO UPDATE
+       SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at,
+           owner_ip = EXCLUDED.owner_ip, owner_device = EXCLUDED.owner_device
+     WHERE slot_holds.token = EXCLUDED.token OR slot_holds.expires_at <= now();
+    GET DIAGNOSTICS acquired = ROW_COUNT;
+    RETURN CASE WHEN acquired > 0 THEN 1 ELSE 0 END;
+END;
+$$ LANGUAGE plpgsql;
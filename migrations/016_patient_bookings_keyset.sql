@@ -0,0 +1,44 @@
+-- Migration 016: keyset pagination for patient_bookings() (PATIENT_DASHBOARD_RPC_ENABLED in app.py). Replaces 010.
+-- Run once in the Supabase SQL editor after 010 (safe to re-run).
+--
+-- Pages used to be LIMIT/OFFSET, so page N read and threw away every row of the pages before it, from both tables.
+-- A page now starts strictly after the cursor (p_after_date, p_after_time, p_after_id) — the last row of the previous
+-- page on the (booking_date, booking_time, id) DESC order — and NULLs mean the first page. Each table is filtered,
+-- ordered and limited on its own before the merge, so neither side reads more than one page.
+
+DROP FUNCTION IF EXISTS public.patient_bookings(BIGINT[], TEXT, TEXT, BOOLEAN, INT, INT);
+CREATE OR REPLACE FUNCTION public.patient_bookings(p_patient_ids BIGINT[], p_phone TEXT, p_name TEXT,
+                                                   p_include_archive BOOLEAN, p_limit INT,
+                                                   p_after_date TEXT DEFAULT NULL, p_after_time TEXT DEFAULT NULL,
+                                                   p_after_id BIGINT DEFAULT NULL)
+RETURNS TABLE (id BIGINT, doctor_id BIGINT, doctor_name TEXT, patient_name TEXT, patient_phone TEXT,
+               booking_date TEXT, booking_time TEXT, status TEXT, notes TEXT, is_deletable BOOLEAN) AS $$
+    WITH matched AS (
+        (SELECT b.id, b.doctor_id, b.doctor_name, b.patient_name, b.patient_phone, b.booking_date, b.booking_time,
+                b.status, b.notes, b.start_at
+           FROM public."bookings" AS b
+          WHERE b.status <> 'Cancelled'
+            AND ((p_patient_ids IS NOT NULL AND b.patient_id = ANY(p_patient_ids))
+              OR (p_patient_ids IS NULL AND (b.patient_phone = p_phone OR b.patient_name ILIKE '%' || p_name || '%')))
+            AND (p_after_id IS NULL OR (b.booking_date::TEXT, b.booking_time::TEXT, b.id) < (p_after_date, p_after_time, p_after_id))
+          ORDER BY b.booking_date DESC, b.booking_time DESC, b.id DESC
+          LIMIT p_limit)
+        UNION ALL
+        (SELECT a.id, a.doctor_id, a.doctor_name, a.patient_name, a.patient_phone, a.booking_date, a.booking_time,
+                a.status, a.notes, a.start_at
+           FROM public."bookings_archive" AS a
+          WHERE p_include_archive
+            AND a.status <> 'Cancelled'
+            AND ((p_patient_ids IS NOT NULL AND a.patient_id = ANY(p_patient_ids))
+              OR (p_patient_ids IS NULL AND (a.patient_phone = p_phone OR a.patient_name ILIKE '%' || p_name || '%')))
+            AND (p_after_id IS NULL OR (a.booking_date::TEXT, a.booking_time::TEXT, a.id) < (p_after_date, p_after_time, p_after_id))
+          ORDER BY a.booking_date DESC, a.booking_time DESC, a.id DESC
+          LIMIT p_limit)
+    )
+    SELECT m.id::BIGINT, m.doctor_id::BIGINT, m.doctor_name::TEXT, m.patient_name::TEXT, m.patient_phone::TEXT,
+           m.booking_date::TEXT, m.booking_time::TEXT, m.status::TEXT, m.notes::TEXT,
+           coalesce(m.status = 'Pending' AND m.start_at > now()::timestamp, FALSE)
+      FROM matched AS m
+     ORDER BY m.booking_date DESC, m.booking_time DESC, m.id DESC
+     LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,114 @@
+-- Migration 017: keep doctor_rating_summary / site_review_summary in step with every review change. Requires 012.
+-- Run once in the Supabase SQL editor (safe to re-run; a re-run rebuilds both summaries from the approved rows).
+--
+-- In 012 only approve_reviews() / approve_site_reviews() added to the summaries, so reviews approved on insert
+-- (moderation off), deleted reviews and approvals changed by hand were never counted, and the ratings were stale by
+-- the time moderation was switched on. Row triggers on reviews / site_reviews now subtract a row's old contribution
+-- and add its new one on INSERT, DELETE and UPDATE OF is_approved / rating / doctor_id, whoever makes the change.
+-- The approve RPCs become plain updates (the triggers do the counting, so nothing is counted twice).
+-- Re-running 012 would bring back its counting approve RPCs, so run this file again after it.
+
+-- Adds (p_sign = 1) or removes (p_sign = -1) one approved review from doctor_rating_summary.
+-- Same validity rule as rating_stats.py: a doctor_id of an existing doctor and a rating between 1 and 5.
+CREATE OR REPLACE FUNCTION public.bump_doctor_rating_summary(p_doctor_id BIGINT, p_rating DOUBLE PRECISION, p_sign INT)
+RETURNS VOID AS $$
+    INSERT INTO public."doctor_rating_summary" AS s
+           (doctor_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+    SELECT d.id, p_sign, p_sign * p_rating,
+           CASE WHEN round(p_rating) = 1 THEN p_sign ELSE 0 END, CASE WHEN round(p_rating) = 2 THEN p_sign ELSE 0 END,
+           CASE WHEN round(p_rating) = 3 THEN p_sign ELSE 0 END, CASE WHEN round(p_rating) = 4 THEN p_sign ELSE 0 END,
+           CASE WHEN round(p_rating) = 5 THEN p_sign ELSE 0 END
+      FROM public."doctors" AS d
+     WHERE d.id = p_doctor_id AND p_rating BETWEEN 1 AND 5
+    ON CONFLICT ON CONSTRAINT doctor_rating_summary_pkey DO UPDATE
+       SET review_count = s.review_count + EXCLUDED.review_count,
+           rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+           stars_1 = s.stars_1 + EXCLUDED.stars_1, stars_2 = s.stars_2 + EXCLUDED.stars_2,
+           stars_3 = s.stars_3 + EXCLUDED.stars_3, stars_4 = s.stars_4 + EXCLUDED.stars_4,
+           stars_5 = s.stars_5 + EXCLUDED.stars_5, updated_at = now();
+$$ LANGUAGE sql;
+
+-- Row trigger on reviews: takes the old row out of the summary (if it was counted) and puts the new one in.
+CREATE OR REPLACE FUNCTION public.reviews_summary_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_approved = 1 AND OLD.doctor_id IS NOT NULL THEN
+        PERFORM public.bump_doctor_rating_summary(OLD.doctor_id, OLD.rating, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_approved = 1 AND NEW.doctor_id IS NOT NULL THEN
+        PERFORM public.bump_doctor_rating_summary(NEW.doctor_id, NEW.rating, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Row trigger on site_reviews: same for the approved site review count.
+CREATE OR REPLACE FUNCTION public.site_reviews_summary_trigger()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_delta INT := 0;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_approved = 1 THEN v_delta := v_delta - 1; END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_approved = 1 THEN v_delta := v_delta + 1; END IF;
+    IF v_delta <> 0 THEN
+        INSERT INTO public."site_review_summary" AS s (id, approved_count) VALUES (1, v_delta)
+        ON CONFLICT (id) DO UPDATE SET approved_count = s.approved_count + EXCLUDED.approved_count, updated_at = now();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS reviews_summary ON public."reviews";
+CREATE TRIGGER reviews_summary
+    AFTER INSERT OR DELETE OR UPDATE OF is_approved, rating, doctor_id ON public."reviews"
+    FOR EACH ROW EXECUTE FUNCTION public.reviews_summary_trigger();
+DROP TRIGGER IF EXISTS site_reviews_summary ON public."site_reviews";
+CREATE TRIGGER site_reviews_summary
+    AFTER INSERT OR DELETE OR UPDATE OF is_approved ON public."site_reviews"
+    FOR EACH ROW EXECUTE FUNCTION public.site_reviews_summary_trigger();
+
+-- Approves the given reviews that are still pending (the trigger adds them to doctor_rating_summary).
+-- Returns the doctors whose reviews were approved (rows already moderated by another run are skipped).
+CREATE OR REPLACE FUNCTION public.approve_reviews(p_ids BIGINT[])
+RETURNS TABLE (doctor_id BIGINT) AS $$
+    WITH approved AS (
+        UPDATE public."reviews" AS r
+           SET is_approved = 1, moderation_reason = NULL, moderated_at = now()
+         WHERE r.id = ANY(p_ids) AND r.is_approved = 0
+        RETURNING r.doctor_id AS doc_id
+    )
+    SELECT DISTINCT a.doc_id::BIGINT FROM approved AS a WHERE a.doc_id IS NOT NULL;
+$$ LANGUAGE sql;
+
+-- Approves the given site reviews that are still pending (the trigger counts them). Returns the number approved.
+CREATE OR REPLACE FUNCTION public.approve_site_reviews(p_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    UPDATE public."site_reviews" AS r
+       SET is_approved = 1, moderation_reason = NULL, moderated_at = now()
+     WHERE r.id = ANY(p_ids) AND r.is_approved = 0;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- (Re)build both summaries from the rows approved so far, with writes to the reviews held off meanwhile so no change
+-- is both in the rebuilt totals and applied again by a trigger.
+BEGIN;
+LOCK TABLE public."reviews", public."site_reviews" IN SHARE MODE;
+DELETE FROM public."doctor_rating_summary";
+INSERT INTO public."doctor_rating_summary" (doctor_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT r.doctor_id, count(*), sum(r.rating),
+       count(*) FILTER (WHERE round(r.rating) = 1), count(*) FILTER (WHERE round(r.rating) = 2),
+       count(*) FILTER (WHERE round(r.rating) = 3), count(*) FILTER (WHERE round(r.rating) = 4),
+       count(*) FILTER (WHERE round(r.rating) = 5)
+  FROM public."reviews" AS r
+  JOIN public."doctors" AS d ON d.id = r.doctor_id
+ WHERE r.is_approved = 1 AND r.rating BETWEEN 1 AND 5
+ GROUP BY r.doctor_id;
+INSERT INTO public."site_review_summary" (id, approved_count)
+SELECT 1, count(*) FROM public."site_reviews" WHERE is_approved = 1
+ON CONFLICT (id) DO UPDATE SET approved_count = EXCLUDED.approved_count, updated_at = now();
+COMMIT;
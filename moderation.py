@@ -0,0 +1,106 @@
+# --- START OF FILE moderation.py ---
+# Review moderation pipeline used by app.py.
+# With moderation enabled, doctor reviews and site reviews are inserted as pending (is_approved = 0) and a background
+# job picks them up in batches: each review is checked against cheap spam/profanity heuristics, clean ones are approved
+# and the rest are rejected (is_approved = -1) with the reasons recorded. Approvals go through the approve_reviews() /
+# approve_site_reviews() RPCs (migrations/012, 017), which flip only rows that are still pending; triggers on the review
+# tables (migrations/017) keep doctor_rating_summary / site_review_summary current, so readers never rescan reviews.
+
+# --- Standard Library Imports ---
+import re                       # Link / number / repeated-character heuristics.
+from datetime import datetime, timezone # moderated_at timestamps.
+
+# --- Local Module Imports ---
+from patients import normalize_name # Same Arabic folding as patient names, so blocked words match their variants.
+
+# Values of the is_approved column.
+PENDING = 0
+APPROVED = 1
+REJECTED = -1
+# Pending reviews read (and written) per batch, and batches per run.
+MODERATION_BATCH_SIZE = 200
+MODERATION_MAX_BATCHES = 10
+# Moderated tables: name -> (name column, approval RPC).
+TABLES = {
+    'reviews': ('reviewer_name', 'approve_reviews'),
+    'site_reviews': ('reviewer_name', 'approve_site_reviews'),
+}
+# Words that reject a review on sight (extend with MODERATION_BLOCKED_WORDS in app.py).
+DEFAULT_BLOCKED_WORDS = frozenset({'fuck', 'fucking', 'shit', 'bitch', 'bastard', 'asshole', 'dick', 'whore', 'slut'})
+
+# URLs, bare domains and "www." links.
+_LINK = re.compile(r'https?://|www\.|\b[\w-]+\.(?:com|net|org|info|biz|xyz|ru|top|me|ly)\b', re.IGNORECASE)
+# Eight or more digits in a row (spaces/dashes allowed): a phone or account number being advertised.
+_LONG_NUMBER = re.compile(r'\d(?:[\s-]?\d){7,}')
+# The same character eight or more times in a row.
+_REPEATED_CHAR = re.compile(r'(.)\1{7,}')
+
+
+# Normalizes a list of blocked words (same folding as normalize_name, empty entries dropped).
+def blocked_word_set(words):
+    return frozenset(filter(None, (normalize_name(word) for word in words)))
+
+
+# Reasons to reject one review (empty list = approve). `blocked_words` must already be normalized.
+def review_problems(name, comment, blocked_words=DEFAULT_BLOCKED_WORDS):
+    problems = []
+    text = f"{name or ''} {comment or ''}"
+    if _LINK.search(text): problems.append('link')
+    if _LONG_NUMBER.search(comment or ''): problems.append('contact number')
+    if _REPEATED_CHAR.search(text): problems.append('repeated characters')
+    if blocked_words and set(re.findall(r'\w+', normalize_name(text) or '')) & blocked_words: problems.append('profanity')
+    return problems
+
+
+# Moderates one batch of pending rows from `table_name`; returns (rows read, approved ids, rejected ids, doctor ids).
+def moderate_batch(supabase, table_name, blocked_words=DEFAULT_BLOCKED_WORDS, batch_size=MODERATION_BATCH_SIZE):
+    name_col, approve_rpc = TABLES[table_name]
+    columns = f"id, {name_col}, comment" + (", doctor_id" if table_name == 'reviews' else '')
+    # Oldest pending first (partial index on pending rows).
+    rows = supabase.table(table_name).select(columns).eq('is_approved', PENDING) \
+        .order('id', desc=False).limit(batch_size).execute().data or []
+    approve = []; reject = {}; seen_comments = set()
+    for row in rows:
+        problems = review_problems(row.get(name_col), row.get('comment'), blocked_words)
+        # The same non-trivial comment posted again within a batch is a flood; the first copy is judged on its own.
+        comment_key = normalize_name(row.get('comment'))
+        if comment_key and len(comment_key) >= 20:
+            if comment_key in seen_comments: problems.append('duplicate')
+            seen_comments.add(comment_key)
+        if problems: reject.setdefault(', '.join(problems), []).append(row['id'])
+        else: approve.append(row['id'])
+    doctor_ids = set()
+    if approve:
+        # Approves the rows still pending (the summary triggers count them); returns the affected doctors (reviews only).
+        res = supabase.rpc(approve_rpc, {'p_ids': approve}).execute()
+        if table_name == 'reviews': doctor_ids = {row['doctor_id'] for row in (res.data or []) if row.get('doctor_id') is not None}
+    moderated_at = datetime.now(timezone.utc).isoformat()
+    for reason, ids in reject.items():
+        # Only rows that are still pending (another worker may have handled them meanwhile).
+        supabase.table(table_name).update({'is_approved': REJECTED, 'moderation_reason': reason, 'moderated_at': moderated_at}) \
+            .in_('id', ids).eq('is_approved', PENDING).execute()
+    return len(rows), approve, [row_id for ids in reject.values() for row_id in ids], doctor_ids
+
+
+# Moderates every pending review and site review, batch by batch, and reports what it did.
+def moderate_pending(supabase, blocked_words=DEFAULT_BLOCKED_WORDS, batch_size=MODERATION_BATCH_SIZE,
+                     max_batches=MODERATION_MAX_BATCHES):
+    """Approves or rejects pending reviews in both tables (at most `max_batches` batches each).
+
+    Returns a dict with approved/rejected counts per table and `doctor_ids`, the set of doctors whose
+    rating changed (their rank scores need a refresh).
+    """
+    report = {'doctor_ids': set()}
+    for table_name in TABLES:
+        approved = rejected = 0
+        for _ in range(max_batches):
+            read, approve, reject, doctor_ids = moderate_batch(supabase, table_name, blocked_words, batch_size)
+            approved += len(approve); rejected += len(reject); report['doctor_ids'] |= doctor_ids
+            # A short batch means nothing is left.
+            if read < batch_size: break
+        report[table_name] = {'approved': approved, 'rejected': rejected}
+        if approved or rejected:
+            print(f"INFO (moderation): {table_name}: {approved} approved, {rejected} rejected.")
+    return report
+
+# --- END OF FILE moderation.py ---
@@ -0,0 +1,149 @@
+# --- START OF FILE patients.py ---
+# Patient identity used by app.py to find "this person's" bookings and reviews with one query.
+# The old routes ran two queries per check (one by name, one by phone) and merged them in Python. Here a person is
+# resolved once to a PatientIdentity, and `match()` turns it into a single filter on a bookings/reviews query:
+#   * with the patient index (migrations/009): the ids of every patient whose normalized phone or normalized name
+#     matches (one indexed query on `patients`), filtered as `patient_id IN (...)`;
+#   * without it: one PostgREST OR filter on the raw name/phone columns (same matching as before).
+# Normalization must stay identical to public.normalize_phone() / public.normalize_name() in migrations/009.
+
+# --- Standard Library Imports ---
+import base64                   # URL-safe booking cursor encoding.
+import re                       # Strips non-digits / Arabic diacritics.
+
+# Arabic diacritics (fathatan .. sukun) and the tatweel (kashida) character, removed from names.
+_NAME_STRIP = re.compile('[\u064B-\u0652\u0640]')
+# Arabic letter variants folded together in names (hamza forms of alef, teh marbuta, alef maksura).
+_NAME_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ة': 'ه', 'ى': 'ي'})
+
+
+# Normalized phone: digits only, without the 00 / +967 prefix or a leading trunk 0. None if there are no digits.
+def normalize_phone(raw):
+    digits = re.sub(r'\D', '', raw or '')
+    if digits.startswith('00'): digits = digits[2:]
+    if len(digits) == 12 and digits.startswith('967'): digits = digits[3:]
+    if len(digits) == 10 and digits.startswith('0'): digits = digits[1:]
+    return digits or None
+
+
+# Normalized name: no diacritics/tatweel, folded letter variants, single spaces, lower case. None if empty.
+def normalize_name(raw):
+    name = _NAME_STRIP.sub('', raw or '').translate(_NAME_FOLD)
+    return ' '.join(name.split()).lower() or None
+
+
+# Quotes a value for a PostgREST OR filter (commas, dots and parentheses are otherwise syntax).
+def quote_filter_value(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# Adds a PostgREST OR filter (`conditions` = "col.op.value,and(...),...") to `query`.
+# The pinned postgrest client (0.11) has no or_(), so the `or=(...)` parameter is added the way later versions do it.
+def or_filter(query, conditions):
+    query.params = query.params.add('or', f"({conditions})")
+    return query
+
+
+# Orders `query` by several columns in one `order=` parameter ("booking_date.desc", "id.desc", ...). The pinned postgrest
+# client adds one `order` parameter per order() call, and keyset pages need the whole sort key applied.
+def order_by(query, *terms):
+    query.params = query.params.add('order', ','.join(terms))
+    return query
+
+
+# A person as identified by a form (name and/or phone), optionally resolved to patient ids.
+class PatientIdentity:
+    """Name/phone as entered, plus `patient_ids` (None when the patient index is not in use)."""
+
+    # Constructor: store the raw values and resolved ids.
+    def __init__(self, name=None, phone=None, patient_ids=None):
+        self.name = (name or '').strip() or None
+        self.phone = (phone or '').strip() or None
+        self.patient_ids = patient_ids
+
+    # True if there is nothing to look up (no name, no phone).
+    def __bool__(self):
+        return bool(self.name or self.phone)
+
+
+# Ids of every patient whose normalized phone or normalized name matches (one query on `patients`).
+def lookup_patient_ids(supabase, name=None, phone=None):
+    conditions = []
+    phone_norm = normalize_phone(phone); name_norm = normalize_name(name)
+    if phone_norm: conditions.append(f"phone_norm.eq.{quote_filter_value(phone_norm)}")
+    if name_norm: conditions.append(f"name_norm.eq.{quote_filter_value(name_norm)}")
+    if not conditions: return []
+    res = or_filter(supabase.table('patients').select('id'), ','.join(conditions)).execute()
+    return [row['id'] for row in (res.data or [])]
+
+
+# Builds the identity for a name/phone pair; with `indexed` the patient ids are resolved up front.
+def identify(supabase, name=None, phone=None, indexed=False):
+    identity = PatientIdentity(name, phone)
+    if indexed and identity: identity.patient_ids = lookup_patient_ids(supabase, identity.name, identity.phone)
+    return identity
+
+
+# Restricts `query` to rows belonging to `identity` (one filter, so one round trip per query).
+# `name_col` / `phone_col` are the raw columns used without the patient index; `name_like` matches the name as a
+# case-insensitive substring there (patient login / dashboard), otherwise exactly.
+def match(query, identity, name_col='patient_name', phone_col='patient_phone', name_like=False):
+    if identity.patient_ids is not None:
+        return query.in_('patient_id', identity.patient_ids)
+    conditions = []
+    if identity.phone: conditions.append(f"{phone_col}.eq.{quote_filter_value(identity.phone)}")
+    if identity.name:
+        conditions.append(f"{name_col}.ilike.{quote_filter_value('*' + identity.name + '*')}" if name_like
+                          else f"{name_col}.eq.{quote_filter_value(identity.name)}")
+    return or_filter(query, ','.join(conditions))
+
+
+# Encodes a booking's (booking_date, booking_time, id) position as an opaque URL-safe cursor.
+# Dashboard pages are newest first on that key; the next page is "strictly older than the cursor".
+def encode_booking_cursor(booking):
+    key = f"{booking.get('booking_date') or ''}|{booking.get('booking_time') or ''}|{booking.get('id')}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+# Decodes a booking cursor back to (booking_date, booking_time, id). Raises ValueError if it is malformed.
+def decode_booking_cursor(cursor):
+    try:
+        booking_date, _, rest = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().partition('|')
+        booking_time, _, booking_id = rest.rpartition('|')
+        if not booking_date or not booking_time: raise ValueError('missing booking_date/booking_time')
+        return booking_date, booking_time, int(booking_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid booking cursor: {e}") from None
+
+
+# Restricts a bookings query to rows strictly older than the decoded cursor `after` on (booking_date, booking_time, id),
+# so a page is one range read however deep the patient pages (no OFFSET rows read and thrown away).
+def older_than(query, after):
+    booking_date, booking_time, booking_id = after
+    day, slot = quote_filter_value(booking_date), quote_filter_value(booking_time)
+    return or_filter(query, f"booking_date.lt.{day},and(booking_date.eq.{day},booking_time.lt.{slot}),"
+                            f"and(booking_date.eq.{day},booking_time.eq.{slot},id.lt.{booking_id})")
+
+
+# One page of the patient's non-cancelled bookings, newest first, with `is_deletable` computed in SQL
+# (patient_bookings() RPC, migrations/016). `limit` rows strictly older than the decoded cursor `after` (None = newest).
+def fetch_bookings_page(supabase, identity, include_archive=False, limit=20, after=None):
+    after_date, after_time, after_id = after or (None, None, None)
+    res = supabase.rpc('patient_bookings', {
+        'p_patient_ids': identity.patient_ids, 'p_phone': identity.phone, 'p_name': identity.name,
+        'p_include_archive': include_archive, 'p_limit': limit,
+        'p_after_date': after_date, 'p_after_time': after_time, 'p_after_id': after_id}).execute()
+    return res.data or []
+
+
+# Review eligibility for one doctor in one call (review_eligibility() RPC, migrations/011): a dict with
+# review_exists, last_booking_date / last_booking_time (latest started non-cancelled booking, or None) and
+# next_start_at (start of the next upcoming one, ISO text, or None).
+def fetch_review_eligibility(supabase, doctor_id, identity):
+    res = supabase.rpc('review_eligibility', {
+        'p_doctor_id': doctor_id, 'p_patient_ids': identity.patient_ids,
+        'p_phone': identity.phone, 'p_name': identity.name}).execute()
+    rows = res.data if isinstance(res.data, list) else [res.data] if res.data else []
+    return rows[0] if rows else {'review_exists': False, 'last_booking_date': None, 'last_booking_time': None, 'next_start_at': None}
+
+# --- END OF FILE patients.py ---
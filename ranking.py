@@ -0,0 +1,139 @@
+# --- START OF FILE ranking.py ---
+# Doctor ranking engine used by app.py for the "recommended" search order.
+# Each doctor gets a precomputed rank_score (stored in the doctor_rankings table, migrations/004) that combines:
+#   * a time-decayed Bayesian rating: reviews lose half their weight every RANK_HALF_LIFE_DAYS, and the
+#     weighted mean is smoothed towards rating_stats.RATING_PRIOR_MEAN, so one fresh 5-star review does not
+#     outrank hundreds of 4.8s;
+#   * next-available-slot proximity: doctors who can see a patient sooner score higher.
+# Scores are refreshed for single doctors when their reviews/bookings change, and for everyone periodically
+# (time decay and slot proximity drift even when nothing changes).
+
+# --- Standard Library Imports ---
+from datetime import datetime, timedelta, timezone # Review ages, slot search window, timestamps.
+
+# --- Third-Party Imports ---
+import numpy as np              # Vectorized decay weights and per-doctor sums (bincount).
+
+# --- Local Module Imports ---
+from rating_stats import RATING_PRIOR_MEAN, RATING_PRIOR_WEIGHT, rating_columns # Shared prior and validity rule.
+from slot_index import earliest_open_slot # Shared next-open-slot search.
+
+# Reviews lose half their weight after this many days.
+RANK_HALF_LIFE_DAYS = 180
+# How far ahead to look for the next free slot.
+RANK_SLOT_HORIZON_DAYS = 14
+# Hours at which the availability component drops to one half (1 / (1 + hours / RANK_SLOT_HALF_HOURS)).
+RANK_SLOT_HALF_HOURS = 48
+# Weights of the two components (both are in 0..1, so rank_score is in 0..1).
+RANK_RATING_WEIGHT = 0.75
+RANK_AVAILABILITY_WEIGHT = 0.25
+# Table holding the precomputed scores.
+RANKINGS_TABLE = 'doctor_rankings'
+
+
+# --- Components ---
+
+# Parses a Supabase timestamp string to an aware UTC datetime (None if missing/invalid).
+def _parse_timestamp(value):
+    if not value: return None
+    try: parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError: return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+# Computes the time-decayed Bayesian rating for every doctor in the reviews.
+def decayed_ratings(reviews, now=None, half_life_days=RANK_HALF_LIFE_DAYS):
+    """Returns {doctor_id: decayed Bayesian mean (1..5)} from approved review rows (doctor_id, rating, created_at)."""
+    now = now or datetime.now(timezone.utc)
+    # Same validity rule as rating_stats; the mask also selects the matching review ages.
+    doctor_ids, ratings, valid = rating_columns(reviews)
+    if not valid.any(): return {}
+    # Age in days (reviews without a timestamp count as fresh).
+    ages = np.array([(now - created).total_seconds() / 86400 if created else 0.0
+                     for created in (_parse_timestamp(r.get('created_at')) for r in reviews)], dtype=np.float64)
+    doctor_ids, ratings, ages = doctor_ids[valid], ratings[valid], ages[valid]
+    weights = np.power(0.5, np.clip(ages, 0, None) / half_life_days)
+    # Dense doctor codes, then weighted sums in two bincounts.
+    unique_ids, codes = np.unique(doctor_ids, return_inverse=True)
+    weight_sums = np.bincount(codes, weights=weights, minlength=len(unique_ids))
+    rating_sums = np.bincount(codes, weights=weights * ratings, minlength=len(unique_ids))
+    smoothed = (RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT + rating_sums) / (RATING_PRIOR_WEIGHT + weight_sums)
+    return {int(doc_id): float(smoothed[i]) for i, doc_id in enumerate(unique_ids)}
+
+# Finds the start of the first free slot in a weekly schedule, skipping booked (date, slot) pairs.
+def next_free_slot(availability, booked, now=None, horizon_days=RANK_SLOT_HORIZON_DAYS):
+    """Returns the datetime of the doctor's next unbooked slot within `horizon_days`, or None (see slot_index)."""
+    found = earliest_open_slot(availability, booked, now, horizon_days + 1)
+    return found[0] if found else None
+
+# Combines the components into the final score.
+def rank_score(decayed_rating, next_slot_at, now=None):
+    """Returns a 0..1 score from a 1..5 decayed rating and the next free slot datetime (None = none soon)."""
+    now = now or datetime.now()
+    rating_part = (decayed_rating - 1) / 4
+    if next_slot_at is None:
+        availability_part = 0.0
+    else:
+        hours = max(0.0, (next_slot_at - now).total_seconds() / 3600)
+        availability_part = 1 / (1 + hours / RANK_SLOT_HALF_HOURS)
+    return RANK_RATING_WEIGHT * rating_part + RANK_AVAILABILITY_WEIGHT * availability_part
+
+
+# --- Refresh ---
+
+# Recomputes and stores rank scores for some or all doctors.
+def refresh_rank_scores(supabase, doctor_ids=None, now=None):
+    """Recomputes rank_score for `doctor_ids` (all doctors if None) and upserts them into doctor_rankings.
+
+    Uses three queries (doctors, approved reviews, upcoming bookings) and one upsert regardless of
+    the number of doctors. Returns the number of doctors scored.
+    """
+    now = now or datetime.now()
+    # Restrict every query to the affected doctors for incremental refreshes.
+    def scoped(query):
+        return query.in_('doctor_id', list(doctor_ids)) if doctor_ids is not None else query
+    doctors_query = supabase.table('doctors').select('id, availability')
+    if doctor_ids is not None:
+        if not doctor_ids: return 0
+        doctors_query = doctors_query.in_('id', list(doctor_ids))
+    doctors = doctors_query.execute().data or []
+    if not doctors: return 0
+    reviews = scoped(supabase.table('reviews').select('doctor_id, rating, created_at').eq('is_approved', 1)).execute().data or []
+    # Bookings in the slot window that still occupy a slot.
+    window_end = (now.date() + timedelta(days=RANK_SLOT_HORIZON_DAYS)).strftime('%Y-%m-%d')
+    bookings = scoped(supabase.table('bookings').select('doctor_id, booking_date, booking_time')
+                      .gte('booking_date', now.strftime('%Y-%m-%d')).lte('booking_date', window_end)
+                      .neq('status', 'Cancelled')).execute().data or []
+    booked_by_doctor = {}
+    for b in bookings:
+        booked_by_doctor.setdefault(b.get('doctor_id'), set()).add((b.get('booking_date'), b.get('booking_time')))
+    ratings = decayed_ratings(reviews, now=datetime.now(timezone.utc))
+    # Build one row per doctor and store them in a single upsert.
+    updated_at = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for doc in doctors:
+        decayed = ratings.get(doc['id'], RATING_PRIOR_MEAN)
+        next_slot = next_free_slot(doc.get('availability'), booked_by_doctor.get(doc['id'], set()), now)
+        rows.append({'doctor_id': doc['id'], 'rank_score': round(rank_score(decayed, next_slot, now), 6),
+                     'ranked_rating': round(decayed, 3), 'next_slot_at': next_slot.isoformat() if next_slot else None,
+                     'updated_at': updated_at})
+    supabase.table(RANKINGS_TABLE).upsert(rows, on_conflict='doctor_id').execute()
+    print(f"INFO (ranking): Refreshed rank scores for {len(rows)} doctor(s).")
+    return len(rows)
+
+# Loads stored scores and copies them onto doctor dicts.
+def apply_rank_scores(supabase, doctors):
+    """Sets rank_score and next_slot_at on each doctor dict (0.0 / None when no score is stored yet)."""
+    try:
+        res = supabase.table(RANKINGS_TABLE).select('doctor_id, rank_score, next_slot_at').execute()
+        scores = {row['doctor_id']: row for row in (res.data or [])}
+    # A missing table (migration 004 not run yet) just means no ranking.
+    except Exception as e:
+        print(f"WARN (ranking): Could not load rank scores: {e}")
+        scores = {}
+    for doc in doctors:
+        stored = scores.get(doc.get('id'), {})
+        doc['rank_score'] = stored.get('rank_score') or 0.0
+        doc['next_slot_at'] = stored.get('next_slot_at')
+    return doctors
+
+# --- END OF FILE ranking.py ---
@@ -0,0 +1,130 @@
+# --- START OF FILE ratelimit.py ---
+# Token-bucket rate limiting for the expensive endpoints in app.py (booking, reviews, nearest-slot search).
+# Every request to a limited endpoint takes one token from each of its client's buckets (one per identity: IP address,
+# device cookie, browser fingerprint). A bucket holds up to `capacity` tokens and refills at `capacity / period`
+# tokens per second. If any of the buckets is empty the request is rejected and no token is taken from the others,
+# so a rejected burst doesn't keep draining them.
+#
+# Two interchangeable backends (same methods, same choice as holds.py):
+#   * MemoryRateLimiter:   buckets in a dict in this process (default; correct for a single app process).
+#   * SupabaseRateLimiter: the rate_limit_buckets table + take_rate_limit_tokens() function (migrations/008),
+#                          shared by every app process; each check is one round trip.
+# Both keep rejection counters in memory (per endpoint and per identity kind) for /api/rate-limit/metrics.
+
+# --- Standard Library Imports ---
+import threading                # Lock protecting buckets and counters.
+import time                     # Monotonic clock for in-memory refills.
+from collections import defaultdict # Rejection counters.
+
+
+# One endpoint's limit: `capacity` requests per `period` seconds, per identity.
+class Limit:
+    """Bucket size and refill period for one endpoint; IP buckets get `ip_factor` times the capacity."""
+
+    # Constructor: store the settings.
+    def __init__(self, capacity, period, ip_factor=4):
+        self.capacity = capacity
+        self.period = period
+        # Many patients can share one IP (mobile carriers, clinics), so IP buckets are larger.
+        self.ip_factor = ip_factor
+
+    # Bucket size for an identity kind ('ip', 'device', 'fingerprint').
+    def capacity_for(self, kind):
+        return self.capacity * self.ip_factor if kind == 'ip' else self.capacity
+
+
+# Rejection counters shared by both backends.
+class _Counters:
+    # Constructor: zeroed counters.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._allowed = defaultdict(int)
+        self._rejected = defaultdict(int)
+        self._rejected_by = defaultdict(int)
+        self._errors = 0
+
+    # Counts one decision (and, for a rejection, which identity kinds ran out).
+    def record(self, endpoint, allowed, empty_kinds=()):
+        with self._lock:
+            if allowed: self._allowed[endpoint] += 1; return
+            self._rejected[endpoint] += 1
+            for kind in empty_kinds: self._rejected_by[f"{endpoint}:{kind}"] += 1
+
+    # Counts a backend failure (the request was let through).
+    def record_error(self):
+        with self._lock: self._errors += 1
+
+    # Snapshot for the metrics endpoint.
+    def metrics(self):
+        with self._lock:
+            return {'allowed': dict(self._allowed), 'rejected': dict(self._rejected),
+                    'rejected_by_identity': dict(self._rejected_by), 'backend_errors': self._errors}
+
+
+# In-process rate limiter.
+class MemoryRateLimiter:
+    """Token buckets kept in a dict: (endpoint, kind, value) -> [tokens, monotonic time of last refill]."""
+
+    # Constructor: endpoint name -> Limit.
+    def __init__(self, limits):
+        self.limits = limits
+        self.counters = _Counters()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        # Idle (full) buckets are swept at most once a minute.
+        self._next_sweep = 0.0
+
+    # Drops buckets that have refilled completely (they'd be recreated full anyway). Caller holds the lock.
+    def _sweep(self, now):
+        if now < self._next_sweep: return
+        self._next_sweep = now + 60
+        for key in [key for key, (tokens, stamp) in self._buckets.items()
+                    if now - stamp >= self.limits[key[0]].period]: del self._buckets[key]
+
+    # Takes one token from each identity's bucket for `endpoint`; returns (allowed, kinds whose bucket was empty).
+    # `identities` is a dict of kind -> value; empty values are skipped.
+    def take(self, endpoint, identities):
+        limit = self.limits[endpoint]; now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            refilled, empty = {}, []
+            for kind, value in identities.items():
+                if not value: continue
+                capacity = limit.capacity_for(kind)
+                tokens, stamp = self._buckets.get((endpoint, kind, value), (capacity, now))
+                tokens = min(capacity, tokens + (now - stamp) * capacity / limit.period)
+                refilled[(endpoint, kind, value)] = tokens
+                if tokens < 1: empty.append(kind)
+            # All or nothing: only take tokens when every bucket has one.
+            for key, tokens in refilled.items():
+                self._buckets[key] = (tokens if empty else tokens - 1, now)
+        self.counters.record(endpoint, not empty, empty)
+        return not empty, empty
+
+
+# Rate limiter shared through Supabase (requires migrations/008).
+class SupabaseRateLimiter:
+    """Token buckets in the rate_limit_buckets table; a check is one atomic call (take_rate_limit_tokens RPC)."""
+
+    # Constructor: keep the client and limits.
+    def __init__(self, supabase, limits):
+        self.supabase = supabase
+        self.limits = limits
+        self.counters = _Counters()
+
+    # Same contract as MemoryRateLimiter.take.
+    def take(self, endpoint, identities):
+        limit = self.limits[endpoint]
+        present = [(kind, value) for kind, value in identities.items() if value]
+        if not present: return True, []
+        res = self.supabase.rpc('take_rate_limit_tokens', {
+            'p_keys': [f"{endpoint}:{kind}:{value}" for kind, value in present],
+            'p_capacities': [limit.capacity_for(kind) for kind, _ in present],
+            'p_period_seconds': limit.period}).execute()
+        # The function returns the keys whose bucket was empty (none = allowed).
+        empty_keys = set(res.data or [])
+        empty = [kind for kind, value in present if f"{endpoint}:{kind}:{value}" in empty_keys]
+        self.counters.record(endpoint, not empty, empty)
+        return not empty, empty
+
+# --- END OF FILE ratelimit.py ---
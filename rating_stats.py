@@ -0,0 +1,116 @@
+# --- START OF FILE rating_stats.py ---
+# Doctor rating statistics used by app.py.
+# All pages (home/doctor list, booking page, center details) compute ratings here, from one query of
+# approved reviews, with one validity rule and one vectorized pass: numpy.bincount over dense doctor
+# codes gives review counts, rating sums and 1-5 star histograms for every doctor at once.
+# With review moderation enabled the same stats are read from doctor_rating_summary (migrations/012), which
+# triggers on the reviews table (migrations/017) update incrementally, so no page has to scan the reviews table.
+
+# --- Third-Party Imports ---
+import numpy as np              # Vectorized counting (bincount) and arithmetic.
+
+# Prior used for the Bayesian-smoothed average: a doctor with few reviews is pulled towards
+# RATING_PRIOR_MEAN as if they had RATING_PRIOR_WEIGHT extra reviews of that value. A fixed prior
+# (rather than the mean of whichever reviews were fetched) keeps the number identical on every page.
+RATING_PRIOR_MEAN = 3.5
+RATING_PRIOR_WEIGHT = 5
+
+# Stats returned for a doctor without any valid reviews.
+EMPTY_RATING_STATS = {'review_count': 0, 'average_rating': 0.0, 'bayesian_rating': 0.0, 'rating_histogram': [0, 0, 0, 0, 0]}
+
+
+# Converts one raw rating value to float, or NaN if it isn't a usable number.
+def _rating_value(value):
+    # bool is an int subclass; a True/False rating is not a real rating.
+    if value is None or isinstance(value, bool): return np.nan
+    try: return float(value)
+    except (TypeError, ValueError): return np.nan
+
+# Pulls the (doctor_id, rating) columns out of review rows, with a validity mask.
+def rating_columns(reviews):
+    """Returns (doctor_ids, ratings, valid) arrays with one entry per row in `reviews`.
+
+    A review is valid when it has a doctor_id and a numeric rating between 1 and 5 (inclusive).
+    """
+    # Single pass to pull the two columns out of the row dicts (-1 / NaN mark unusable values).
+    doctor_ids = np.array([r.get('doctor_id') if r.get('doctor_id') is not None else -1 for r in reviews], dtype=np.int64)
+    ratings = np.array([_rating_value(r.get('rating')) for r in reviews], dtype=np.float64)
+    # Vectorized validity mask (NaN comparisons are False, so bad values drop out here).
+    valid = (doctor_ids >= 0) & (ratings >= 1) & (ratings <= 5)
+    return doctor_ids, ratings, valid
+
+# Turns review rows into the columnar (doctor_id, rating) arrays the stats function takes.
+def rating_arrays(reviews):
+    """Returns (doctor_ids int64 array, ratings float64 array) for the valid reviews in `reviews`."""
+    doctor_ids, ratings, valid = rating_columns(reviews)
+    return doctor_ids[valid], ratings[valid]
+
+# Computes all rating stats for every doctor present in the arrays.
+def compute_rating_stats(doctor_ids, ratings, prior_mean=RATING_PRIOR_MEAN, prior_weight=RATING_PRIOR_WEIGHT):
+    """Returns {doctor_id: stats} with review_count, average_rating, bayesian_rating and rating_histogram.
+
+    `doctor_ids` and `ratings` are parallel arrays of valid reviews (see `rating_arrays`).
+    Averages are rounded to one decimal place; rating_histogram is [count of 1 star, ..., count of 5 stars].
+    """
+    if len(doctor_ids) == 0: return {}
+    # Dense 0..n-1 code per distinct doctor so bincount output is compact.
+    unique_ids, codes = np.unique(doctor_ids, return_inverse=True)
+    n = len(unique_ids)
+    # One bincount each for counts and rating sums.
+    counts = np.bincount(codes, minlength=n)
+    sums = np.bincount(codes, weights=ratings, minlength=n)
+    # Star bucket 0..4 (fractional ratings round to the nearest star) -> one bincount for the whole n x 5 histogram.
+    stars = np.clip(np.rint(ratings).astype(np.int64), 1, 5) - 1
+    histograms = np.bincount(codes * 5 + stars, minlength=n * 5).reshape(n, 5)
+    # Plain and smoothed means (counts are >= 1 for every doctor present).
+    averages = np.round(sums / counts, 1)
+    bayesian = np.round((prior_mean * prior_weight + sums) / (prior_weight + counts), 1)
+    # Back to plain Python types for templates and JSON.
+    return {int(doc_id): {'review_count': int(counts[i]), 'average_rating': float(averages[i]),
+                          'bayesian_rating': float(bayesian[i]), 'rating_histogram': histograms[i].tolist()}
+            for i, doc_id in enumerate(unique_ids)}
+
+# Fetches approved reviews and returns their stats.
+def fetch_rating_stats(supabase, doctor_ids=None):
+    """Loads approved review ratings (for `doctor_ids`, or all doctors if None) in one query and computes stats."""
+    query = supabase.table('reviews').select('doctor_id, rating').eq('is_approved', 1)
+    if doctor_ids is not None:
+        # Nothing to look up.
+        if not doctor_ids: return {}
+        query = query.in_('doctor_id', list(doctor_ids))
+    return compute_rating_stats(*rating_arrays(query.execute().data or []))
+
+# Turns doctor_rating_summary rows (migrations/012) into the same stats compute_rating_stats returns.
+def summary_stats(rows, prior_mean=RATING_PRIOR_MEAN, prior_weight=RATING_PRIOR_WEIGHT):
+    """Returns {doctor_id: stats} from summary rows (doctor_id, review_count, rating_sum, stars_1..stars_5)."""
+    rows = [row for row in rows if row.get('review_count')]
+    if not rows: return {}
+    counts = np.array([row['review_count'] for row in rows], dtype=np.int64)
+    sums = np.array([row.get('rating_sum') or 0 for row in rows], dtype=np.float64)
+    # Same rounding as compute_rating_stats, so both sources give identical numbers.
+    averages = np.round(sums / counts, 1)
+    bayesian = np.round((prior_mean * prior_weight + sums) / (prior_weight + counts), 1)
+    return {int(row['doctor_id']): {'review_count': int(counts[i]), 'average_rating': float(averages[i]),
+                                    'bayesian_rating': float(bayesian[i]),
+                                    'rating_histogram': [int(row.get(f'stars_{star}') or 0) for star in range(1, 6)]}
+            for i, row in enumerate(rows)}
+
+# Reads precomputed stats from doctor_rating_summary (kept up to date by triggers on reviews) instead of the reviews.
+def fetch_rating_summary(supabase, doctor_ids=None):
+    """Loads summary rows (for `doctor_ids`, or all doctors if None) in one query and returns their stats."""
+    query = supabase.table('doctor_rating_summary').select('doctor_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5')
+    if doctor_ids is not None:
+        # Nothing to look up.
+        if not doctor_ids: return {}
+        query = query.in_('doctor_id', list(doctor_ids))
+    return summary_stats(query.execute().data or [])
+
+# Copies stats onto doctor dicts (doctors without reviews get zeros).
+def apply_rating_stats(doctors, stats):
+    """Sets review_count, average_rating, bayesian_rating and rating_histogram on each doctor dict in place."""
+    for doc in doctors:
+        doc_stats = stats.get(doc.get('id'), EMPTY_RATING_STATS)
+        doc.update({key: (list(value) if isinstance(value, list) else value) for key, value in doc_stats.items()})
+    return doctors
+
+# --- END OF FILE rating_stats.py ---
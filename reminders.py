@@ -0,0 +1,164 @@
+# --- START OF FILE reminders.py ---
+# Appointment reminder scheduler used by app.py.
+# Each tick finds Pending bookings starting in the next N hours (via the partial index on
+# bookings.start_at from migrations/001), claims them by setting reminder_claimed_at (a lease,
+# migrations/014), and hands them in batches to a pluggable sender. Claiming is a conditional
+# UPDATE, so several app processes ticking at the same time never claim the same booking.
+# reminder_sent_at is only set once the sender succeeded; a claim whose process died before
+# sending expires after the lease and is picked up again by a later tick.
+
+# --- Standard Library Imports ---
+import json                     # Used by the file sink to write one JSON message per line.
+import os                       # Used to create the sink's directory.
+import threading                # Lock so concurrent workers don't interleave sink writes.
+import traceback                # Detailed error output when sending fails.
+from datetime import datetime, timedelta, timezone # Used for the look-ahead window and sent timestamps.
+
+# --- Local Module Imports ---
+from patients import or_filter, quote_filter_value # OR filter for the claim lease (the pinned postgrest has no or_()).
+
+# Maximum number of bookings claimed and sent per batch (one PostgREST round trip each).
+REMINDER_BATCH_SIZE = 200
+# Minutes after which an unsent claim is considered abandoned and may be claimed again.
+REMINDER_CLAIM_LEASE_MINUTES = 30
+
+
+# --- Senders ---
+# A sender is any object with `send(booking, message)` that raises on failure.
+
+# Sender that appends reminders to a local JSON Lines file instead of sending SMS/e-mail.
+class FileSinkSender:
+    """Stub sender: appends each reminder as a JSON line to `path` (used for local runs and testing)."""
+
+    # Constructor: remember the sink path and make sure its folder exists.
+    def __init__(self, path='database/reminders_outbox.jsonl'):
+        # Path of the outbox file.
+        self.path = path
+        # Lock so parallel job workers write whole lines.
+        self._lock = threading.Lock()
+        # Create the parent directory if needed.
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Writes a single reminder to the sink.
+    def send(self, booking, message):
+        # Build the outbox record.
+        record = {'booking_id': booking.get('id'), 'to': booking.get('patient_phone'),
+                  'channel': 'sms', 'message': message, 'queued_at': datetime.now().isoformat()}
+        # Append it as one line.
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+# Sender that only prints reminders to the console.
+class LogSender:
+    """Stub sender: prints each reminder to the console."""
+
+    # Print the reminder.
+    def send(self, booking, message):
+        print(f"REMINDER -> {booking.get('patient_phone')}: {message}")
+
+
+# --- Scheduler Logic ---
+
+# Builds the reminder text for one booking.
+def format_reminder(booking):
+    """Returns the reminder message for a booking row."""
+    return (f"Reminder: your appointment with Dr. {booking.get('doctor_name') or 'your doctor'} "
+            f"is on {booking.get('booking_date')} at {booking.get('booking_time')}.")
+
+# Claims the next batch of due bookings for reminding.
+def claim_due_reminders(supabase, hours_ahead=24, batch_size=REMINDER_BATCH_SIZE, now=None,
+                        lease_minutes=REMINDER_CLAIM_LEASE_MINUTES):
+    """Finds Pending, un-reminded bookings starting within `hours_ahead` hours and claims up to `batch_size`.
+
+    Returns the claimed booking rows. Only unclaimed rows (or rows whose claim is older than
+    `lease_minutes`) are claimed, and only rows this call actually updated are returned.
+    """
+    # Window boundaries (start_at is naive local time, like datetime.now() elsewhere in the app).
+    now = now or datetime.now()
+    window_end = now + timedelta(hours=hours_ahead)
+    # Claims older than this were abandoned (their process died before sending).
+    claimed_now = datetime.now(timezone.utc)
+    lease_cutoff = quote_filter_value((claimed_now - timedelta(minutes=lease_minutes)).isoformat())
+    unclaimed = f"reminder_claimed_at.is.null,reminder_claimed_at.lt.{lease_cutoff}"
+    # Indexed range scan: status/reminder_sent_at match the partial index, start_at is the index key.
+    due_res = or_filter(supabase.table('bookings').select('id'), unclaimed) \
+        .eq('status', 'Pending') \
+        .is_('reminder_sent_at', 'null') \
+        .gte('start_at', now.isoformat()) \
+        .lt('start_at', window_end.isoformat()) \
+        .order('start_at', desc=False) \
+        .limit(batch_size).execute()
+    # Collect candidate IDs.
+    due_ids = [row['id'] for row in (due_res.data or [])]
+    # Nothing due this tick.
+    if not due_ids: return []
+    # Claim them in one UPDATE; repeating the guards means concurrent tickers can't claim the same row twice.
+    claim_res = or_filter(supabase.table('bookings').update({'reminder_claimed_at': claimed_now.isoformat()}), unclaimed) \
+        .in_('id', due_ids) \
+        .is_('reminder_sent_at', 'null') \
+        .execute()
+    # Return the rows we own (UPDATE returns the full updated rows).
+    return claim_res.data or []
+
+# Releases claims for bookings whose reminder could not be sent, so the next tick retries them.
+def release_reminders(supabase, booking_ids):
+    """Clears reminder_claimed_at for `booking_ids`."""
+    if booking_ids:
+        supabase.table('bookings').update({'reminder_claimed_at': None}).in_('id', list(booking_ids)).execute()
+
+# Records that the reminders for `booking_ids` went out (drops them from the reminder index).
+def mark_reminders_sent(supabase, booking_ids):
+    """Sets reminder_sent_at for `booking_ids`."""
+    if booking_ids:
+        supabase.table('bookings').update({'reminder_sent_at': datetime.now(timezone.utc).isoformat()}) \
+            .in_('id', list(booking_ids)).execute()
+
+# Sends reminders for a batch of already-claimed bookings.
+def send_reminder_batch(supabase, sender, bookings):
+    """Sends one reminder per booking; sent ones are marked, failed ones released for retry. Returns (sent, failed) counts."""
+    # IDs whose send succeeded / raised.
+    sent_ids = []; failed_ids = []
+    # Send each reminder.
+    for booking in bookings:
+        try:
+            sender.send(booking, format_reminder(booking))
+            sent_ids.append(booking.get('id'))
+        except Exception as e:
+            print(f"ERROR (reminders): Send failed for booking {booking.get('id')}: {e}"); traceback.print_exc()
+            failed_ids.append(booking.get('id'))
+    # Record the successful sends. If this fails the claims simply expire and those reminders go out again,
+    # which is better than never sending them.
+    try:
+        mark_reminders_sent(supabase, sent_ids)
+    except Exception as e:
+        print(f"ERROR (reminders): Could not mark reminders sent {sent_ids}: {e}")
+    # Un-claim the failures so they are picked up again.
+    try:
+        release_reminders(supabase, failed_ids)
+    except Exception as e:
+        print(f"ERROR (reminders): Could not release failed reminders {failed_ids}: {e}")
+    # Report counts.
+    return len(bookings) - len(failed_ids), len(failed_ids)
+
+# One scheduler tick: claim due bookings batch by batch and hand each batch to `dispatch`.
+def run_reminder_tick(supabase, dispatch, hours_ahead=24, batch_size=REMINDER_BATCH_SIZE, max_batches=50):
+    """Claims due reminders in batches and calls `dispatch(bookings)` per batch. Returns the number claimed.
+
+    `dispatch` is typically a function that enqueues a background job, so sending never
+    blocks the tick. `max_batches` caps the work done per tick.
+    """
+    # Running total for the log line.
+    claimed_total = 0
+    # Keep claiming until the window is drained or the per-tick cap is hit.
+    for _ in range(max_batches):
+        batch = claim_due_reminders(supabase, hours_ahead=hours_ahead, batch_size=batch_size)
+        if not batch: break
+        claimed_total += len(batch)
+        dispatch(batch)
+        # A short batch means the window is empty.
+        if len(batch) < batch_size: break
+    # Log only when something happened.
+    if claimed_total: print(f"INFO (reminders): Claimed {claimed_total} booking(s) for reminders (next {hours_ahead}h).")
+    return claimed_total
+
+# --- END OF FILE reminders.py ---
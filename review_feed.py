@@ -0,0 +1,56 @@
+# --- START OF FILE review_feed.py ---
+# Paginated feed of a doctor's approved reviews, used by the booking page (first page, rendered server-side) and by
+# /api/doctors/<id>/reviews (the following pages, loaded as the patient scrolls).
+# Pages use keyset pagination on (created_at, id), newest first: the cursor is the position of the last review sent,
+# and the next page is "strictly older than that", so each page is one range read on the partial index from
+# migrations/013 however deep the patient scrolls, and reviews approved meanwhile never shift or repeat rows.
+
+# --- Standard Library Imports ---
+import base64                   # URL-safe cursor encoding.
+
+# --- Local Module Imports ---
+from patients import or_filter, order_by, quote_filter_value # PostgREST OR filter / sort key and value quoting.
+
+# Reviews per page, and the most a client may ask for.
+REVIEW_PAGE_SIZE = 10
+REVIEW_PAGE_MAX = 50
+
+
+# Encodes a (created_at, id) position as an opaque URL-safe cursor.
+def encode_cursor(created_at, review_id):
+    return base64.urlsafe_b64encode(f"{created_at}|{review_id}".encode()).decode().rstrip('=')
+
+
+# Decodes a cursor back to (created_at, id). Raises ValueError if it is malformed.
+def decode_cursor(cursor):
+    try:
+        created_at, _, review_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().rpartition('|')
+        if not created_at: raise ValueError('missing created_at')
+        return created_at, int(review_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid review cursor: {e}") from None
+
+
+# Shapes a review row for the JSON feed (only what booking.html shows).
+def compact(row):
+    return {'name': row.get('reviewer_name'), 'rating': row.get('rating'), 'comment': row.get('comment'),
+            'date': str(row.get('created_at') or '')[:10] or None}
+
+
+# One page of `doctor_id`'s approved reviews, newest first, starting after the cursor `after` (None = first page).
+# Returns (rows, next_cursor); next_cursor is None on the last page. Raises ValueError for a malformed cursor.
+def fetch_page(supabase, doctor_id, after=None, limit=REVIEW_PAGE_SIZE):
+    query = supabase.table('reviews').select('id, reviewer_name, rating, comment, created_at') \
+        .eq('doctor_id', doctor_id).eq('is_approved', 1)
+    if after:
+        created_at, review_id = decode_cursor(after)
+        # Strictly older than the cursor; the id breaks ties between reviews with the same timestamp.
+        created_at = quote_filter_value(created_at)
+        query = or_filter(query, f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{review_id})")
+    # One extra row tells whether another page exists.
+    rows = order_by(query, 'created_at.desc', 'id.desc').limit(limit + 1).execute().data or []
+    if len(rows) <= limit: return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+# --- END OF FILE review_feed.py ---
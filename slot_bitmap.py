@@ -0,0 +1,262 @@
+# --- START OF FILE slot_bitmap.py ---
+# Bitmap availability engine used by slot_index.py.
+# A day is divided into fixed SLOT_GRID_MINUTES cells; a slot is identified by the cell its start time falls in.
+# Each doctor's weekly schedule is 7 Python int bitmaps (one bit per slot start) and their bookings are one
+# bitmap per date, so "free slots on D" is `weekly[D.weekday()] & ~booked[D]`, "first free slot after T" is a
+# mask plus a lowest-set-bit, and filtering many doctors is a handful of integer operations per doctor.
+# Slot labels ("09:00 - 09:30") are kept per weekday so results come back in the same format as availability.
+# Date-specific exceptions (closures and extra slots, migrations/005) are resolved once per doctor into disjoint
+# date segments held in sorted arrays, so the effective schedule of any date is a bisect plus two bit operations.
+
+# --- Standard Library Imports ---
+from bisect import bisect_right # Segment lookup in the exception calendar.
+from datetime import date, datetime, timedelta # Date arithmetic for multi-day searches.
+from functools import lru_cache # Slot strings repeat constantly; parse each one once.
+
+# Width of one grid cell in minutes (5 -> 288 cells per day; any HH:MM start on a 5-minute boundary is exact).
+SLOT_GRID_MINUTES = 5
+# Cells per day and the all-ones mask for one day.
+DAY_BITS = 24 * 60 // SLOT_GRID_MINUTES
+FULL_DAY = (1 << DAY_BITS) - 1
+# Availability keys in date.weekday() order (Monday = 0).
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+# --- Bit Helpers ---
+
+# Maps a slot string ("HH:MM - HH:MM", or just "HH:MM") to the grid cell of its start time.
+@lru_cache(maxsize=4096)
+def slot_bit(slot):
+    """Returns the bit index of `slot`'s start time, or None for unparsable / 'unavailable' entries."""
+    if not isinstance(slot, str) or ':' not in slot or slot.strip().lower() == 'unavailable': return None
+    try: start = datetime.strptime(slot.split('-')[0].strip(), '%H:%M')
+    except ValueError: return None
+    return (start.hour * 60 + start.minute) // SLOT_GRID_MINUTES
+
+# First bit whose slot starts strictly after the given time of day.
+def bit_after(moment):
+    return (moment.hour * 3600 + moment.minute * 60 + moment.second) // (SLOT_GRID_MINUTES * 60) + 1
+
+# Mask of all bits >= `bit` within one day.
+def mask_from(bit):
+    return FULL_DAY & ~((1 << bit) - 1) if bit > 0 else FULL_DAY
+
+# Mask of bits in [start_bit, end_bit).
+def mask_between(start_bit, end_bit):
+    return mask_from(start_bit) & ((1 << end_bit) - 1)
+
+# Yields the indices of the set bits in ascending (time) order.
+def iter_bits(bitmap):
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+# Index of the lowest set bit (None for an empty bitmap).
+def lowest_bit(bitmap):
+    return (bitmap & -bitmap).bit_length() - 1 if bitmap else None
+
+
+# Bitmap and labels for a list of slot strings.
+def slots_bitmap(slots):
+    bitmap = 0; labels = {}
+    for slot in slots or []:
+        # Same filter as weekly availability: "HH:MM - HH:MM" strings only.
+        if not isinstance(slot, str) or '-' not in slot: continue
+        bit = slot_bit(slot)
+        if bit is None: continue
+        bitmap |= 1 << bit
+        labels.setdefault(bit, slot)
+    return bitmap, labels
+
+# Converts a 'YYYY-MM-DD' string (or date) to a date.
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+# --- Date Exceptions ---
+
+# Class resolving a doctor's date-range exceptions into disjoint segments.
+class ExceptionCalendar:
+    """Closures and extra slots over date ranges, merged into sorted, non-overlapping segments.
+
+    Each segment covers the dates [start, end] (inclusive ordinals) and carries a `closed` bitmap (slot
+    starts removed from the weekly schedule; FULL_DAY for a whole-day closure) and an `extra` bitmap (slots
+    added on top, with their labels). Looking up one date is a bisect (O(log n)); walking a date range visits
+    only the k segments it overlaps.
+    """
+
+    __slots__ = ('starts', 'ends', 'closed', 'extra', 'labels')
+
+    # Builds the segments from exception rows (start_date, end_date, kind 'closed'|'extra', slots).
+    def __init__(self, rows=()):
+        # Per row: (first ordinal, last ordinal, closed bitmap, extra bitmap, extra labels).
+        ranges = []
+        for row in rows:
+            try: first, last = _as_date(row['start_date']).toordinal(), _as_date(row['end_date']).toordinal()
+            except (KeyError, TypeError, ValueError): continue
+            if last < first: continue
+            bitmap, labels = slots_bitmap(row.get('slots'))
+            if row.get('kind') == 'extra':
+                if bitmap: ranges.append((first, last, 0, bitmap, labels))
+            # A closure without (valid) slots closes the whole day.
+            else:
+                ranges.append((first, last, bitmap or FULL_DAY, 0, {}))
+        # Sweep over every range boundary; between two boundaries the set of active ranges is constant.
+        boundaries = sorted({r[0] for r in ranges} | {r[1] + 1 for r in ranges})
+        self.starts, self.ends, self.closed, self.extra, self.labels = [], [], [], [], []
+        for seg_start, next_start in zip(boundaries, boundaries[1:]):
+            active = [r for r in ranges if r[0] <= seg_start <= r[1]]
+            if not active: continue
+            closed = 0; extra = 0; labels = {}
+            for r in active:
+                closed |= r[2]; extra |= r[3]
+                for bit, label in r[4].items(): labels.setdefault(bit, label)
+            # Extend the previous segment when it is adjacent and identical.
+            if self.ends and self.ends[-1] == seg_start - 1 and self.closed[-1] == closed and self.extra[-1] == extra:
+                self.ends[-1] = next_start - 1; self.labels[-1].update(labels); continue
+            self.starts.append(seg_start); self.ends.append(next_start - 1)
+            self.closed.append(closed); self.extra.append(extra); self.labels.append(labels)
+
+    # True if there are no exceptions at all.
+    def __bool__(self):
+        return bool(self.starts)
+
+    # Index of the segment containing a date, or None.
+    def segment_at(self, day):
+        ordinal = day.toordinal()
+        i = bisect_right(self.starts, ordinal) - 1
+        return i if i >= 0 and self.ends[i] >= ordinal else None
+
+    # Indices of the segments overlapping [first, last].
+    def segments_between(self, first, last):
+        i = max(bisect_right(self.starts, first.toordinal()) - 1, 0)
+        while i < len(self.starts) and self.starts[i] <= last.toordinal():
+            if self.ends[i] >= first.toordinal(): yield i
+            i += 1
+
+
+# --- Per-Doctor Schedule ---
+
+# Class holding one doctor's weekly schedule and booked bitmaps.
+class DoctorSchedule:
+    """Weekly availability + per-date booked slots for one doctor, stored as int bitmaps."""
+
+    __slots__ = ('weekly', 'labels', 'booked', 'exceptions')
+
+    # Constructor: empty schedule (no slots, nothing booked).
+    def __init__(self):
+        # weekday -> bitmap of slot starts.
+        self.weekly = [0] * 7
+        # weekday -> {bit: slot label} to turn bits back into the original strings.
+        self.labels = [{} for _ in range(7)]
+        # 'YYYY-MM-DD' -> bitmap of booked slot starts.
+        self.booked = {}
+        # Date-specific closures / extra slots.
+        self.exceptions = ExceptionCalendar()
+
+    # Builds a schedule from an availability dict (day name -> list of slot strings) and optional exception rows.
+    @classmethod
+    def from_availability(cls, availability, exceptions=()):
+        schedule = cls()
+        if isinstance(availability, dict):
+            for weekday, day_name in enumerate(DAY_NAMES):
+                slots = availability.get(day_name, [])
+                if isinstance(slots, list): schedule.weekly[weekday], schedule.labels[weekday] = slots_bitmap(slots)
+        schedule.exceptions = ExceptionCalendar(exceptions)
+        return schedule
+
+    # Effective scheduled slots on a date: weekly slots minus closures, plus extra slots.
+    def day_bitmap(self, day):
+        bitmap = self.weekly[day.weekday()]
+        if self.exceptions:
+            i = self.exceptions.segment_at(day)
+            if i is not None: bitmap = (bitmap & ~self.exceptions.closed[i]) | self.exceptions.extra[i]
+        return bitmap
+
+    # Label of a scheduled slot bit on a date (extra-slot labels take precedence).
+    def label(self, day, bit):
+        if self.exceptions:
+            i = self.exceptions.segment_at(day)
+            if i is not None and bit in self.exceptions.labels[i]: return self.exceptions.labels[i][bit]
+        return self.labels[day.weekday()][bit]
+
+    # True if `slot` (exact string) is part of the effective schedule on `day` (ignores bookings).
+    def is_scheduled(self, day, slot):
+        bit = slot_bit(slot)
+        return bit is not None and bool(self.day_bitmap(day) >> bit & 1) and self.label(day, bit) == slot
+
+    # Dates in [first, last] whose schedule differs from the weekly pattern because of exceptions.
+    def overrides_between(self, first, last):
+        """Returns {'closed': [dates with weekly slots but none left], 'extra': [dates with no weekly slots but extra ones]}."""
+        closed, extra = [], []
+        for i in self.exceptions.segments_between(first, last):
+            day = date.fromordinal(max(self.exceptions.starts[i], first.toordinal()))
+            end = date.fromordinal(min(self.exceptions.ends[i], last.toordinal()))
+            while day <= end:
+                weekly, effective = self.weekly[day.weekday()], self.day_bitmap(day)
+                if weekly and not effective: closed.append(day.isoformat())
+                elif effective and not weekly: extra.append(day.isoformat())
+                day += timedelta(days=1)
+        return {'closed': closed, 'extra': extra}
+
+    # Replaces all booked bitmaps from (booking_date, booking_time) pairs.
+    def set_booked(self, pairs):
+        self.booked = {}
+        for booking_date, booking_time in pairs: self.book(booking_date, booking_time)
+
+    # Replaces one date's booked bitmap from its booked time strings.
+    def set_booked_day(self, date_str, times):
+        bitmap = 0
+        for booking_time in times:
+            bit = slot_bit(booking_time)
+            if bit is not None: bitmap |= 1 << bit
+        if bitmap: self.booked[date_str] = bitmap
+        else: self.booked.pop(date_str, None)
+
+    # Marks one slot as booked.
+    def book(self, date_str, booking_time):
+        bit = slot_bit(booking_time)
+        if bit is not None: self.booked[date_str] = self.booked.get(date_str, 0) | (1 << bit)
+
+    # Marks one slot as free again.
+    def unbook(self, date_str, booking_time):
+        bit = slot_bit(booking_time)
+        if bit is None or date_str not in self.booked: return
+        self.booked[date_str] &= ~(1 << bit)
+        if not self.booked[date_str]: del self.booked[date_str]
+
+    # Bitmap of open slots on a date (only slots starting after `now` when the date is today).
+    def free_bitmap(self, day, now=None):
+        bitmap = self.day_bitmap(day) & ~self.booked.get(day.isoformat(), 0)
+        if now is not None:
+            if day < now.date(): return 0
+            if day == now.date(): bitmap &= mask_from(bit_after(now))
+        return bitmap
+
+    # Open slots on a date as labels, in time order (optionally only those inside a `window` mask).
+    def free_slots(self, day, now=None, window=FULL_DAY):
+        return [self.label(day, bit) for bit in iter_bits(self.free_bitmap(day, now) & window)]
+
+    # First open slot starting after `now` within `horizon_days` days (today included).
+    def first_free(self, now, horizon_days):
+        """Returns (start datetime, 'YYYY-MM-DD', slot label) or None."""
+        return next(self.iter_free(now, horizon_days), None)
+
+    # All open slots starting after `now` within `horizon_days` days, lazily and in time order.
+    def iter_free(self, now, horizon_days):
+        """Yields (start datetime, 'YYYY-MM-DD', slot label) tuples; stops at the end of the window."""
+        # Nothing scheduled on any weekday and no extra slots: nothing to yield.
+        if not any(self.weekly) and not any(self.exceptions.extra): return
+        day, last = now.date(), now.date() + timedelta(days=horizon_days - 1)
+        while day <= last:
+            # Inside a whole-day closure without extra slots: jump straight past it.
+            i = self.exceptions.segment_at(day) if self.exceptions else None
+            if i is not None and self.exceptions.closed[i] == FULL_DAY and not self.exceptions.extra[i]:
+                day = date.fromordinal(self.exceptions.ends[i] + 1); continue
+            midnight = datetime.combine(day, datetime.min.time())
+            for bit in iter_bits(self.free_bitmap(day, now)):
+                yield midnight + timedelta(minutes=bit * SLOT_GRID_MINUTES), day.isoformat(), self.label(day, bit)
+            day += timedelta(days=1)
+
+# --- END OF FILE slot_bitmap.py ---
@@ -0,0 +1,270 @@
+# --- START OF FILE slot_index.py ---
+# Next-available-slot index used by app.py.
+# Keeps every doctor's weekly schedule and booked slots for the next SLOT_INDEX_HORIZON_DAYS as bitmaps
+# (slot_bitmap.DoctorSchedule) plus their earliest open slot in memory, so "next available" lookups (home page
+# cards, sorting, "available today" filtering, /get-nearest-available), per-date free slots and "which doctors
+# are free on D" queries need no per-doctor or per-day queries.
+# Date-specific closures and extra slots (doctor_availability_exceptions, migrations/005) are merged into each
+# doctor's schedule. A full rebuild costs one doctors query plus paginated fetches of upcoming bookings and
+# exceptions; bookings, cancellations and completions update single doctors in place between rebuilds.
+
+# --- Standard Library Imports ---
+import heapq                    # k-way merge of per-doctor slot streams.
+import itertools                # Taking the first K merged slots.
+import json                     # Availability may arrive as a JSON string.
+import threading                # Lock protecting the index (routes and job workers share it).
+from datetime import datetime, timedelta # Slot start times and the lookahead window.
+
+# --- Local Module Imports ---
+from slot_bitmap import DAY_BITS, DoctorSchedule, mask_between, slot_bit # Bitmap schedules and time-window masks.
+
+# How far ahead the index looks for an open slot (same window as the old per-day scan).
+SLOT_INDEX_HORIZON_DAYS = 90
+# Bookings fetched per page during a rebuild (PostgREST caps responses at 1000 rows by default).
+SLOT_INDEX_PAGE_SIZE = 1000
+# Table holding date-specific closures / extra slots.
+EXCEPTIONS_TABLE = 'doctor_availability_exceptions'
+
+
+# --- Slot Search ---
+
+# Returns availability as a dict (it may be stored as JSON text).
+def availability_dict(raw):
+    if isinstance(raw, dict): return raw
+    if isinstance(raw, str):
+        try: parsed = json.loads(raw)
+        except ValueError: return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+# Restricts a query to one doctor ID or a list of them (None = all doctors).
+def _for_doctors(query, doctor_id):
+    if doctor_id is None: return query
+    return query.in_('doctor_id', list(doctor_id)) if isinstance(doctor_id, (list, tuple, set)) else query.eq('doctor_id', doctor_id)
+
+# Loads non-cancelled bookings dated [start day, start day + days] (one doctor ID, a list, or all), page by page on id.
+def fetch_booked(supabase, now, days, doctor_id=None):
+    """Returns {doctor_id: set of (booking_date, booking_time)}."""
+    start = now.strftime('%Y-%m-%d')
+    end = (now.date() + timedelta(days=days)).strftime('%Y-%m-%d')
+    booked = {}; last_id = 0
+    while True:
+        query = supabase.table('bookings').select('id, doctor_id, booking_date, booking_time') \
+            .gte('booking_date', start).lte('booking_date', end).neq('status', 'Cancelled')
+        rows = _for_doctors(query, doctor_id).gt('id', last_id).order('id', desc=False).limit(SLOT_INDEX_PAGE_SIZE).execute().data or []
+        for row in rows:
+            booked.setdefault(row.get('doctor_id'), set()).add((row.get('booking_date'), row.get('booking_time')))
+        if len(rows) < SLOT_INDEX_PAGE_SIZE: return booked
+        last_id = rows[-1]['id']
+
+# Loads exception rows that haven't ended before `since` (one doctor ID, a list, or all), grouped by doctor.
+def fetch_exceptions(supabase, since, doctor_id=None):
+    """Returns {doctor_id: [exception rows]} with end_date >= `since`; {} if the table doesn't exist yet."""
+    grouped = {}; last_id = 0
+    try:
+        while True:
+            query = _for_doctors(supabase.table(EXCEPTIONS_TABLE).select('id, doctor_id, start_date, end_date, kind, slots') \
+                .gte('end_date', since.strftime('%Y-%m-%d')), doctor_id)
+            rows = query.gt('id', last_id).order('id', desc=False).limit(SLOT_INDEX_PAGE_SIZE).execute().data or []
+            for row in rows: grouped.setdefault(row.get('doctor_id'), []).append(row)
+            if len(rows) < SLOT_INDEX_PAGE_SIZE: return grouped
+            last_id = rows[-1]['id']
+    # A missing table (migration 005 not run yet) just means no exceptions.
+    except Exception as e:
+        print(f"WARN (slot_index): Could not load availability exceptions: {e}")
+        return {}
+
+# Builds a doctor's effective schedule (weekly availability + exception rows) without bookings.
+def build_schedule(availability, exceptions=()):
+    return DoctorSchedule.from_availability(availability_dict(availability), exceptions)
+
+# Merges many doctors' open-slot streams and returns the K earliest slots overall.
+def earliest_slots(schedules, now=None, limit=10, horizon_days=SLOT_INDEX_HORIZON_DAYS):
+    """Returns up to `limit` (start datetime, doctor_id, 'YYYY-MM-DD', slot) tuples in time order.
+
+    `schedules` maps doctor_id -> DoctorSchedule (bookings already applied). Each doctor's slots are a lazy,
+    time-ordered stream; heapq.merge keeps one pending slot per doctor, so only about `limit` + n slots are
+    ever generated. Ties at the same start time are ordered by doctor_id.
+    """
+    now = now or datetime.now()
+    streams = [_tagged_slots(doctor_id, schedule, now, horizon_days) for doctor_id, schedule in schedules.items()]
+    return list(itertools.islice(heapq.merge(*streams), limit))
+
+# One doctor's open-slot stream with the doctor ID as the tie-breaker (a function, so each stream binds its own ID).
+def _tagged_slots(doctor_id, schedule, now, horizon_days):
+    for start, day_str, slot in schedule.iter_free(now, horizon_days): yield start, doctor_id, day_str, slot
+
+# Finds the first slot in a weekly schedule that starts after `now` and isn't booked.
+def earliest_open_slot(availability, booked, now=None, horizon_days=SLOT_INDEX_HORIZON_DAYS):
+    """Returns (start datetime, 'YYYY-MM-DD', slot string) for the doctor's next unbooked slot, or None.
+
+    `availability` maps day names ('Monday', ...) to "HH:MM - HH:MM" slot strings; `booked` is a set of
+    (booking_date 'YYYY-MM-DD', booking_time) pairs. Times are local clinic time, like datetime.now().
+    """
+    schedule = build_schedule(availability)
+    schedule.set_booked(booked)
+    return schedule.first_free(now or datetime.now(), horizon_days)
+
+
+# --- Index ---
+
+# Class holding the in-memory index.
+class SlotIndex:
+    """Thread-safe map of doctor_id -> earliest open slot, maintained from bulk loads and booking events."""
+
+    # Constructor: empty index; filled by rebuild() (or ensure_built() on first use).
+    def __init__(self, horizon_days=SLOT_INDEX_HORIZON_DAYS):
+        # Lookahead window in days.
+        self.horizon_days = horizon_days
+        # doctor_id -> {'schedule': DoctorSchedule, 'specialization': str, 'next': tuple or None, 'valid_until': datetime}.
+        self._doctors = {}
+        # Lock protecting _doctors.
+        self._lock = threading.Lock()
+        # Serializes rebuilds so concurrent first requests don't all hit the database.
+        self._build_lock = threading.Lock()
+        # Time of the last full rebuild (None = never built).
+        self.built_at = None
+
+    # Recomputes one doctor's cached slot. Caller holds the lock.
+    def _recompute(self, entry, now):
+        found = entry['schedule'].first_free(now, self.horizon_days)
+        entry['next'] = found
+        # The answer stays valid until that slot starts (or, if nothing is open, until the window moves at midnight).
+        entry['valid_until'] = found[0] if found else datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+
+    # Builds an entry from a doctor row, its booked pairs and exception rows. Caller holds the lock.
+    def _store(self, doc, booked, exceptions, now):
+        schedule = build_schedule(doc.get('availability'), exceptions)
+        schedule.set_booked(booked)
+        entry = {'schedule': schedule, 'specialization': doc.get('specialization')}
+        self._recompute(entry, now)
+        self._doctors[doc['id']] = entry
+
+    # Loads everything and swaps in the new index. Caller holds the build lock.
+    def _load(self, supabase, now):
+        doctors = supabase.table('doctors').select('id, availability, specialization').execute().data or []
+        booked = fetch_booked(supabase, now, self.horizon_days)
+        exceptions = fetch_exceptions(supabase, now)
+        with self._lock:
+            self._doctors = {}
+            for doc in doctors: self._store(doc, booked.get(doc['id'], set()), exceptions.get(doc['id'], []), now)
+            self.built_at = now
+        print(f"INFO (slot_index): Indexed next available slots for {len(doctors)} doctor(s).")
+        return len(doctors)
+
+    # Rebuilds the whole index from the database.
+    def rebuild(self, supabase, now=None):
+        """Reloads all doctors and their upcoming bookings (one doctors query + paginated bookings). Returns the doctor count."""
+        with self._build_lock: return self._load(supabase, now or datetime.now())
+
+    # Builds the index once if it hasn't been built yet.
+    def ensure_built(self, supabase):
+        """Runs a rebuild unless the index has already been built (safe to call from every request)."""
+        if self.built_at is not None: return
+        with self._build_lock:
+            # Another request may have finished the build while this one waited.
+            if self.built_at is None: self._load(supabase, datetime.now())
+
+    # Reloads a single doctor (schedule and bookings) from the database.
+    def refresh_doctor(self, supabase, doctor_id, now=None):
+        """Re-reads one doctor's availability, exceptions and upcoming bookings (three queries) and updates their entry."""
+        now = now or datetime.now()
+        res = supabase.table('doctors').select('id, availability, specialization').eq('id', doctor_id).maybe_single().execute()
+        booked = fetch_booked(supabase, now, self.horizon_days, doctor_id).get(doctor_id, set())
+        exceptions = fetch_exceptions(supabase, now, doctor_id).get(doctor_id, [])
+        with self._lock:
+            # A doctor that no longer exists drops out of the index.
+            if not (res and res.data): self._doctors.pop(doctor_id, None); return
+            self._store(res.data, booked, exceptions, now)
+
+    # True if the doctor has an entry (indexed with or without an open slot).
+    def __contains__(self, doctor_id):
+        with self._lock: return doctor_id in self._doctors
+
+    # Records a new booking without touching the database.
+    def mark_booked(self, doctor_id, booking_date, booking_time, now=None):
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            if entry is None: return
+            entry['schedule'].book(booking_date, booking_time)
+            self._recompute(entry, now or datetime.now())
+
+    # Records a freed slot (cancellation) without touching the database.
+    def mark_freed(self, doctor_id, booking_date, booking_time, now=None):
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            if entry is None: return
+            entry['schedule'].unbook(booking_date, booking_time)
+            self._recompute(entry, now or datetime.now())
+
+    # Replaces one date's bookings for a doctor with authoritative data (e.g. just read from the database).
+    def sync_booked_day(self, doctor_id, date_str, booked_times, now=None):
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            if entry is None: return
+            entry['schedule'].set_booked_day(date_str, booked_times)
+            self._recompute(entry, now or datetime.now())
+
+    # Returns one doctor's earliest open slot.
+    def next_slot(self, doctor_id, now=None):
+        """Returns ('YYYY-MM-DD', slot string) for the doctor's next open slot, or None (none soon / not indexed)."""
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            if entry is None: return None
+            # Time has passed the cached slot: recompute from the in-memory schedule (no queries).
+            if now >= entry['valid_until']: self._recompute(entry, now)
+            return entry['next'][1:] if entry['next'] else None
+
+    # Returns one doctor's open slots on a date.
+    def free_slots(self, doctor_id, day, now=None):
+        """Returns the doctor's unbooked slot strings on `day` in time order (past slots excluded today), or None if not indexed."""
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            return entry['schedule'].free_slots(day, now or datetime.now()) if entry else None
+
+    # True if `slot` is part of the doctor's effective schedule on `day` (bookings ignored).
+    def is_scheduled(self, doctor_id, day, slot):
+        """Returns True/False from the indexed schedule, or None if the doctor is not indexed."""
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            return entry['schedule'].is_scheduled(day, slot) if entry else None
+
+    # Returns the dates whose schedule differs from the weekly pattern (for the booking page calendar).
+    def date_overrides(self, doctor_id, first, last):
+        """Returns {'closed': [...], 'extra': [...]} 'YYYY-MM-DD' lists for [first, last] (empty if not indexed)."""
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            return entry['schedule'].overrides_between(first, last) if entry else {'closed': [], 'extra': []}
+
+    # Bulk query: which doctors have an open slot on a date.
+    def doctors_free_on(self, day, specialization=None, doctor_ids=None, start_time=None, end_time=None, now=None):
+        """Returns {doctor_id: [open slot strings]} for doctors with at least one open slot on `day`.
+
+        Optional filters: `specialization` (exact match), `doctor_ids` (iterable) and a start-time window
+        `start_time` <= slot start < `end_time` ("HH:MM" strings).
+        """
+        now = now or datetime.now()
+        # The time window is one mask applied to every doctor's free bitmap.
+        window = mask_between(slot_bit(start_time) if start_time else 0, slot_bit(end_time) if end_time else DAY_BITS)
+        wanted = set(doctor_ids) if doctor_ids is not None else None
+        results = {}
+        with self._lock:
+            for doctor_id, entry in self._doctors.items():
+                if wanted is not None and doctor_id not in wanted: continue
+                if specialization and entry['specialization'] != specialization: continue
+                # One AND per doctor decides; labels are only built for the doctors that match.
+                if not (entry['schedule'].free_bitmap(day, now) & window): continue
+                results[doctor_id] = entry['schedule'].free_slots(day, now, window)
+        return results
+
+    # Copies next-slot fields onto doctor dicts.
+    def apply(self, doctors, now=None):
+        """Sets next_available_date and next_available_time on each doctor dict (None when nothing is open soon)."""
+        now = now or datetime.now()
+        for doc in doctors:
+            found = self.next_slot(doc.get('id'), now)
+            doc['next_available_date'], doc['next_available_time'] = found if found else (None, None)
+        return doctors
+
+# --- END OF FILE slot_index.py ---
@@ -0,0 +1,64 @@
+# --- START OF FILE sweeper.py ---
+# Booking lifecycle sweeper used by app.py.
+# Pending bookings whose appointment is long past are moved to a final status in small batches:
+# 'Expired' (default policy) or 'Completed'. Each batch is one SELECT of IDs on the indexed
+# start_at column (migrations/002) plus one UPDATE ... WHERE id IN (...), so no statement
+# touches more than `chunk_size` rows or holds locks for long.
+
+# --- Standard Library Imports ---
+import time                     # Optional pause between chunks.
+from datetime import datetime, timedelta # Used to compute the staleness cutoff.
+
+# Status written by each sweep policy.
+SWEEP_POLICIES = {'expire': 'Expired', 'complete': 'Completed'}
+# Default number of bookings updated per UPDATE statement.
+SWEEP_CHUNK_SIZE = 500
+
+
+# Sweeps stale Pending bookings in chunks and reports what it did.
+def sweep_stale_bookings(supabase, policy='expire', grace_hours=24, chunk_size=SWEEP_CHUNK_SIZE,
+                         max_chunks=100, pause_seconds=0.0, now=None):
+    """Moves Pending bookings that started more than `grace_hours` ago to the policy's status.
+
+    Returns a dict with the policy, new status, cutoff, number of chunks run and rows updated.
+    Raises ValueError for an unknown policy.
+    """
+    # Resolve the target status for the policy.
+    if policy not in SWEEP_POLICIES:
+        raise ValueError(f"Unknown sweep policy '{policy}'. Use one of: {', '.join(SWEEP_POLICIES)}.")
+    new_status = SWEEP_POLICIES[policy]
+    # Bookings starting before this moment are considered stale.
+    cutoff = (now or datetime.now()) - timedelta(hours=grace_hours)
+    # Counters for the report.
+    chunks = 0; updated = 0
+    # Process chunk by chunk until nothing is left or the per-run cap is reached.
+    while chunks < max_chunks:
+        # Oldest stale Pending bookings first (range scan on the partial index).
+        stale_res = supabase.table('bookings').select('id') \
+            .eq('status', 'Pending') \
+            .lt('start_at', cutoff.isoformat()) \
+            .order('start_at', desc=False) \
+            .limit(chunk_size).execute()
+        # IDs in this chunk.
+        stale_ids = [row['id'] for row in (stale_res.data or [])]
+        if not stale_ids: break
+        # Update only rows that are still Pending (a doctor may have completed/cancelled one meanwhile).
+        update_res = supabase.table('bookings').update({'status': new_status}) \
+            .in_('id', stale_ids) \
+            .eq('status', 'Pending') \
+            .execute()
+        # Count the rows this chunk actually changed.
+        chunks += 1
+        updated += len(update_res.data or [])
+        # A short chunk means we've reached the end.
+        if len(stale_ids) < chunk_size: break
+        # Optionally yield to other writers between chunks.
+        if pause_seconds: time.sleep(pause_seconds)
+    # Build the report.
+    report = {'policy': policy, 'status': new_status, 'cutoff': cutoff.isoformat(timespec='minutes'),
+              'chunks': chunks, 'updated': updated}
+    # Log the outcome.
+    print(f"INFO (sweeper): {updated} stale Pending booking(s) -> {new_status} in {chunks} chunk(s) (cutoff {report['cutoff']}).")
+    return report
+
+# --- END OF FILE sweeper.py ---
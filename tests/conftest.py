@@ -0,0 +1,38 @@
+# Shared pytest fixtures. Run the suite from the repository root with `python -m pytest tests`.
+# The modules under test live at the top level of the repository (no package), so the root goes on sys.path.
+
+# --- Standard Library Imports ---
+import os
+import sys
+
+# --- Third-Party Imports ---
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A syntactically valid (unsigned) service key: the client never talks to the server in these tests.
+TEST_SUPABASE_URL = 'https://example.supabase.co'
+TEST_SUPABASE_KEY = 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.x'
+
+
+# Real client from the pinned supabase/postgrest versions, with execute() replaced by a recorder.
+# Each executed query is appended to `client.executed` as (path, [(param, value), ...]), its JSON body (RPC arguments,
+# update values) to `client.bodies`, and returns `client.rows`.
+@pytest.fixture
+def supabase_client(monkeypatch):
+    from supabase import create_client
+    from postgrest._sync import request_builder
+
+    client = create_client(TEST_SUPABASE_URL, TEST_SUPABASE_KEY)
+    client.executed = []; client.bodies = []; client.rows = []
+
+    # Stand-in for the HTTP round trip.
+    def execute(builder):
+        client.executed.append((builder.path, builder.params.multi_items())); client.bodies.append(builder.json)
+        return request_builder.APIResponse(data=list(client.rows), count=None)
+
+    for cls in (request_builder.SyncQueryRequestBuilder, request_builder.SyncSelectRequestBuilder,
+                request_builder.SyncFilterRequestBuilder, request_builder.SyncSingleRequestBuilder,
+                request_builder.SyncMaybeSingleRequestBuilder):
+        monkeypatch.setattr(cls, 'execute', execute)
+    return client
@@ -0,0 +1,74 @@
+# Tests for holds.MemoryHoldStore: one slot per token, expiry, release and the per-owner caps.
+
+# --- Third-Party Imports ---
+import pytest
+
+# --- Local Module Imports ---
+import holds
+
+
+# Store driven by a manual monotonic clock (`store.clock[0]` is "now").
+@pytest.fixture
+def store(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(holds.time, 'monotonic', lambda: clock[0])
+    store = holds.MemoryHoldStore(); store.clock = clock
+    return store
+
+
+def test_slot_held_by_one_token_at_a_time(store):
+    assert store.acquire(1, '2026-03-01', '09:00 - 09:30', 'a')
+    assert not store.acquire(1, '2026-03-01', '09:00 - 09:30', 'b')
+    assert store.held_by_other(1, '2026-03-01', '09:00 - 09:30', 'b')
+    assert not store.held_by_other(1, '2026-03-01', '09:00 - 09:30', 'a')
+    # The holder can extend its own hold.
+    assert store.acquire(1, '2026-03-01', '09:00 - 09:30', 'a')
+
+
+def test_new_hold_replaces_the_tokens_previous_one(store):
+    store.acquire(1, '2026-03-01', '09:00 - 09:30', 'a')
+    store.acquire(1, '2026-03-01', '09:30 - 10:00', 'a')
+    assert store.held_times(1, '2026-03-01') == {'09:30 - 10:00'}
+    assert store.held_times(1, '2026-03-01', token='a') == set()
+
+
+def test_expired_hold_can_be_taken(store):
+    store.acquire(1, '2026-03-01', '09:00 - 09:30', 'a', ttl=60)
+    store.clock[0] += 59
+    assert not store.acquire(1, '2026-03-01', '09:00 - 09:30', 'b')
+    store.clock[0] += 1
+    assert store.acquire(1, '2026-03-01', '09:00 - 09:30', 'b')
+    assert store.held_times(1, '2026-03-01', token='a') == {'09:00 - 09:30'}
+
+
+def test_release_frees_the_slot(store):
+    store.acquire(1, '2026-03-01', '09:00 - 09:30', 'a')
+    store.release('a')
+    assert store.acquire(1, '2026-03-01', '09:00 - 09:30', 'b')
+    # Releasing a token that no longer holds the slot leaves the new holder alone.
+    store.release('a')
+    assert store.held_by_other(1, '2026-03-01', '09:00 - 09:30', 'a')
+
+
+# A client dropping its session cookie gets new tokens, but its device still runs into the cap.
+def test_owner_cap_counts_live_holds_under_other_tokens(store):
+    owners = {'ip': '10.0.0.1', 'device': 'dev-1'}; caps = {'ip': 8, 'device': 2}
+    assert store.acquire(1, '2026-03-01', '09:00 - 09:30', 't1', owners=owners, max_holds=caps)
+    assert store.acquire(1, '2026-03-01', '09:30 - 10:00', 't2', owners=owners, max_holds=caps)
+    with pytest.raises(holds.HoldLimitError):
+        store.acquire(1, '2026-03-01', '10:00 - 10:30', 't3', owners=owners, max_holds=caps)
+    # Moving one of its own holds is not a new hold.
+    assert store.acquire(1, '2026-03-01', '10:00 - 10:30', 't2', owners=owners, max_holds=caps)
+    # Another device behind the same IP is still under the IP cap.
+    assert store.acquire(1, '2026-03-01', '10:30 - 11:00', 't4', owners={'ip': '10.0.0.1', 'device': 'dev-2'}, max_holds=caps)
+
+
+def test_owner_cap_ignores_expired_holds_and_missing_owners(store):
+    caps = {'ip': 1, 'device': None}
+    store.acquire(1, '2026-03-01', '09:00 - 09:30', 't1', ttl=60, owners={'ip': '10.0.0.1'}, max_holds=caps)
+    with pytest.raises(holds.HoldLimitError):
+        store.acquire(1, '2026-03-01', '09:30 - 10:00', 't2', owners={'ip': '10.0.0.1'}, max_holds=caps)
+    store.clock[0] += 60
+    assert store.acquire(1, '2026-03-01', '09:30 - 10:00', 't2', owners={'ip': '10.0.0.1'}, max_holds=caps)
+    # No IP recorded: nothing to cap.
+    assert store.acquire(1, '2026-03-01', '10:00 - 10:30', 't3', owners={'ip': None}, max_holds=caps)
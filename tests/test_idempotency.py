@@ -0,0 +1,77 @@
+# Tests for idempotency.MemoryIdempotencyStore: claim, replay, release, expiry and waiting on a running request.
+
+# --- Standard Library Imports ---
+import threading
+
+# --- Third-Party Imports ---
+import pytest
+
+# --- Local Module Imports ---
+import idempotency
+
+
+# Store driven by a manual monotonic clock (`store.clock[0]` is "now").
+@pytest.fixture
+def store(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(idempotency.time, 'monotonic', lambda: clock[0])
+    store = idempotency.MemoryIdempotencyStore(); store.clock = clock
+    return store
+
+
+def test_valid_key():
+    assert idempotency.valid_key('a' * 32)
+    assert idempotency.valid_key('abc-DEF_123')
+    assert not idempotency.valid_key('')
+    assert not idempotency.valid_key('a' * (idempotency.MAX_KEY_LENGTH + 1))
+    assert not idempotency.valid_key('key with spaces')
+
+
+def test_duplicate_gets_the_first_result(store):
+    assert store.claim('k') == (True, None)
+    assert store.claim('k') == (False, None)
+    store.complete('k', '/confirmation?booking_id=1')
+    assert store.claim('k') == (False, '/confirmation?booking_id=1')
+
+
+def test_release_lets_a_resubmit_run(store):
+    store.claim('k')
+    store.release('k')
+    assert store.claim('k') == (True, None)
+
+
+def test_release_after_complete_keeps_the_result(store):
+    store.claim('k'); store.complete('k', '/done')
+    store.release('k')
+    assert store.claim('k') == (False, '/done')
+
+
+# A claim whose request died is claimable again after PENDING_TTL_SECONDS; results last for their ttl.
+def test_pending_and_completed_keys_expire(store):
+    store.claim('k')
+    store.clock[0] += idempotency.PENDING_TTL_SECONDS
+    assert store.claim('k') == (True, None)
+    store.complete('k', '/done', ttl=120)
+    store.clock[0] += 119
+    assert store.claim('k') == (False, '/done')
+    store.clock[0] += 1
+    assert store.claim('k') == (True, None)
+
+
+def test_wait_returns_the_result_once_completed():
+    store = idempotency.MemoryIdempotencyStore()
+    store.claim('k')
+    timer = threading.Timer(0.05, store.complete, args=('k', '/done'))
+    timer.start()
+    try:
+        assert store.wait('k', timeout=5) == '/done'
+    finally:
+        timer.cancel()
+    assert store.wait('unknown', timeout=0) is None
+
+
+def test_wait_returns_none_when_the_first_request_gives_up():
+    store = idempotency.MemoryIdempotencyStore()
+    store.claim('k')
+    threading.Timer(0.05, store.release, args=('k',)).start()
+    assert store.wait('k', timeout=5) is None
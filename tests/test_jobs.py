@@ -0,0 +1,74 @@
+# Tests for jobs.JobQueue's SQLite spool: claiming, lease-aware replay, old spool upgrades and the worker round trip.
+
+# --- Standard Library Imports ---
+import sqlite3
+import time
+
+# --- Local Module Imports ---
+import jobs
+
+
+# Inserts a spool row directly and returns its id.
+def spool_row(job_queue, status='queued', lease_expires_at=None, name='noop'):
+    with job_queue._spool_conn() as conn:
+        return conn.execute("INSERT INTO jobs (name, payload, enqueued_at, status, lease_expires_at) VALUES (?, '{}', ?, ?, ?)",
+                            (name, time.time(), status, lease_expires_at)).lastrowid
+
+
+# Status of every spool row, by id.
+def statuses(job_queue):
+    with job_queue._spool_conn() as conn:
+        return dict(conn.execute("SELECT id, status FROM jobs").fetchall())
+
+
+def test_claim_takes_a_queued_job_once(tmp_path):
+    job_queue = jobs.JobQueue(spool_path=str(tmp_path / 'spool.db'), lease_seconds=60)
+    job_id = spool_row(job_queue)
+    assert job_queue._claim(job_id) is True
+    assert job_queue._claim(job_id) is False
+    with job_queue._spool_conn() as conn:
+        owner, lease = conn.execute("SELECT claimed_by, lease_expires_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert owner == job_queue._owner and lease > time.time()
+
+
+# Replay re-queues queued jobs and running jobs whose lease expired (or never had one), not live leases.
+def test_replay_skips_jobs_with_a_live_lease(tmp_path):
+    job_queue = jobs.JobQueue(spool_path=str(tmp_path / 'spool.db'))
+    queued = spool_row(job_queue)
+    expired = spool_row(job_queue, 'running', time.time() - 1)
+    unleased = spool_row(job_queue, 'running', None)
+    live = spool_row(job_queue, 'running', time.time() + 600)
+    assert job_queue._replay_spool() == 3
+    replayed = [job_queue._queue.get_nowait()[0] for _ in range(3)]
+    assert sorted(replayed) == sorted([queued, expired, unleased])
+    assert statuses(job_queue) == {queued: 'queued', expired: 'queued', unleased: 'queued', live: 'running'}
+
+
+# Spools written before leases existed get the new columns on startup.
+def test_old_spool_is_upgraded(tmp_path):
+    path = str(tmp_path / 'spool.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                 "enqueued_at REAL NOT NULL, status TEXT NOT NULL DEFAULT 'queued')")
+    conn.execute("INSERT INTO jobs (name, payload, enqueued_at, status) VALUES ('noop', '{}', 0, 'running')")
+    conn.commit(); conn.close()
+    job_queue = jobs.JobQueue(spool_path=path)
+    assert job_queue._replay_spool() == 1
+
+
+def test_enqueued_job_runs_and_leaves_the_spool(tmp_path):
+    job_queue = jobs.JobQueue(num_workers=1, spool_path=str(tmp_path / 'spool.db'))
+    seen = []
+    job_queue.register('record', lambda value: seen.append(value))
+    assert job_queue.enqueue('record', value=7)
+    job_queue.join()
+    assert seen == [7]
+    assert statuses(job_queue) == {}
+    assert job_queue.metrics()['processed'] == 1
+
+
+def test_unknown_job_is_dropped(tmp_path):
+    job_queue = jobs.JobQueue(spool_path=str(tmp_path / 'spool.db'))
+    assert job_queue.enqueue('missing') is False
+    assert job_queue.metrics()['dropped'] == 1
+    assert statuses(job_queue) == {}
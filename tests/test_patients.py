@@ -0,0 +1,106 @@
+# Tests for patients.py: name/phone normalization and the PostgREST filters built on the pinned client.
+
+# --- Local Module Imports ---
+import patients
+
+
+# Every spelling of the same Yemeni mobile number normalizes to the 9-digit national number.
+def test_normalize_phone_strips_prefixes_and_punctuation():
+    for raw in ('777123456', '0777123456', '+967 777-123-456', '00967777123456', '967777123456'):
+        assert patients.normalize_phone(raw) == '777123456'
+
+
+def test_normalize_phone_without_digits_is_none():
+    assert patients.normalize_phone('') is None
+    assert patients.normalize_phone(None) is None
+    assert patients.normalize_phone('n/a') is None
+
+
+# Diacritics and tatweel are dropped, letter variants folded, spaces collapsed, case lowered.
+def test_normalize_name_folds_arabic_variants():
+    assert patients.normalize_name('  أحمدُ   علـي ') == 'احمد علي'
+    assert patients.normalize_name('إيمان') == patients.normalize_name('ايمان')
+    assert patients.normalize_name('فاطمة') == 'فاطمه'
+    assert patients.normalize_name('مصطفى') == 'مصطفي'
+    assert patients.normalize_name('Fatimah  ALI') == 'fatimah ali'
+
+
+def test_normalize_name_empty_is_none():
+    assert patients.normalize_name('   ') is None
+    assert patients.normalize_name(None) is None
+
+
+def test_quote_filter_value_escapes_quotes_and_backslashes():
+    assert patients.quote_filter_value('a,b.c') == '"a,b.c"'
+    assert patients.quote_filter_value('say "hi"\\') == '"say \\"hi\\"\\\\"'
+
+
+# match() without the patient index: one or=(...) parameter on the raw columns (the pinned postgrest has no or_()).
+def test_match_builds_or_filter_on_pinned_client(supabase_client):
+    identity = patients.PatientIdentity('Sam, Jr.', '777123456')
+    query = patients.match(supabase_client.table('bookings').select('id'), identity, name_like=True)
+    query.neq('status', 'Cancelled').execute()
+    path, params = supabase_client.executed[0]
+    assert ('or', '(patient_phone.eq."777123456",patient_name.ilike."*Sam, Jr.*")') in params
+    assert ('status', 'neq.Cancelled') in params
+
+
+# With the patient index the identity becomes one patient_id IN filter.
+def test_match_with_patient_ids_uses_in_filter(supabase_client):
+    identity = patients.PatientIdentity('Sam', '777123456', patient_ids=[4, 9])
+    patients.match(supabase_client.table('reviews').select('id'), identity, 'reviewer_name', 'reviewer_phone').execute()
+    assert supabase_client.executed[0][1] == [('select', 'id'), ('patient_id', 'in.(4,9)')]
+
+
+def test_lookup_patient_ids_queries_normalized_columns(supabase_client):
+    supabase_client.rows = [{'id': 3}, {'id': 8}]
+    assert patients.lookup_patient_ids(supabase_client, 'أحمد', '0777123456') == [3, 8]
+    path, params = supabase_client.executed[0]
+    assert path.endswith('/patients')
+    assert ('or', '(phone_norm.eq."777123456",name_norm.eq."احمد")') in params
+
+
+def test_lookup_patient_ids_without_identity_skips_query(supabase_client):
+    assert patients.lookup_patient_ids(supabase_client, '', '') == []
+    assert supabase_client.executed == []
+
+
+# --- Dashboard keyset cursor (booking_date, booking_time, id) ---
+
+def test_booking_cursor_round_trip():
+    booking = {'booking_date': '2026-03-01', 'booking_time': '09:00 - 09:30', 'id': 42}
+    cursor = patients.encode_booking_cursor(booking)
+    assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+    assert patients.decode_booking_cursor(cursor) == ('2026-03-01', '09:00 - 09:30', 42)
+
+
+def test_booking_cursor_rejects_malformed_input():
+    import base64
+    for cursor in ('%%%', base64.urlsafe_b64encode(b'2026-03-01|09:00|x').decode(),
+                   base64.urlsafe_b64encode(b'|09:00|1').decode(), base64.urlsafe_b64encode(b'\xff\xfe').decode()):
+        try:
+            patients.decode_booking_cursor(cursor)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {cursor!r}")
+
+
+# The next page is strictly older than the cursor on the full sort key, sent as one order= parameter.
+def test_older_than_and_order_by_on_pinned_client(supabase_client):
+    query = patients.older_than(supabase_client.table('bookings').select('id'), ('2026-03-01', '09:00 - 09:30', 42))
+    patients.order_by(query, 'booking_date.desc', 'booking_time.desc', 'id.desc').limit(21).execute()
+    params = supabase_client.executed[0][1]
+    assert ('or', '(booking_date.lt."2026-03-01",'
+                  'and(booking_date.eq."2026-03-01",booking_time.lt."09:00 - 09:30"),'
+                  'and(booking_date.eq."2026-03-01",booking_time.eq."09:00 - 09:30",id.lt.42))') in params
+    assert [value for name, value in params if name == 'order'] == ['booking_date.desc,booking_time.desc,id.desc']
+
+
+def test_fetch_bookings_page_passes_cursor_to_rpc(supabase_client):
+    identity = patients.PatientIdentity('Sam', '777123456')
+    patients.fetch_bookings_page(supabase_client, identity, limit=5, after=('2026-03-01', '09:00 - 09:30', 42))
+    patients.fetch_bookings_page(supabase_client, identity)
+    assert supabase_client.executed[0][0].endswith('/rpc/patient_bookings')
+    first, newest = supabase_client.bodies
+    assert (first['p_after_date'], first['p_after_time'], first['p_after_id'], first['p_limit']) == ('2026-03-01', '09:00 - 09:30', 42, 5)
+    assert (newest['p_after_date'], newest['p_after_time'], newest['p_after_id']) == (None, None, None)
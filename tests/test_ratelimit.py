@@ -0,0 +1,62 @@
+# Tests for ratelimit.MemoryRateLimiter: per-identity token buckets, refills and all-or-nothing takes.
+
+# --- Third-Party Imports ---
+import pytest
+
+# --- Local Module Imports ---
+import ratelimit
+
+
+# Limiter with 2 requests / 60 s (IP buckets 4x larger), driven by a manual monotonic clock.
+@pytest.fixture
+def limiter(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: clock[0])
+    limiter = ratelimit.MemoryRateLimiter({'book': ratelimit.Limit(2, 60)}); limiter.clock = clock
+    return limiter
+
+
+def test_capacity_for_ip_is_larger():
+    limit = ratelimit.Limit(5, 60)
+    assert limit.capacity_for('ip') == 20
+    assert limit.capacity_for('device') == 5
+
+
+def test_bucket_empties_after_capacity(limiter):
+    identities = {'device': 'd1'}
+    assert limiter.take('book', identities) == (True, [])
+    assert limiter.take('book', identities) == (True, [])
+    assert limiter.take('book', identities) == (False, ['device'])
+    # Other devices have their own buckets.
+    assert limiter.take('book', {'device': 'd2'}) == (True, [])
+
+
+def test_bucket_refills_over_the_period(limiter):
+    for _ in range(2): limiter.take('book', {'device': 'd1'})
+    limiter.clock[0] += 29
+    assert limiter.take('book', {'device': 'd1'})[0] is False
+    limiter.clock[0] += 1
+    assert limiter.take('book', {'device': 'd1'})[0] is True
+
+
+# A rejected request takes no token from the buckets that still had some.
+def test_rejection_takes_nothing_from_other_buckets(limiter):
+    for _ in range(2): limiter.take('book', {'device': 'd1'})
+    for _ in range(3): assert limiter.take('book', {'ip': '10.0.0.1', 'device': 'd1'}) == (False, ['device'])
+    # The IP bucket (8 tokens) is still full: 8 requests from fresh devices pass, the 9th doesn't.
+    results = [limiter.take('book', {'ip': '10.0.0.1', 'device': f'n{i}'})[0] for i in range(9)]
+    assert results == [True] * 8 + [False]
+
+
+def test_empty_identities_are_skipped(limiter):
+    for _ in range(5): assert limiter.take('book', {'ip': None, 'device': '', 'fingerprint': None}) == (True, [])
+
+
+def test_counters_record_decisions(limiter):
+    for _ in range(3): limiter.take('book', {'device': 'd1'})
+    limiter.counters.record_error()
+    metrics = limiter.counters.metrics()
+    assert metrics['allowed'] == {'book': 2}
+    assert metrics['rejected'] == {'book': 1}
+    assert metrics['rejected_by_identity'] == {'book:device': 1}
+    assert metrics['backend_errors'] == 1
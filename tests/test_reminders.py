@@ -0,0 +1,39 @@
+# Tests for reminders.py: the claim queries built on the pinned client and the send/mark/release bookkeeping.
+
+# --- Standard Library Imports ---
+from datetime import datetime
+
+# --- Local Module Imports ---
+import reminders
+
+
+# Both the candidate read and the claiming UPDATE only match unclaimed rows or claims older than the lease.
+def test_claim_filters_on_expired_or_missing_lease(supabase_client):
+    supabase_client.rows = [{'id': 5}]
+    claimed = reminders.claim_due_reminders(supabase_client, hours_ahead=24, batch_size=10, now=datetime(2026, 3, 1, 8, 0))
+    assert claimed == [{'id': 5}]
+    (_, select_params), (_, update_params) = supabase_client.executed
+    for params in (select_params, update_params):
+        lease = dict(params)['or']
+        assert lease.startswith('(reminder_claimed_at.is.null,reminder_claimed_at.lt."') and lease.endswith('")')
+        assert ('reminder_sent_at', 'is.null') in params
+    assert ('start_at', 'gte.2026-03-01T08:00:00') in select_params and ('limit', '10') in select_params
+    assert ('id', 'in.(5)') in update_params
+    assert set(supabase_client.bodies[1]) == {'reminder_claimed_at'}
+
+
+def test_claim_with_nothing_due_skips_the_update(supabase_client):
+    assert reminders.claim_due_reminders(supabase_client) == []
+    assert len(supabase_client.executed) == 1
+
+
+# Sent reminders are marked; failed ones are released so a later tick retries them.
+def test_send_batch_marks_sent_and_releases_failures(supabase_client):
+    class Sender:
+        def send(self, booking, message):
+            if booking['id'] == 2: raise RuntimeError('gateway down')
+
+    assert reminders.send_reminder_batch(supabase_client, Sender(), [{'id': 1}, {'id': 2}, {'id': 3}]) == (2, 1)
+    (_, mark_params), (_, release_params) = supabase_client.executed
+    assert ('id', 'in.(1,3)') in mark_params and 'reminder_sent_at' in supabase_client.bodies[0]
+    assert ('id', 'in.(2)') in release_params and supabase_client.bodies[1] == {'reminder_claimed_at': None}
@@ -0,0 +1,50 @@
+# Tests for review_feed.py: the (created_at, id) cursor and the page query built on the pinned client.
+
+# --- Standard Library Imports ---
+import base64
+
+# --- Third-Party Imports ---
+import pytest
+
+# --- Local Module Imports ---
+import review_feed
+
+
+def test_cursor_round_trip():
+    cursor = review_feed.encode_cursor('2026-01-08T10:00:00+00:00', 515)
+    assert '=' not in cursor
+    assert review_feed.decode_cursor(cursor) == ('2026-01-08T10:00:00+00:00', 515)
+
+
+@pytest.mark.parametrize('cursor', ['%%%', base64.urlsafe_b64encode(b'2026-01-08|abc').decode(),
+                                    base64.urlsafe_b64encode(b'|5').decode(), base64.urlsafe_b64encode(b'no-separator').decode()])
+def test_decode_cursor_rejects_malformed_input(cursor):
+    with pytest.raises(ValueError):
+        review_feed.decode_cursor(cursor)
+
+
+def test_compact_keeps_displayed_fields():
+    row = {'id': 1, 'reviewer_name': 'Sam', 'rating': 4, 'comment': 'ok', 'created_at': '2026-01-08T10:00:00+00:00'}
+    assert review_feed.compact(row) == {'name': 'Sam', 'rating': 4, 'comment': 'ok', 'date': '2026-01-08'}
+
+
+# First page: no cursor filter, one row more than the page to detect a next page.
+def test_first_page_reads_limit_plus_one(supabase_client):
+    supabase_client.rows = [{'id': 9 - i, 'created_at': f'2026-01-0{9 - i}T10:00:00+00:00'} for i in range(3)]
+    rows, next_cursor = review_feed.fetch_page(supabase_client, 7, limit=2)
+    assert [row['id'] for row in rows] == [9, 8]
+    assert review_feed.decode_cursor(next_cursor) == ('2026-01-08T10:00:00+00:00', 8)
+    params = supabase_client.executed[0][1]
+    assert not any(name == 'or' for name, _ in params)
+    assert ('limit', '3') in params
+
+
+# Later pages: strictly older than the cursor, sorted on the whole (created_at, id) key in one order= parameter.
+def test_next_page_filters_after_cursor(supabase_client):
+    rows, next_cursor = review_feed.fetch_page(supabase_client, 7, after=review_feed.encode_cursor('2026-01-08T10:00:00+00:00', 8))
+    assert rows == [] and next_cursor is None
+    params = supabase_client.executed[0][1]
+    assert ('or', '(created_at.lt."2026-01-08T10:00:00+00:00",'
+                  'and(created_at.eq."2026-01-08T10:00:00+00:00",id.lt.8))') in params
+    assert [value for name, value in params if name == 'order'] == ['created_at.desc,id.desc']
+    assert ('doctor_id', 'eq.7') in params and ('is_approved', 'eq.1') in params